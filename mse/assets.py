@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""This module contains the build step and the handler for static assets.
+
+The pages of the application need a handful of style sheets and scripts.
+`build_assets` bundles them into one style sheet and one script, minifies
+the application's own style sheet, copies the fonts referenced by the style
+sheets and writes all files with the hash of their content in the file name,
+together with a gzip compressed variant, to the 'static/build' directory.
+A manifest maps the bundle names to the built files.
+
+The built files never change, so the 'asset' CherryPy tool serves them with
+far-future cache headers, sending the precompressed variant to clients that
+accept gzip. Templates get the URL of a bundle with tg.asset_url(name),
+which returns None if the assets have not been built.
+
+"""
+
+# symbols which are imported by "from mse.assets import *"
+__all__ = ['BUNDLES', 'add_variables', 'asset_url', 'build_assets',
+           'serve_asset']
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import time
+from cStringIO import StringIO
+from email.utils import formatdate
+
+import cherrypy
+from cherrypy._cptools import HandlerTool
+from cherrypy.lib import static
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), 'static')
+BUILD_DIR = os.path.join(STATIC_DIR, 'build')
+BUILD_URL = '/static/build/'
+MANIFEST = 'manifest.json'
+
+# The files used by the templates, relative to STATIC_DIR, by bundle name,
+# in the order master.html links them: later rules win over earlier ones of
+# the same specificity, so style.css stays in front of bootstrap
+BUNDLES = {
+    'mse.css': ['css/style.css',
+                'css/bootstrap-3.3.2-dist/css/bootstrap.min.css',
+                'css/font-awesome-4.3.0/css/font-awesome.min.css'],
+    'mse.js': ['javascript/jquery/dist/jquery.min.js',
+               'css/bootstrap-3.3.2-dist/js/bootstrap.min.js'],
+}
+
+# Built files are valid for one year
+MAX_AGE = 365 * 24 * 3600
+
+_url_re = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+_source_map_re = re.compile(r'^\s*(//|/\*)# sourceMappingURL=.*$', re.M)
+
+
+def _fingerprint(name, data):
+    """Return name with the hash of data inserted before the extension."""
+    base, ext = os.path.splitext(name)
+    return '%s.%s%s' % (base, hashlib.md5(data).hexdigest()[:12], ext)
+
+
+def _write(name, data):
+    """Write data and a gzip compressed copy of it to BUILD_DIR.
+
+    The compressed copy is left out if it would not be smaller, as for
+    fonts which are compressed already.
+
+    """
+    path = os.path.join(BUILD_DIR, name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    buf = StringIO()
+    # a fixed mtime keeps the compressed file identical between builds
+    f = gzip.GzipFile(name, 'wb', 9, buf, mtime=0)
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    if len(buf.getvalue()) < len(data):
+        with open(path + '.gz', 'wb') as f:
+            f.write(buf.getvalue())
+
+
+def minify_css(css):
+    """Remove comments and needless whitespace from a style sheet."""
+    css = re.sub(r'/\*[^!].*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def _copy_urls(css, source):
+    """Copy the files referenced by a style sheet to BUILD_DIR.
+
+    Returns the style sheet with the references replaced by the names of
+    the fingerprinted copies.
+
+    """
+    def copy(match):
+        url = match.group(2)
+        if url.startswith(('data:', '/', 'http:', 'https:')):
+            return match.group(0)
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        path = os.path.normpath(os.path.join(os.path.dirname(source), path))
+        with open(path, 'rb') as f:
+            data = f.read()
+        name = _fingerprint(os.path.basename(path), data)
+        _write(name, data)
+        return "url('%s%s')" % (name, suffix)
+    return _url_re.sub(copy, css)
+
+
+def build_assets():
+    """Build the bundles and write them and the manifest to BUILD_DIR.
+
+    Returns the manifest, a dictionary mapping bundle names to file names.
+
+    """
+    if os.path.isdir(BUILD_DIR):
+        shutil.rmtree(BUILD_DIR)
+    os.makedirs(BUILD_DIR)
+    manifest = {}
+    for bundle, files in sorted(BUNDLES.items()):
+        parts = []
+        for name in files:
+            source = os.path.join(STATIC_DIR, name)
+            with open(source, 'rb') as f:
+                data = f.read()
+            if bundle.endswith('.css'):
+                if not name.endswith('.min.css'):
+                    data = minify_css(data)
+                data = _copy_urls(data, source)
+            # source maps are not part of the build
+            data = _source_map_re.sub('', data)
+            parts.append(data.strip())
+        # scripts are joined with a semicolon in case one lacks the last one
+        data = (bundle.endswith('.js') and ';\n' or '\n').join(parts) + '\n'
+        manifest[bundle] = _fingerprint(bundle, data)
+        _write(manifest[bundle], data)
+    with open(os.path.join(BUILD_DIR, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    _manifest.clear()
+    return manifest
+
+
+_manifest = {}
+
+
+def asset_url(bundle):
+    """Return the URL of the built bundle or None if it has not been built."""
+    path = os.path.join(BUILD_DIR, MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    if _manifest.get('mtime') != mtime:
+        with open(path) as f:
+            _manifest.update(files=json.load(f), mtime=mtime)
+    name = _manifest['files'].get(bundle)
+    return name and BUILD_URL + name
+
+
+def add_variables(variables):
+    """Make asset_url available in templates as tg.asset_url."""
+    variables['asset_url'] = asset_url
+
+
+def serve_asset(dir, debug=False):
+    """Serve a built file with far-future cache headers.
+
+    Clients which accept gzip get the precompressed variant of the file.
+    Returns True if the file has been served.
+
+    """
+    request = cherrypy.serving.request
+    response = cherrypy.serving.response
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    name = os.path.basename(request.path_info)
+    path = os.path.join(dir, name)
+    if not name or name == MANIFEST or not os.path.isfile(path):
+        return False
+    response.headers['Cache-Control'] = 'public, max-age=%d' % MAX_AGE
+    response.headers['Expires'] = formatdate(time.time() + MAX_AGE,
+                                             usegmt=True)
+    response.headers['Vary'] = 'Accept-Encoding'
+    encodings = [e.value for e in request.headers.elements('Accept-Encoding')
+                 if e.qvalue > 0]
+    if 'gzip' in encodings and os.path.isfile(path + '.gz'):
+        static.serve_file(path + '.gz', mimetypes.guess_type(name)[0]
+                          or 'application/octet-stream')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        static.serve_file(path)
+    return True
+
+cherrypy.tools.asset = HandlerTool(serve_asset)
@@ -1,12 +1,26 @@
 from myAlgorithms.ScoringAlgorithms import *
+from turbogears import config
 from turbogears.database import PackageHub
 from datetime import datetime
 from mse import model
+from mse.database import insert_many, transaction
+from mse import library, metrics
+from mse.myAlgorithms.MassIndex import decoyShifts, peakWeights
+from mse.myAlgorithms.PeakPicking import searchPeaks
+from mse.registry import collect_garbage, current_versions, search_index
+from collections import OrderedDict
+import hashlib
+import logging
 import threading
 import traceback
 
 __connection__ = hub = PackageHub('mse')
 cleanupLock = threading.Lock()
+log = logging.getLogger('mse.async')
+
+# Candidate sets of recently searched spectra, see matchCandidates
+candidateLock = threading.Lock()
+candidateCache = OrderedDict()
 
 
 def MicroorganismIdentification():
@@ -19,38 +33,134 @@ def MicroorganismIdentification():
             except IndexError:
                 break
 
-            hub.begin()
-            s.status = 'Running'
-            hub.commit()
-            startTime = datetime.now()
-
-            spectrum = readInput(s.query)
-            db = SelectFastaFile(s.database)
-            filteredSeqs = fastaFilter(db, s.min_mass, s.max_mass)
-            result, dbSize = resultTable(spectrum, filteredSeqs, s.mass_tolerance, s.spec_mode)
-            score = matchNum(result)
-            output = sortbyMatch(score)
-            for microbe, hit in output:
-                bigK = len(spectrum)    # Number of peaks in the unknown spectrum
-                k = hit                 # Number of peaks that match
-                n = dbSize[microbe]     # Number of sequences in each microorganisms
-                bigN = len(dbSize)      # Number of microorganisms in the sequence file
-                nstar = (s.max_mass - s.min_mass) / (2 * s.mass_tolerance)
-
-                pvalue, evalue = pValue(bigK, k, n, nstar, bigN)
-                pvalue = float('%.3g' % pvalue)  # Trim the number of significant figure to 3
-                evalue = float('%.3g' % evalue)
-                model.ResultList(microorganism_name=microbe, matching_hit=hit,
-                                 p_value=pvalue, e_value=evalue, search=s)
-
-            s.status = 'Done'
-            hub.commit()
-
-            endTime = datetime.now()
-            runningTime = endTime - startTime
-            print runningTime
+            metrics.worker_busy.set(1)
+            try:
+                runSearch(s)
+            except Exception:
+                # a failed search must not block the searches queued after it
+                metrics.search_failures.inc()
+                log.exception("Search %d failed.", s.id)
+                with transaction(write=True):
+                    s.set(status='Failed', completed=datetime.now())
+            finally:
+                metrics.worker_busy.set(0)
+            collect_garbage()
     except Exception, e:
         traceback.print_exc(e)
         raise
     finally:
+        metrics.worker_busy.set(0)
         cleanupLock.release()
+
+
+def runSearch(s):
+    """Run the queued search s and write its results."""
+    startTime = datetime.now()
+    # the database releases are fixed when the search starts; finding them
+    # may publish a release, which takes long, so the write lock is taken
+    # only afterwards
+    versions = current_versions(s.database)
+    with transaction(write=True):
+        s.set(status='Running', started=startTime, db_version=versions)
+    metrics.search_wait_seconds.observe(_seconds(startTime - s.created))
+
+    rows, matches = searchResults(s)
+
+    # Write all results and the new status in one short transaction
+    with metrics.stage_seconds.time(stage='write'):
+        with transaction(write=True):
+            insert_many(model.ResultList, rows)
+            insert_many(model.LibraryMatch, matches)
+            if s.add_to_library:
+                library.add_search(s, rows)
+            s.set(status='Done', completed=datetime.now())
+
+    runningTime = _seconds(datetime.now() - startTime)
+    metrics.results_written.inc(len(rows))
+    metrics.search_run_seconds.observe(runningTime)
+    metrics.worker_busy_seconds.inc(runningTime)
+    log.info("Search %d done in %.3fs, %d results.",
+             s.id, runningTime, len(rows))
+
+
+def searchResults(s):
+    """Run the search s.
+
+    Returns its results as rows for ResultList and the similar spectra of
+    the spectral library as rows for LibraryMatch.
+    """
+    stage = metrics.stage_seconds.time
+    with stage(stage='read_input'):
+        # profile spectra are reduced to their peaks first
+        spectrum, intensities = searchPeaks(s.query, s.peak_picking)
+        weights = peakWeights(intensities, s.weighting)
+    with stage(stage='library'):
+        # known isolates are recognized without searching the databases
+        matches = library.lookup(s, spectrum, intensities)
+    with stage(stage='read_database'):
+        # one index of all selected databases, searched in a single pass
+        index = search_index(s.db_version)
+    with stage(stage='match'):
+        candidates = matchCandidates(s, index, spectrum)
+        # all ranks are scored from the matches of a single pass
+        ranks = index.scoreCandidates(candidates, s.min_mass, s.max_mass,
+                                      s.mass_tolerance, s.tolerance_unit,
+                                      weights=weights)
+    significance = None
+    if s.decoys:
+        with stage(stage='decoys'):
+            significance = index.empiricalSignificance(spectrum, s.min_mass,
+                s.max_mass, s.mass_tolerance, s.spec_mode, s.tolerance_unit,
+                dict((rank, ranks[rank][0]) for rank in ranks),
+                decoyShifts(s.decoys))
+    with stage(stage='score'):
+        nstar = nStar(s.min_mass, s.max_mass, s.mass_tolerance,
+                      s.tolerance_unit)
+        rows = rankResults(ranks, len(spectrum), nstar, weights is not None,
+                           significance)
+        for row in rows:
+            row['search'] = s
+    return rows, matches
+
+
+def matchCandidates(s, index, spectrum):
+    """Return the candidate matches of the spectrum of search s.
+
+    The candidates found for a spectrum are kept for the widest tolerance
+    and mass range it was searched with so far, so searching it again with
+    narrower parameters (as users do to tune their results) only rescores
+    them. The last 'mse.candidate_cache.size' (default: 32) spectra are
+    kept, per combination of peak picking, database versions and mass spec
+    mode.
+    """
+    key = (hashlib.sha1(s.query.encode('utf-8')).hexdigest(), s.peak_picking,
+           s.db_version, s.spec_mode)
+    with candidateLock:
+        candidates = candidateCache.pop(key, None)
+    if candidates is not None and candidates.covers(
+            s.min_mass, s.max_mass, s.mass_tolerance, s.tolerance_unit):
+        metrics.candidate_cache.inc(result='hit')
+    else:
+        metrics.candidate_cache.inc(result='miss')
+        candidates = index.matchPeaks(spectrum, s.min_mass, s.max_mass,
+            s.mass_tolerance, s.spec_mode, s.tolerance_unit, widen=candidates)
+    size = int(config.get('mse.candidate_cache.size', 32))
+    with candidateLock:
+        candidateCache[key] = candidates
+        while len(candidateCache) > size:
+            candidateCache.popitem(last=False)
+    return candidates
+
+
+def _seconds(delta):
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+
+def startIdentification():
+    """Process the queued searches in a background thread.
+
+    Does nothing if a thread is already processing the queue.
+    """
+    t = threading.Thread(target=MicroorganismIdentification)
+    t.daemon = True
+    t.start()
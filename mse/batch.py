@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""This module contains the offline batch search.
+
+`run_batch` searches many spectrum files (in the formats read by
+mse.myAlgorithms.SpectrumFiles) against a reference database without the
+web application: no database of users and searches is needed.
+The database is the key of a configured reference database (see
+mse.registry, its current release is searched), a FASTA file or a saved
+MassIndex file. The spectra are searched in parallel worker processes,
+which load the index once, and the results of every file are written as
+soon as it is done:
+
+- as TSV, a header and one row per spectrum, matching taxon and rank, or
+- as JSON lines, one object per spectrum with its file name, title,
+  number of peaks and results.
+
+Next to the output file, a progress file ('<output>.progress') records the
+size of the output after every file. A batch which was interrupted is
+resumed by running it again with resume=True: the output is truncated to
+the last file done completely and only the remaining files are searched.
+
+Run it with the 'batch-mse' command.
+
+"""
+
+# symbols which are imported by "from mse.batch import *"
+__all__ = ['BatchError', 'FORMATS', 'TSV_COLUMNS', 'open_database',
+           'run_batch', 'search_file', 'spectrum_files']
+
+import csv
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+from cStringIO import StringIO
+
+FORMATS = ('tsv', 'json')
+
+TSV_COLUMNS = ['file', 'spectrum', 'rank', 'source', 'microorganism_name',
+               'matching_hit', 'weighted_score', 'p_value', 'e_value',
+               'empirical_p_value', 'q_value']
+
+_worker = {}    # the index and search parameters of a worker process
+
+
+class BatchError(Exception):
+    """A batch search cannot be run."""
+
+
+def spectrum_files(patterns):
+    """Return the spectrum files named by directories or glob patterns.
+
+    A directory stands for the files directly in it, except hidden ones.
+    The files are sorted per pattern and returned once each.
+    """
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matched = [os.path.join(pattern, name)
+                       for name in os.listdir(pattern)
+                       if not name.startswith('.')]
+        else:
+            matched = glob.glob(pattern)
+        matched = sorted(path for path in matched if os.path.isfile(path))
+        if not matched:
+            raise BatchError("No spectrum files in %s" % pattern)
+        files.extend(matched)
+    seen = set()
+    return [path for path in files
+            if not (path in seen or seen.add(path))]
+
+
+def open_database(name, directory):
+    """Return the path of the index file of the database name.
+
+    name is a saved MassIndex ('.npz'), a FASTA file, whose index is built
+    into directory, or the key or title of a configured reference database.
+    """
+    from mse.myAlgorithms.MassIndex import buildIndex
+    if os.path.isfile(name):
+        if name.endswith('.npz'):
+            return name
+        index_file = os.path.join(directory, 'index.npz')
+        buildIndex(name, os.path.splitext(os.path.basename(name))[0],
+                   dict(path=os.path.abspath(name))).save(index_file)
+        return index_file
+    from mse import registry
+    db = registry.find_database(name)
+    if db is None:
+        raise BatchError("Unknown database: %s" % name)
+    return os.path.join(db.index_dir, db.current_version(),
+                        registry.INDEX_FILE)
+
+
+def _init_worker(index_file, options):
+    if 'index' in _worker:
+        # forked from the main process, which loaded the index already
+        return
+    from mse.myAlgorithms.MassIndex import loadIndex
+    index = loadIndex(index_file)
+    if index is None:
+        raise BatchError("%s has an outdated format" % index_file)
+    _worker.update(index=index, options=options)
+
+
+def search_file(path):
+    """Search the spectra of the file path with the index of the worker.
+
+    Returns (path, spectra, error message); spectra is a list of (title,
+    number of peaks, result rows) tuples, the rows are the dictionaries of
+    ScoringAlgorithms.rankResults.
+    """
+    from mse.myAlgorithms.MassIndex import decoyShifts, peakWeights
+    from mse.myAlgorithms.PeakPicking import pickPeaks
+    from mse.myAlgorithms.ScoringAlgorithms import nStar, rankResults
+    from mse.myAlgorithms.SpectrumFiles import readSpectra
+    index, options = _worker['index'], _worker['options']
+    nstar = nStar(options.min_mass, options.max_mass, options.tolerance,
+                  options.unit)
+    shifts = decoyShifts(options.decoys)
+    spectra = []
+    try:
+        with open(path, 'rb') as f:
+            for title, spectrum, intensities in readSpectra(f, path):
+                if options.peak_picking:
+                    if intensities is None:
+                        raise ValueError("Spectrum %s has no intensities to "
+                                         "pick the peaks of" % title)
+                    spectrum, intensities = pickPeaks(spectrum, intensities,
+                                                      options.snr)
+                weights = peakWeights(intensities, options.weighting)
+                ranks = index.searchRanks(spectrum, options.min_mass,
+                    options.max_mass, options.tolerance, options.mode,
+                    options.unit, weights=weights)
+                significance = None
+                if options.decoys:
+                    significance = index.empiricalSignificance(spectrum,
+                        options.min_mass, options.max_mass, options.tolerance,
+                        options.mode, options.unit, dict((rank, ranks[rank][0])
+                        for rank in ranks), shifts)
+                spectra.append((title, len(spectrum), rankResults(ranks,
+                    len(spectrum), nstar, weights is not None, significance)))
+    except (EnvironmentError, SyntaxError, ValueError), e:
+        return path, [], str(e)
+    return path, spectra, None
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _format(output_format, path, spectra):
+    buf = StringIO()
+    writer = csv.writer(buf, delimiter='\t', lineterminator='\n')
+    for title, peaks, rows in spectra:
+        if output_format == 'json':
+            buf.write(json.dumps(dict(file=path, spectrum=title, peaks=peaks,
+                                      results=rows)) + '\n')
+            continue
+        for row in rows:
+            writer.writerow([path, _encode(title)] + [_encode(row[column])
+                for column in TSV_COLUMNS[2:]])
+    return buf.getvalue()
+
+
+def _read_progress(progress_file):
+    """Return the (output size, file) entries recorded by a batch."""
+    entries = []
+    try:
+        with open(progress_file) as f:
+            for line in f:
+                # the last line is incomplete if the batch was killed
+                if line.endswith('\n'):
+                    offset, path = line[:-1].split('\t', 1)
+                    entries.append((int(offset), path))
+    except IOError:
+        pass
+    return entries
+
+
+def run_batch(database, files, options, output=None, resume=False,
+              log=sys.stderr):
+    """Search the spectrum files against database and write the results.
+
+    options has the attributes of the options of the 'batch-mse' command
+    (min_mass, max_mass, tolerance, unit, mode, weighting, peak_picking,
+    snr, decoys, format and processes). The results are written to the
+    file output, or to stdout.
+    Returns the number of files which could not be searched; their errors
+    are printed to log.
+    """
+    if resume and not output:
+        raise BatchError("Only batches written to a file can be resumed.")
+    if options.format not in FORMATS:
+        raise BatchError("Unknown output format: %s" % options.format)
+    progress_file = output and output + '.progress'
+    entries = []
+    if resume:
+        entries = _read_progress(progress_file)
+    size = entries and entries[-1][0] or 0
+    done = set(path for offset, path in entries)
+    if size and not (os.path.exists(output) and
+                     os.path.getsize(output) >= size):
+        raise BatchError("%s is shorter than recorded in %s."
+                         % (output, progress_file))
+    todo = [path for path in files if os.path.abspath(path) not in done]
+    if len(todo) < len(files):
+        print >> log, "Resuming: %d of %d files done." % (
+            len(files) - len(todo), len(files))
+    if output:
+        out = open(output, 'r+b' if size else 'wb')
+        out.truncate(size)
+        out.seek(size)
+        progress = open(progress_file, 'wb')
+        progress.writelines('%d\t%s\n' % entry for entry in entries)
+    else:
+        out, progress = sys.stdout, None
+    directory = tempfile.mkdtemp(prefix='mse-batch-')
+    pool = None
+    failed = 0
+    try:
+        index_file = open_database(database, directory)
+        _init_worker(index_file, options)
+        if not size and options.format == 'tsv':
+            out.write('\t'.join(TSV_COLUMNS) + '\n')
+        if options.processes == 1 or len(todo) < 2:
+            results = itertools.imap(search_file, todo)
+        else:
+            pool = multiprocessing.Pool(options.processes or None,
+                                        _init_worker, (index_file, options))
+            results = pool.imap_unordered(search_file, todo)
+        for path, spectra, error in results:
+            if error:
+                print >> log, "%s: %s" % (path, error)
+                failed += 1
+                continue
+            out.write(_format(options.format, path, spectra))
+            out.flush()
+            if progress:
+                # the file counts as done once its rows are written
+                progress.write('%d\t%s\n' % (out.tell(),
+                                             os.path.abspath(path)))
+                progress.flush()
+        if pool:
+            pool.close()
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+        _worker.clear()
+        shutil.rmtree(directory, ignore_errors=True)
+        if progress:
+            progress.close()
+            out.close()
+    print >> log, "%d files searched, %d failed." % (
+        len(todo) - failed, failed)
+    return failed
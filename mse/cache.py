@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""This module contains helpers for caching pages that rarely change.
+
+`validate_conditional` answers conditional GET requests with "304 Not
+Modified" when the client's copy of a page is still current, and
+`cached_page` keeps the rendered output of exposed controller methods in
+a `RenderCache`, so that a page is rendered only once. A cached page may
+depend on files, like its templates; it is rendered again as soon as the
+modification time of one of them changes.
+
+"""
+
+# symbols which are imported by "from mse.cache import *"
+__all__ = ['RenderCache', 'cached_page', 'validate_conditional']
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+
+import cherrypy
+from cherrypy.lib import cptools
+from turbogears.decorator import weak_signature_decorator
+
+# Pages rendered by an older version of the application may look different,
+# so the start time of the process is part of every validator.
+_started = time.time()
+
+
+class RenderCache(object):
+    """A thread-safe cache of rendered pages.
+
+    Holds at most max_entries pages with a total length of at most
+    max_bytes (if not None) and evicts the least recently used pages when
+    it is full. Pages longer than a quarter of max_bytes are not cached.
+    """
+
+    def __init__(self, max_entries=200, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = self.misses = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, key):
+        """Return the page cached under key or None.
+
+        A page is dropped from the cache if one of the files it depends on
+        has been modified since it was cached.
+        """
+        self._lock.acquire()
+        try:
+            try:
+                page, files = self._pages.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if any(_mtime(path) != mtime for path, mtime in files):
+                self.size -= len(page)
+                self.misses += 1
+                return None
+            self._pages[key] = page, files
+            self.hits += 1
+            return page
+        finally:
+            self._lock.release()
+
+    def set(self, key, page, files=()):
+        """Cache page under key.
+
+        files are the paths of the files the page depends on.
+        """
+        # take the modification times before the lock, stat may be slow
+        files = tuple((path, _mtime(path)) for path in files)
+        if self.max_bytes is not None and len(page) * 4 > self.max_bytes:
+            return
+        self._lock.acquire()
+        try:
+            old = self._pages.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._pages[key] = page, files
+            self.size += len(page)
+            while len(self._pages) > self.max_entries or (
+                    self.max_bytes is not None and self.size > self.max_bytes):
+                self.size -= len(self._pages.popitem(last=False)[1][0])
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Remove all pages from the cache."""
+        self._lock.acquire()
+        try:
+            self._pages.clear()
+            self.size = 0
+        finally:
+            self._lock.release()
+
+
+def _mtime(path):
+    """Return the modification time of a file or None if it does not exist."""
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def cached_page(cache, key, files=()):
+    """Cache the output of an exposed controller method in cache.
+
+    This decorator must be applied on top of the expose decorator, so that
+    it gets to see the rendered page. 'key' is called with the arguments
+    of the method and returns the key of the page in the cache, or None if
+    the page must not be cached (it is then rendered as usual). Only pages
+    with status "200 OK" are cached, and none are served from the cache
+    while a flash message is pending. 'files' are the paths of the files
+    (templates, texts) the page depends on.
+
+    """
+    def entangle(func):
+        def cached(func, *args, **kw):
+            if 'tg_flash' in cherrypy.request.cookie:
+                return func(*args, **kw)
+            k = key(*args, **kw)
+            if k is None:
+                return func(*args, **kw)
+            page = cache.get(k)
+            if page is None:
+                page = func(*args, **kw)
+                status = str(cherrypy.response.status or 200)
+                if isinstance(page, basestring) and status.startswith('200'):
+                    cache.set(k, page, files)
+            return page
+        return cached
+    return weak_signature_decorator(entangle)
+
+
+def validate_conditional(tag, last_modified):
+    """Answer a conditional GET for a resource which only changes with tag.
+
+    Sets the ETag, Last-Modified and Cache-Control headers of the response
+    and raises "304 Not Modified" if the client's copy is still current.
+    last_modified is the time of the last modification in seconds since
+    the epoch.
+
+    """
+    headers = cherrypy.response.headers
+    headers['ETag'] = '"%s-%x"' % (tag, int(_started))
+    headers['Last-Modified'] = formatdate(max(last_modified, _started),
+                                          usegmt=True)
+    headers['Cache-Control'] = 'private, max-age=0, must-revalidate'
+    cptools.validate_etags()
+    cptools.validate_since()
@@ -3,13 +3,16 @@
 """
 
 # symbols which are imported by "from mse.command import *"
-__all__ = ['bootstrap', 'ConfigurationError', 'start']
+__all__ = ['archive', 'batch_search', 'bootstrap', 'build_assets',
+    'ConfigurationError', 'import_report', 'loadtest', 'publish_database', 'start']
 
 import sys
 import optparse
 
+from datetime import timedelta
+
 from os import getcwd
-from os.path import dirname, exists, join
+from os.path import dirname, exists, isfile, join
 
 import pkg_resources
 try:
@@ -79,13 +82,88 @@ def _read_config(args):
     turbogears.update_config(configfile=configfile,
         modulename='mse.config')
 
+def batch_search():
+    """Search many spectrum files without the web application.
+
+    Searches the spectrum files in directories or matching glob patterns
+    against a reference database in parallel processes and writes the
+    results as TSV or JSON lines as every spectrum is done. An interrupted
+    batch is resumed with --resume, see mse.batch for details:
+
+        'batch-mse = mse.command:batch_search',
+
+    """
+
+    from mse import batch
+    from mse.myAlgorithms.PeakPicking import SNR
+    from mse.myAlgorithms.ScoringAlgorithms import WEIGHTINGS
+    optparser = optparse.OptionParser(
+        usage="%prog [options] database spectra...",
+        description="Search the spectrum files in the given directories or "
+        "matching the given glob patterns against a database: the key of a "
+        "configured reference database, a FASTA file or an index file.",
+        version="mse %s" % version)
+    optparser.add_option('-o', '--output', dest="output",
+        help="File to write the results to (default: stdout).")
+    optparser.add_option('-f', '--format', dest="format", default="tsv",
+        choices=batch.FORMATS, help="Output format, tsv or json (default: "
+        "%default).")
+    optparser.add_option('-r', '--resume', dest="resume", action="store_true",
+        default=False, help="Resume an interrupted batch writing to the "
+        "same output file.")
+    optparser.add_option('-j', '--processes', dest="processes", type="int",
+        default=0, help="Number of worker processes (default: one per CPU).")
+    optparser.add_option('--min-mass', dest="min_mass", type="float",
+        default=4000, help="Min. protein mass (default: %default).")
+    optparser.add_option('--max-mass', dest="max_mass", type="float",
+        default=15000, help="Max. protein mass (default: %default).")
+    optparser.add_option('-t', '--tolerance', dest="tolerance", type="float",
+        default=2, help="Mass tolerance (default: %default).")
+    optparser.add_option('-u', '--unit', dest="unit", default="Da",
+        choices=["Da", "ppm"], help="Unit of the mass tolerance, Da or ppm "
+        "(default: %default).")
+    optparser.add_option('-m', '--mode', dest="mode", default="Positive",
+        choices=["Positive", "Negative"], help="Mass spec mode (default: "
+        "%default).")
+    optparser.add_option('-w', '--weighting', dest="weighting",
+        default="none", choices=list(WEIGHTINGS), help="Peak weighting, "
+        "one of %s (default: %%default)." % ', '.join(WEIGHTINGS))
+    optparser.add_option('-p', '--pick-peaks', dest="peak_picking",
+        action="store_true", default=False, help="Pick the peaks of profile "
+        "spectra before searching them.")
+    optparser.add_option('--snr', dest="snr", type="float", default=SNR,
+        help="Min. signal to noise ratio of picked peaks (default: "
+        "%default).")
+    optparser.add_option('-d', '--decoys', dest="decoys", type="int",
+        default=0, help="Number of decoy spectra to estimate empirical "
+        "p-values and q-values from (default: %default).")
+    optparser.add_option('-c', '--config', dest="config",
+        help="Configuration file defining the reference databases.")
+    options, args = optparser.parse_args()
+    if len(args) < 2:
+        optparser.error("No database or no spectra given.")
+    if options.decoys < 0:
+        optparser.error("The number of decoys must not be negative.")
+    if not isfile(args[0]):
+        _read_config(filter(None, [options.config]))
+    try:
+        files = batch.spectrum_files(args[1:])
+        failed = batch.run_batch(args[0], files, options, options.output,
+                                 options.resume)
+    except batch.BatchError, e:
+        optparser.error(str(e))
+    if failed:
+        sys.exit(1)
+
 def bootstrap():
     """Example function for loading bootstrap data into the database
 
     You can adapt this to your needs to e.g. accept more options or to
     run more functions for bootstrapping other parts of your application.
     By default this runs the function 'mse.model.bootstrap_model', which
-    creates all database tables and optionally adds a user.
+    creates all database tables and optionally adds a user. Run it after
+    upgrading, too: it adds the columns new in the model to the existing
+    tables.
 
     The following line in your project's 'setup.py' file takes care of
     installing a command line script when you install your application via
@@ -110,11 +188,216 @@ def bootstrap():
     from mse.model import bootstrap_model
     bootstrap_model(options.clean, options.user)
 
+def archive():
+    """Archive the results of old finished searches.
+
+    Packs the ResultList rows of every finished search older than the given
+    number of days into a compressed ResultArchive and deletes the expanded
+    rows in batches. Run this periodically (e.g. from cron) to keep the
+    ResultList table small:
+
+        'archive-mse = mse.command:archive',
+
+    """
+
+    optparser = optparse.OptionParser(usage="%prog [options] [config-file]",
+        description="Archive the results of old finished searches in the "
+        "database defined in config-file.", version="mse %s" % version)
+    optparser.add_option('-d', '--days', dest="days", type="int", default=30,
+        help="Archive searches created more than DAYS days ago "
+        "(default: %default).")
+    optparser.add_option('-b', '--batch-size', dest="batch_size", type="int",
+        default=1000, help="Delete at most BATCH_SIZE result rows per "
+        "transaction (default: %default).")
+    options, args = optparser.parse_args()
+    _read_config(args)
+    # shares the database file with the running server
+    from mse.database import configure_database
+    configure_database()
+    from mse.model import archive_results
+    count = archive_results(timedelta(days=options.days), options.batch_size)
+    print "%d search(es) archived." % count
+
+def build_assets():
+    """Bundle, fingerprint and precompress the static assets.
+
+    Writes the bundles used by the templates to 'mse/static/build', see
+    mse.assets for details. Run this after changing any of the bundled
+    style sheets or scripts:
+
+        'build-assets-mse = mse.command:build_assets',
+
+    """
+
+    optparser = optparse.OptionParser(usage="%prog",
+        description="Build the static asset bundles of the application.",
+        version="mse %s" % version)
+    optparser.parse_args()
+    from mse import assets
+    for bundle, name in sorted(assets.build_assets().items()):
+        print "%s -> %s" % (bundle, join(assets.BUILD_DIR, name))
+
+def loadtest():
+    """Measure how many clients and searches the application handles.
+
+    Starts the application against a scratch database and lets simulated
+    clients sign up and use it, see mse.loadtest for details:
+
+        'loadtest-mse = mse.command:loadtest',
+
+    """
+
+    from mse import loadtest
+    optparser = optparse.OptionParser(usage="%prog [options]",
+        description="Run a load test against a scratch instance of the "
+        "application.", version="mse %s" % version)
+    optparser.add_option('-c', '--clients', dest="clients", type="int",
+        default=10, help="Number of simulated clients (default: %default).")
+    optparser.add_option('-n', '--requests', dest="requests", type="int",
+        default=50, help="Requests per client (default: %default).")
+    optparser.add_option('-d', '--duration', dest="duration", type="float",
+        default=0, help="Run for DURATION seconds instead of a fixed number "
+        "of requests.")
+    optparser.add_option('-m', '--mix', dest="mix",
+        default=loadtest.DEFAULT_MIX, help="Weights of the requested pages "
+        "(default: %default).")
+    optparser.add_option('-t', '--think', dest="think", type="float",
+        default=0, help="Mean think time of a client between two requests "
+        "in seconds (default: %default).")
+    optparser.add_option('--database', dest="database",
+        help="Comma separated keys of the databases to search (default: "
+        "the databases searched by default).")
+    optparser.add_option('--spectrum', dest="spectrum",
+        help="File with the peak masses to search for. By default every "
+        "search uses random masses.")
+    optparser.add_option('--peaks', dest="peaks", type="int", default=30,
+        help="Number of random peaks per search (default: %default).")
+    optparser.add_option('--min-mass', dest="min_mass", type="float",
+        default=4000, help="Min. mass of the searches (default: %default).")
+    optparser.add_option('--max-mass', dest="max_mass", type="float",
+        default=15000, help="Max. mass of the searches (default: %default).")
+    optparser.add_option('--tolerance', dest="tolerance", type="float",
+        default=2, help="Mass tolerance of the searches (default: %default).")
+    optparser.add_option('-p', '--port', dest="port", type="int", default=0,
+        help="Port of the server (default: a free port).")
+    optparser.add_option('--timeout', dest="timeout", type="float",
+        default=60, help="Timeout of a request in seconds (default: "
+        "%default).")
+    optparser.add_option('--startup-timeout', dest="startup_timeout",
+        type="float", default=60, help="Seconds to wait for the server to "
+        "start (default: %default).")
+    optparser.add_option('--drain-timeout', dest="drain_timeout",
+        type="float", default=600, help="Seconds to wait for the search "
+        "queue to drain after the load (default: %default).")
+    optparser.add_option('-k', '--keep', dest="keep", action="store_true",
+        default=False, help="Keep the scratch database and server log.")
+    options, args = optparser.parse_args()
+    try:
+        loadtest.parse_mix(options.mix)
+    except ValueError, e:
+        optparser.error(str(e))
+    if not loadtest.run_load_test(options):
+        sys.exit(1)
+
+def publish_database():
+    """Publish a new release of a reference database.
+
+    Builds the mass index of the FASTA file of a database (see mse.registry)
+    and makes it the current version, which searches started afterwards
+    use. Old releases no longer used by running searches are deleted:
+
+        'publish-db-mse = mse.command:publish_database',
+
+    """
+
+    optparser = optparse.OptionParser(
+        usage="%prog [options] database [config-file]",
+        description="Publish a new release of the reference database with "
+        "the given key.", version="mse %s" % version)
+    optparser.add_option('-f', '--fasta', dest="fasta",
+        help="FASTA file to publish (default: the configured path).")
+    optparser.add_option('-V', '--db-version', dest="db_version",
+        help="Version name of the release (default: date, time and hash).")
+    optparser.add_option('-c', '--current', dest="current",
+        help="Make the existing version CURRENT current again instead.")
+    optparser.add_option('-l', '--list', dest="list", action="store_true",
+        default=False, help="List the versions on disk.")
+    options, args = optparser.parse_args()
+    if not args:
+        optparser.error("No database given.")
+    _read_config(args[1:])
+    from mse import registry
+    db = registry.find_database(args[0].decode(sys.getfilesystemencoding()))
+    if db is None:
+        optparser.error("Unknown database: %s" % args[0])
+    if options.list:
+        for v in db.versions():
+            print v
+        return
+    try:
+        if options.current:
+            db.set_current(options.current)
+        else:
+            print db.publish(options.fasta, options.db_version)
+    except ValueError, e:
+        optparser.error(str(e))
+    count = registry.collect_garbage()
+    if count:
+        print "%d old version(s) deleted." % count
+
+def import_report():
+    """Report the import time of the web application.
+
+    Imports the controllers (or another module) in a new process, prints
+    the slowest imports and exits with status 1 if the import took longer
+    than the budget or loaded numpy, scipy or Biopython, see mse.importtime
+    for details:
+
+        'import-report-mse = mse.command:import_report',
+
+    """
+
+    from mse import importtime
+    optparser = optparse.OptionParser(usage="%prog [options] [config-file]",
+        description="Report the time it takes to import the application.",
+        version="mse %s" % version)
+    optparser.add_option('-m', '--module', dest="module",
+        default=importtime.DEFAULT_MODULE,
+        help="Module to import (default: %default).")
+    optparser.add_option('-n', '--top', dest="top", type="int", default=20,
+        help="Number of imports listed (default: %default).")
+    optparser.add_option('-b', '--budget', dest="budget", type="float",
+        help="Maximal import time in seconds.")
+    optparser.add_option('--allow-heavy', dest="allow_heavy",
+        action="store_true", default=False,
+        help="Do not fail if numpy, scipy or Biopython are loaded.")
+    options, args = optparser.parse_args()
+    try:
+        timings = importtime.measure(options.module, (args or [None])[0])
+    except RuntimeError, e:
+        optparser.error(str(e))
+    heavy = importtime.HEAVY_MODULES
+    if options.allow_heavy:
+        heavy = []
+    if not importtime.report(timings, top=options.top, budget=options.budget,
+                             heavy=heavy):
+        sys.exit(1)
+
 def start():
     """Start the CherryPy application server."""
 
     _read_config(sys.argv[1:])
 
+    from mse.database import configure_database, instrument_queries
+    configure_database()
+    instrument_queries()
+    from mse import sqlprofile
+    sqlprofile.install()
+
+    # Delete expired visits periodically
+    from mse.visitmanager import schedule_cleanup
+    turbogears.startup.call_on_startup.append(schedule_cleanup)
+
     # Running the async task
     #from mse import async
     #turbogears.startup.call_on_startup.append(async.schedule)
@@ -5,22 +5,41 @@
 __all__ = ['Root']
 
 # standard library imports
+import hashlib
 import os.path
+import json
+import time
 # import logging
 
 # log = logging.getLogger('mse.controllers')
 
 # third-party imports
-from cherrypy import request
+import cherrypy
+from cherrypy import request, response
 from sqlobject import SQLObjectNotFound
+from sqlobject.sqlbuilder import AND, IN
 from turbogears import controllers, expose, identity, redirect, visit, paginate
-from turbogears import widgets, error_handler, validators, validate
+from turbogears import config
+from turbogears import widgets, error_handler, validators, validate, view
 from turbogears.toolbox.catwalk import CatWalk
-import threading
 
 # project specific imports
 from mse.model import VisitIdentity
-from async import *
+from mse import jsonify # registers the JSON rules for the model classes
+from mse.cache import RenderCache, cached_page, validate_conditional
+from mse.export import export_results, gzip_stream
+from mse import assets # registers the CherryPy tool serving built assets
+from mse import metrics, model, registry
+# only the light functions of the algorithms, which load no scientific stack
+from mse.myAlgorithms.ScoringAlgorithms import RANKS, WEIGHTINGS, readPeaks
+
+
+# Maximal number of decoy spectra of a search, which bounds the extra time
+# the empirical significance takes
+MAX_DECOYS = 1000
+
+# make tg.asset_url available in the templates
+view.variable_providers.append(assets.add_variables)
 
 
 # logging in after successfully registering a new user
@@ -70,29 +89,184 @@ class RegistrationFieldsSchema(validators.Schema):
     chained_validators = [validators.FieldsMatch('password', 'confirmPassword')]
 
 
+class DatabaseList(validators.FancyValidator):
+    """Convert one or many reference database keys to a list of keys.
+
+    Accepts a list or a comma separated string of keys or titles (searches
+    used to store the title of their single database).
+    """
+
+    messages = {'unknown': "Unknown database: %(name)s"}
+
+    def _to_python(self, value, state):
+        if isinstance(value, basestring):
+            value = value.split(',')
+        keys = []
+        for name in value:
+            db = registry.find_database(name.strip())
+            if db is None:
+                raise validators.Invalid(
+                    self.message('unknown', state, name=name), value, state)
+            if db.key not in keys:
+                keys.append(db.key)
+        return keys
+
+
+class PeakList(validators.UnicodeString):
+    """Check that a spectrum can be read as a peak list (see readPeaks)."""
+
+    messages = {'peaks': "Enter tab separated m/z values or one m/z value "
+                         "and intensity per line"}
+
+    def validate_python(self, value, state):
+        super(PeakList, self).validate_python(value, state)
+        try:
+            readPeaks(value)
+        except ValueError:
+            raise validators.Invalid(self.message('peaks', state), value, state)
+
+
+class SpectrumUpload(validators.FancyValidator):
+    """Read the spectra of an uploaded file (see SpectrumFiles.readSpectra).
+
+    Converts the upload to a list of (title, peak list) tuples, one per
+    spectrum, with the peak lists in the format of the query field. Files
+    with more than 'mse.upload.max_spectra' spectra are rejected, they are
+    searched with the batch-mse command.
+    """
+
+    messages = {'empty': "The file contains no spectrum",
+                'invalid': "The file cannot be read: %(error)s",
+                'spectra': "The file contains more than %(max)d spectra"}
+
+    def is_empty(self, value):
+        return not getattr(value, 'filename', None)
+
+    def _to_python(self, value, state):
+        # loads numpy, so only imported when a file is uploaded
+        from mse.myAlgorithms.SpectrumFiles import formatPeaks, readSpectra
+        limit = int(config.get('mse.upload.max_spectra', 20))
+        spectra = []
+        try:
+            for title, mz, intensities in readSpectra(value.file,
+                                                      value.filename):
+                if not len(mz):
+                    continue
+                if len(spectra) == limit:
+                    raise validators.Invalid(self.message('spectra', state,
+                        max=limit), value, state)
+                if isinstance(title, str):
+                    title = title.decode('utf-8', 'replace')
+                spectra.append((title, unicode(formatPeaks(mz, intensities))))
+        except (SyntaxError, ValueError), e:
+            raise validators.Invalid(self.message('invalid', state,
+                error=e), value, state)
+        if not spectra:
+            raise validators.Invalid(self.message('empty', state),
+                                     value, state)
+        return spectra
+
+
+class SpectrumSource(validators.FormValidator):
+    """Check that a peak list was entered or a spectrum file uploaded."""
+
+    messages = {'missing': "Enter a peak list or upload a spectrum file"}
+
+    def validate_python(self, value, state):
+        if not (value.get('query') or value.get('spectrumFile')):
+            message = self.message('missing', state)
+            raise validators.Invalid(message, value, state,
+                error_dict=dict(query=validators.Invalid(message, value,
+                                                         state)))
+
+
+class ProfileSpectrum(validators.FormValidator):
+    """Check that the spectra to pick the peaks of have intensities."""
+
+    messages = {'intensities': "Peak picking needs an intensity for every "
+                               "m/z value"}
+
+    def validate_python(self, value, state):
+        if not value.get('peakPicking'):
+            return
+        if value.get('spectrumFile'):
+            field, queries = 'spectrumFile', [query for title, query
+                                              in value['spectrumFile']]
+        else:
+            field, queries = 'query', [value.get('query')]
+        if any(readPeaks(query)[1] is None for query in queries):
+            message = self.message('intensities', state)
+            raise validators.Invalid(message, value, state,
+                error_dict={field: validators.Invalid(message, value, state)})
+
+
+class PpmTolerance(validators.FormValidator):
+    """Check that a ppm tolerance can be applied to the mass range.
+
+    A tolerance in ppm is relative to the mass, so the mass range must be
+    positive and the tolerance smaller than a million ppm.
+    """
+
+    messages = {'minMass': "Must be positive for a tolerance in ppm",
+                'massTolerance': "Must be less than 1000000 ppm"}
+
+    def validate_python(self, value, state):
+        if value.get('toleranceUnit') != 'ppm':
+            return
+        errors = {}
+        if value.get('minMass') <= 0:
+            errors['minMass'] = self.message('minMass', state)
+        if not 0 < value.get('massTolerance') < 1e6:
+            errors['massTolerance'] = self.message('massTolerance', state)
+        if errors:
+            raise validators.Invalid("Invalid ppm tolerance", value, state,
+                error_dict=dict((name, validators.Invalid(message, value, state))
+                                for name, message in errors.items()))
+
+
 class SearchFields(widgets.WidgetsList):
     title = widgets.TextField(label="Assignment Title")
     query = widgets.TextArea(label="Input Spectrum")
+    spectrumFile = widgets.FileField(label="Or Upload a Spectrum File",
+        help_text="MGF, mzXML, mzML or CSV file")
     maxMass = widgets.TextField(label="Max. Peptide Mass")
     minMass = widgets.TextField(label="Min. Peptide Mass")
     massTolerance = widgets.TextField(label="Mass Tolerance")
+    toleranceUnit = widgets.SingleSelectField(label="Tolerance Unit",
+                                              options=["Da", "ppm"],
+                                              default="Da")
     specMode = widgets.SingleSelectField(label="Mode", options=["Positive", "Negative"],
                                          default="Positive")
-    database = widgets.SingleSelectField(label="Databases",
-                                         options=["Ribosomal Proteins in Bacteria: Unreviewed",
-                                                  "Ribosomal Proteins in Bacteria: Reviewed"],
-                                         default="Ribosomal Proteins in Bacteria: Reviewed")
+    weighting = widgets.SingleSelectField(label="Peak Weighting",
+                                          options=[("none", "None"),
+                                                   ("intensity", "Intensity"),
+                                                   ("rank", "Intensity Rank")],
+                                          default="none")
+    peakPicking = widgets.CheckBox(label="Pick Peaks of a Profile Spectrum")
+    decoys = widgets.TextField(label="Decoy Spectra", default=0,
+        help_text="Estimate empirical p-values and q-values from this many "
+                  "shifted copies of the spectrum")
+    addToLibrary = widgets.CheckBox(label="Add to Spectral Library")
+    database = widgets.MultipleSelectField(label="Databases",
+                                           options=registry.database_options,
+                                           default=registry.default_databases)
 
 
 class SearchFieldsSchema(validators.Schema):
     title = validators.UnicodeString(not_empty=True, strip=True)
-    query = validators.UnicodeString(not_empty=True, strip=True)
+    query = PeakList(strip=True, if_missing=u'')
+    spectrumFile = SpectrumUpload(if_missing=None)
     maxMass = validators.Number(not_empty=True, strip=True)
     minMass = validators.Number(not_empty=True, strip=True)
     massTolerance = validators.Number(not_empty=True, strip=True)
+    toleranceUnit = validators.OneOf(["Da", "ppm"], if_missing="Da")
     specMode = validators.OneOf(["Positive", "Negative"])
-    database = validators.OneOf(["Ribosomal Proteins in Bacteria: Unreviewed",
-                                 "Ribosomal Proteins in Bacteria: Reviewed"])
+    weighting = validators.OneOf(list(WEIGHTINGS), if_missing="none")
+    peakPicking = validators.StringBool(if_missing=False)
+    decoys = validators.Int(min=0, max=MAX_DECOYS, if_missing=0, if_empty=0)
+    addToLibrary = validators.StringBool(if_missing=False)
+    database = DatabaseList(not_empty=True)
+    chained_validators = [SpectrumSource(), ProfileSpectrum(), PpmTolerance()]
 
 
 registrationForm = widgets.TableForm(
@@ -110,15 +284,223 @@ engineForm = widgets.TableForm(
 )
 
 
+def create_search(user, values):
+    """Queue a new search for the given user from validated form values."""
+    return model.SearchList(title=values['title'], min_mass=values['minMass'],
+        max_mass=values['maxMass'], query=values['query'],
+        mass_tolerance=values['massTolerance'],
+        tolerance_unit=values.get('toleranceUnit', u'Da'),
+        spec_mode=values['specMode'],
+        weighting=values.get('weighting', u'none'),
+        add_to_library=bool(values.get('addToLibrary')),
+        peak_picking=bool(values.get('peakPicking')),
+        decoys=values.get('decoys', 0),
+        database=u','.join(values['database']), user=user)
+
+
+def create_searches(user, values):
+    """Queue the searches of validated form values.
+
+    That is a search of the entered peak list, or one search per spectrum
+    of the uploaded file, titled after the spectrum if there are several.
+    """
+    spectra = values.get('spectrumFile')
+    if not spectra:
+        return [create_search(user, values)]
+    searches = []
+    for title, query in spectra:
+        if len(spectra) > 1:
+            title = u'%s: %s' % (values['title'], title)
+        else:
+            title = values['title']
+        searches.append(create_search(user,
+                                      dict(values, title=title, query=query)))
+    return searches
+
+
+def start_worker():
+    """Start processing the queued searches.
+
+    The search worker loads numpy, scipy and Biopython, so it is imported
+    when the first search is submitted, not when the web server starts.
+    """
+    from mse.async import startIdentification
+    startIdentification()
+
+
+def user_search(searchID):
+    """Return the search with the given ID if it belongs to the current user."""
+    try:
+        s = model.SearchList.get(int(searchID))
+    except (ValueError, SQLObjectNotFound):
+        s = None
+    if s is None or s.userID != identity.current.user.id:
+        raise cherrypy.NotFound()
+    return s
+
+
+def validate_finished_search(s):
+    """Answer conditional GETs for the results of a finished search.
+
+    The results of a search never change once it is done, so a page of
+    them is identified by the search, its completion time, the query
+    parameters (like the page number, order and rank) and the current user
+    (who is shown on every page).
+    """
+    if s.status == 'Done' and s.completed:
+        params = hashlib.md5(request.query_string or '').hexdigest()[:16]
+        validate_conditional('search-%d-%s-%s-%d' % (s.id,
+            s.completed.strftime('%Y%m%d%H%M%S%f'), params,
+            identity.current.user.id), time.mktime(s.completed.timetuple()))
+
+
+def finished_search_page(self, searchID=None, **kw):
+    """Return the render cache key for the result page of a finished search."""
+    if searchID is None or identity.current.anonymous:
+        return None
+    try:
+        s = model.SearchList.get(int(searchID))
+    except (ValueError, SQLObjectNotFound):
+        return None
+    if s.status != 'Done' or not s.completed:
+        return None
+    validate_finished_search(s)
+    return (request.path_info, request.query_string, identity.current.user.id)
+
+
+def static_page(self, *args, **kw):
+    """Return the render cache key for a page which only depends on files.
+
+    These pages still show who is logged in, so the user is part of the key.
+    """
+    user = identity.current.user
+    return (request.path_info, request.query_string, user and user.id)
+
+
+def page_files(*names):
+    """Return the paths of the files below the package a page depends on.
+
+    The templates of all pages include master.html, as does the asset
+    manifest which decides how style sheets and scripts are linked.
+    """
+    directory = os.path.dirname(__file__)
+    names = ('templates/master.html', 'static/build/manifest.json') + names
+    return [os.path.join(directory, *name.split('/')) for name in names]
+
+
+# rendered pages of finished searches and of the static pages
+pageCache = RenderCache(config.get('mse.render_cache.max_entries', 200),
+    config.get('mse.render_cache.max_bytes', 16 * 1024 * 1024))
+
+
+class SearchAPI(controllers.Controller):
+    """JSON API for submitting searches and fetching their results.
+
+    All methods return JSON and only give access to the searches of the
+    current user, who can log in with the usual form parameters or with
+    HTTP basic authentication.
+    """
+
+    @expose('json')
+    @identity.require(identity.not_anonymous())
+    def submit(self, searches=None, **kw):
+        """Queue one or many searches.
+
+        Either pass the fields of the search form for a single search, or
+        pass 'searches', a JSON encoded list of objects with these fields.
+        Nothing is queued if any of the searches is invalid; the errors are
+        then returned per search index with status 400.
+        """
+        if searches is None:
+            searches = [kw]
+        else:
+            try:
+                searches = json.loads(searches)
+            except ValueError:
+                searches = None
+            if not isinstance(searches, list) or not all(
+                    isinstance(values, dict) for values in searches):
+                response.status = 400
+                return dict(errors={'searches': u"Must be a JSON list of objects."})
+        schema = SearchFieldsSchema()
+        values, errors = [], {}
+        for i, search in enumerate(searches):
+            try:
+                values.append(schema.to_python(search))
+            except validators.Invalid, e:
+                errors[i] = e.unpack_errors()
+        if errors:
+            response.status = 400
+            return dict(errors=errors)
+        u = identity.current.user
+        searches = [s for v in values for s in create_searches(u, v)]
+        start_worker()
+        return dict(searches=searches)
+
+    @expose('json')
+    @identity.require(identity.not_anonymous())
+    def status(self, ids):
+        """Return the searches with the given comma separated IDs."""
+        if not isinstance(ids, list):
+            ids = ids.split(',')
+        try:
+            ids = [int(i) for i in ids if i.strip()]
+        except ValueError:
+            response.status = 400
+            return dict(errors={'ids': u"Must be a list of search IDs."})
+        searches = model.SearchList.select(AND(IN(model.SearchList.q.id, ids),
+            model.SearchList.q.userID == identity.current.user.id))
+        return dict(searches=list(searches))
+
+    @expose('json')
+    @identity.require(identity.not_anonymous())
+    def results(self, searchID, page=1, per_page=50, rank='species'):
+        """Return one page of the results of a search, by ascending p-value.
+
+        Only the results at the given taxonomy rank are returned.
+        """
+        s = user_search(searchID)
+        validate_finished_search(s)
+        if rank not in RANKS:
+            response.status = 400
+            return dict(errors={'rank': u"Must be one of %s." % ', '.join(RANKS)})
+        try:
+            page = max(int(page), 1)
+            per_page = min(max(int(per_page), 1), 1000)
+        except ValueError:
+            response.status = 400
+            return dict(errors={'page': u"Page and per_page must be numbers."})
+        r = s.get_results(rank)
+        if isinstance(r, list):
+            r.sort(key=lambda item: item.p_value)
+            total = len(r)
+        else:
+            r = r.orderBy('p_value')
+            total = r.count()
+        start = (page - 1) * per_page
+        return dict(search=s, page=page, per_page=per_page, total=total,
+                    results=list(r[start:start + per_page]))
+
+
 class Root(controllers.RootController):
     catwalk = CatWalk(model)
     catwalk = identity.SecureObject(catwalk, identity.in_group('admin'))
+    api = SearchAPI()
+
+    @expose(content_type=metrics.CONTENT_TYPE)
+    @identity.require(identity.in_group('admin'))
+    def metrics(self):
+        """Return the operational metrics for Prometheus, see mse.metrics."""
+        return metrics.render()
 
+    @cached_page(pageCache, static_page, page_files('templates/index.html'))
     @expose('mse.templates.index')
     def index(self):
         siteTitle = "Welcome to MSE"
         return dict(siteTitle=siteTitle)
 
+    @cached_page(pageCache, static_page, page_files('templates/about.html',
+        'static/text/abstract.txt', 'static/text/references.txt'))
     @expose('mse.templates.about')
     def about(self):
         siteTitle = "Introduction"
@@ -129,6 +511,7 @@ class Root(controllers.RootController):
             ref = ReferenceContent.read().strip().split("\n")
         return dict(siteTitle=siteTitle, abstract=abstract, ref=ref)
 
+    @cached_page(pageCache, static_page, page_files('templates/contact.html'))
     @expose('mse.templates.contact')
     def contact(self):
         authors = [
@@ -239,14 +622,10 @@ class Root(controllers.RootController):
     @error_handler(searchform)
     def searchsubmit(self, **kw):
         u = identity.current.user
-        model.SearchList(title=kw['title'], min_mass=kw['minMass'], max_mass=kw['maxMass'],
-                         query=kw['query'], mass_tolerance=kw['massTolerance'], spec_mode=kw['specMode'],
-                         database=kw['database'], user=u)
+        create_searches(u, kw)
 
         # Start the search thread immediately
-        t = threading.Thread(target=MicroorganismIdentification)
-        t.daemon = True
-        t.start()
+        start_worker()
 
         redirect('/searchlist')
 
@@ -267,10 +646,52 @@ class Root(controllers.RootController):
         #model.SearchList.deleteBy(searchID)
         redirect('/searchlist')
 
+    @expose()
+    @identity.require(identity.not_anonymous())
+    def searchexport(self, searchID, format='csv', compress=False):
+        """Stream the results of one or more searches as a CSV or TSV file.
+
+        searchID is a search ID, a comma separated list of IDs or a list
+        of IDs. If compress is true ('1', 'true', 'yes' or 'on'), the file
+        is sent gzip compressed.
+        """
+        if not isinstance(searchID, list):
+            searchID = searchID.split(',')
+        searches = [user_search(i) for i in searchID if i.strip()]
+        try:
+            compress = validators.StringBool().to_python(compress)
+        except validators.Invalid:
+            raise cherrypy.NotFound()
+        if format not in ('csv', 'tsv') or not searches:
+            raise cherrypy.NotFound()
+        output = export_results(searches, format == 'tsv' and '\t' or ',')
+        filename = 'search-%s.%s' % ('-'.join(str(s.id) for s in searches),
+                                     format)
+        if compress:
+            output = gzip_stream(output)
+            filename += '.gz'
+            response.headers['Content-Type'] = 'application/x-gzip'
+        elif format == 'tsv':
+            response.headers['Content-Type'] = 'text/tab-separated-values'
+        else:
+            response.headers['Content-Type'] = 'text/csv'
+        response.headers['Content-Disposition'] = (
+            'attachment; filename="%s"' % filename)
+        return output
+    searchexport._cp_config = {'response.stream': True}
+
+    @cached_page(pageCache, finished_search_page,
+                 page_files('templates/searchResult.html'))
     @expose('mse.templates.searchResult')
     @identity.require(identity.not_anonymous())
     @paginate('resultData', default_order="p_value")
-    def searchresult(self, searchID):
+    def searchresult(self, searchID, rank='species'):
+        if rank not in RANKS:
+            raise cherrypy.NotFound()
         s = model.SearchList.get(searchID)
-        r = s.results
-        return dict(resultData=r)
\ No newline at end of file
+        r = s.get_results(rank)
+        matches = sorted(s.library_matches, key=lambda m: -m.similarity)
+        return dict(resultData=r, searchID=s.id, dbVersion=s.db_version,
+                    rank=rank, ranks=RANKS, weighted=s.weighting != 'none',
+                    empirical=bool(s.decoys),
+                    libraryMatches=matches)
\ No newline at end of file
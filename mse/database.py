@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""This module contains helpers for using the database from many threads.
+
+SQLite allows only one writer at a time. The background search thread and
+the CherryPy request threads all write to the same database file, so without
+some care they end up waiting on each other's file locks and fail with
+"database is locked". The helpers in here
+
+  * put a file based SQLite database into WAL journal mode, so that readers
+    are never blocked by a writer,
+  * give every connection a busy timeout, so a locked database is waited for
+    instead of raising an error right away,
+  * limit the number of threads using the database through `transaction`
+    to a configurable pool size and serialize the writers among them in
+    Python, which is much cheaper than letting them spin on the file lock,
+  * insert many rows with a single statement (`insert_many`),
+  * time every statement and pass it to the functions in `query_hooks`
+    (`instrument_queries`).
+
+The settings are read from the following configuration options:
+
+    mse.sqlite.journal_mode = 'WAL'
+    mse.sqlite.busy_timeout = 30    # seconds
+    mse.sqlite.pool_size = 10
+
+"""
+
+# symbols which are imported by "from mse.database import *"
+__all__ = ['configure_database', 'insert_many', 'instrument_queries',
+    'is_sqlite', 'query_hooks', 'transaction']
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import sqlobject
+from sqlobject.sqlbuilder import Insert
+from turbogears import config
+from turbogears.database import PackageHub
+
+log = logging.getLogger('mse.database')
+
+__connection__ = hub = PackageHub('mse')
+
+# SQLite limits the number of rows in a multi-row VALUES clause like the
+# number of terms in a compound SELECT
+INSERT_CHUNK_SIZE = 500
+
+_write_lock = threading.RLock()
+_pool = None
+_local = threading.local()  # the transaction depth of every thread
+
+# Functions called with every statement executed through SQLObject and its
+# duration in seconds, once instrument_queries has been called
+query_hooks = []
+
+
+def _dburi(key):
+    dburi = config.get(key)
+    if dburi.startswith('notrans_'):
+        dburi = dburi[8:]
+    return dburi
+
+
+def _dburi_keys():
+    """Return the config keys holding the database URIs of the application."""
+    return [key for key in ('mse.dburi', 'sqlobject.dburi') if config.get(key)]
+
+
+def is_sqlite(dburi=None):
+    """Check whether dburi (by default the configured one) is a SQLite file."""
+    if dburi is None:
+        keys = _dburi_keys()
+        if not keys:
+            return False
+        dburi = _dburi(keys[0])
+    elif dburi.startswith('notrans_'):
+        dburi = dburi[8:]
+    return dburi.startswith('sqlite:') and ':memory:' not in dburi
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = threading.BoundedSemaphore(
+            int(config.get('mse.sqlite.pool_size', 10)))
+    return _pool
+
+
+def configure_database():
+    """Prepare the configured SQLite database for concurrent use.
+
+    This must be called after the configuration has been read but before
+    the database is accessed for the first time, since the busy timeout is
+    passed to the connections through the database URI. It does nothing for
+    in-memory SQLite databases and other database systems.
+
+    """
+    global _pool
+    _pool = None
+    keys = _dburi_keys()
+    if not keys or not is_sqlite(config.get(keys[0])):
+        return
+    timeout = config.get('mse.sqlite.busy_timeout', 30)
+    for key in keys:
+        dburi = config.get(key)
+        if 'timeout=' not in dburi:
+            dburi += '%stimeout=%s' % ('?' in dburi and '&' or '?', timeout)
+            config.update({key: dburi})
+    journal_mode = config.get('mse.sqlite.journal_mode', 'WAL')
+    if journal_mode:
+        conn = sqlobject.connectionForURI(_dburi(keys[0]))
+        # the journal mode is stored in the database file, so setting it
+        # once is enough for all connections opened afterwards
+        mode = conn.queryOne('PRAGMA journal_mode=%s' % journal_mode)[0]
+        conn.close()
+        log.info("SQLite journal mode: %s, busy timeout: %ss", mode, timeout)
+
+
+@contextmanager
+def transaction(write=False):
+    """Run the enclosed block in a database transaction.
+
+    At most 'mse.sqlite.pool_size' threads may be inside such a block at
+    the same time. If write is True, the block is also serialized with all
+    other writing blocks of this process. The transaction is committed when
+    the block is left normally and rolled back if it raises an exception.
+
+    Blocks may be nested: an inner block is part of the transaction of the
+    outermost one, which alone commits or rolls back, and takes neither a
+    second pool slot nor the write lock a second time.
+
+    Request threads of the web server already run in a transaction managed
+    by TurboGears and must not use this while the controller method runs.
+    The generator of a streamed response body (see response.stream) is
+    only run after the method has returned and TurboGears has ended its
+    transaction, so it reads through this like any other thread.
+
+    """
+    depth = getattr(_local, 'depth', 0)
+    pool = _get_pool()
+    if not depth:
+        pool.acquire()
+    try:
+        if write:
+            _write_lock.acquire()
+        _local.depth = depth + 1
+        try:
+            if depth:
+                yield
+                return
+            hub.begin()
+            try:
+                yield
+            except:
+                hub.rollback()
+                raise
+            hub.commit()
+        finally:
+            _local.depth = depth
+            if write:
+                _write_lock.release()
+    finally:
+        if not depth:
+            pool.release()
+
+
+def insert_many(soClass, rows):
+    """Insert rows into the table of soClass with as few statements as possible.
+
+    rows is a sequence of dictionaries mapping column names of soClass
+    (e.g. 'search' for a ForeignKey column) to their values. Unlike creating
+    SQLObject instances, no objects are created and no ids are fetched.
+    Returns the number of inserted rows.
+
+    """
+    if not rows:
+        return 0
+    columns = soClass.sqlmeta.columns
+    names = sorted(rows[0])
+    dbNames = []
+    for name in names:
+        if name not in columns and name + 'ID' in columns:
+            name += 'ID'
+        dbNames.append(columns[name].dbName)
+    conn = hub.getConnection()
+    for start in xrange(0, len(rows), INSERT_CHUNK_SIZE):
+        values = [[_sqlvalue(row[name]) for name in names]
+                  for row in rows[start:start + INSERT_CHUNK_SIZE]]
+        conn.query(conn.sqlrepr(Insert(soClass.sqlmeta.table,
+            template=dbNames, valueList=values)))
+    return len(rows)
+
+
+def _sqlvalue(value):
+    """Return the database value of a column value (SQLObject instances)."""
+    if isinstance(value, sqlobject.SQLObject):
+        return value.id
+    return value
+
+
+def instrument_queries():
+    """Pass every statement executed through SQLObject to the query_hooks.
+
+    SQLObject sends all statements through the _executeRetry method of its
+    connection class, so the method of the class of the configured database
+    is wrapped to time the statement and call the hooks afterwards. Calling
+    this more than once does no harm.
+
+    """
+    keys = _dburi_keys()
+    if not keys:
+        return
+    connCls = sqlobject.dbconnection.dbConnectionForScheme(
+        _dburi(keys[0]).split(':', 1)[0])
+    execute = connCls._executeRetry
+    if getattr(execute, 'instrumented', False):
+        return
+
+    def _executeRetry(self, conn, cursor, query):
+        start = time.time()
+        try:
+            return execute(self, conn, cursor, query)
+        finally:
+            duration = time.time() - start
+            for hook in query_hooks:
+                hook(query, duration)
+    _executeRetry.instrumented = True
+    connCls._executeRetry = _executeRetry
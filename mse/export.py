@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""This module contains functions for exporting search results.
+
+The results are produced by generators which read them through a database
+cursor and yield the formatted output in small chunks, so exports can be
+streamed to the client in constant memory, however many organisms matched.
+
+"""
+
+# symbols which are imported by "from mse.export import *"
+__all__ = ['export_results', 'gzip_stream']
+
+import csv
+import zlib
+from cStringIO import StringIO
+
+from mse.model import result_columns
+
+# Number of rows formatted per yielded chunk
+CHUNK_ROWS = 500
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def export_results(searches, delimiter=','):
+    """Return a generator of the results of the searches as CSV chunks.
+
+    Use delimiter='\\t' for TSV.
+
+    The first row is a header. Every following row holds the ID and title
+    of a search followed by the columns of one of its results, ordered by
+    search and ascending p-value.
+
+    """
+    # read the titles now, while the searches are still loaded
+    prefixes = [(s.id, _encode(s.title)) for s in searches]
+    return _export_results(zip(searches, prefixes), delimiter)
+
+
+def _export_results(searches, delimiter):
+    buf = StringIO()
+    writer = csv.writer(buf, delimiter=delimiter, lineterminator='\n')
+    writer.writerow(['search_id', 'title'] + result_columns())
+    for s, prefix in searches:
+        count = 0
+        for row in s.iter_results(CHUNK_ROWS):
+            writer.writerow(prefix + tuple(_encode(value) for value in row))
+            count += 1
+            if count % CHUNK_ROWS == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+    yield buf.getvalue()
+
+
+def gzip_stream(chunks, level=6):
+    """Compress the chunks of a stream into the gzip file format."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
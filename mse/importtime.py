@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""This module contains the import-time report of the application.
+
+`measure` imports a module (by default mse.controllers, which the web
+server imports when it starts) in a fresh Python process and times every
+import statement executed meanwhile. `report` prints the slowest imports
+with their cumulative time (including the imports they trigger) and their
+own time, and checks the startup budget:
+
+- the total import time must stay below a given number of seconds, and
+- none of the heavy modules (numpy, scipy and Biopython by default) may be
+  loaded, as the web process should only load them when the search worker
+  runs its first search.
+
+Run it with the 'import-report-mse' command, which exits with status 1 if
+the budget is exceeded.
+
+"""
+
+# symbols which are imported by "from mse.importtime import *"
+__all__ = ['DEFAULT_MODULE', 'HEAVY_MODULES', 'ImportTimer', 'heavy_modules',
+           'measure', 'report']
+
+import __builtin__
+import json
+import os
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULE = 'mse.controllers'
+
+# Modules only the search worker should load
+HEAVY_MODULES = ['numpy', 'scipy', 'Bio']
+
+
+class ImportTimer(object):
+    """Time the import statements executed while it is installed.
+
+    Only imports which load new modules are recorded, under the name of the
+    module as it was imported (a relative name for implicit relative
+    imports) together with the importing module.
+    """
+
+    def __init__(self):
+        self.imports = []   # (name, importer, cumulative, own seconds)
+        self._nested = []
+        self._import = None
+
+    def install(self):
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self._timed_import
+
+    def uninstall(self):
+        __builtin__.__import__ = self._import
+
+    def _timed_import(self, name, globals=None, *args, **kw):
+        loaded = len(sys.modules)
+        self._nested.append(0.0)
+        start = time.time()
+        try:
+            return self._import(name, globals, *args, **kw)
+        finally:
+            elapsed = time.time() - start
+            nested = self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+            if len(sys.modules) != loaded:
+                importer = globals and globals.get('__name__') or '?'
+                self.imports.append((name, importer, elapsed,
+                                     elapsed - nested))
+
+
+def _loaded_modules():
+    return sorted(name for name, module in sys.modules.items()
+                  if module is not None)
+
+
+def _main():
+    """Import the module given on the command line and print the timings.
+
+    This runs in the fresh process started by measure.
+    """
+    module, config_file = sys.argv[1], sys.argv[2:]
+    if config_file:
+        from mse.command import _read_config
+        _read_config(config_file)
+    before = set(_loaded_modules())
+    timer = ImportTimer()
+    timer.install()
+    start = time.time()
+    try:
+        __import__(module)
+    finally:
+        total = time.time() - start
+        timer.uninstall()
+    json.dump(dict(module=module, total=total, imports=timer.imports,
+                   loaded=[name for name in _loaded_modules()
+                           if name not in before]), sys.stdout)
+
+
+def measure(module=DEFAULT_MODULE, config_file=None):
+    """Import module in a new Python process and return the timings.
+
+    Returns a dictionary with the total import time in seconds ('total'),
+    the recorded imports ('imports', see ImportTimer) and the names of the
+    modules loaded ('loaded'). If config_file is given, the configuration
+    is read first, like the start-mse command does.
+    """
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [package_dir] + filter(None, [env.get('PYTHONPATH')]))
+    args = [sys.executable, '-c', 'from mse.importtime import _main; _main()',
+            module]
+    if config_file:
+        args.append(config_file)
+    process = subprocess.Popen(args, env=env, stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode:
+        raise RuntimeError("Importing %s failed with status %d"
+                           % (module, process.returncode))
+    return json.loads(output)
+
+
+def heavy_modules(timings, heavy=HEAVY_MODULES):
+    """Return the top-level heavy modules which were loaded."""
+    return sorted(set(name.split('.')[0] for name in timings['loaded']
+                      if name.split('.')[0] in heavy))
+
+
+def report(timings, out=sys.stdout, top=20, budget=None,
+           heavy=HEAVY_MODULES):
+    """Print the slowest imports and check the budget.
+
+    Returns True if the total time is within budget seconds (if given) and
+    no heavy module was loaded.
+    """
+    print >> out, "%10s %10s  %s" % ('cumulative', 'own', 'module')
+    imports = sorted(timings['imports'], key=lambda i: -i[2])
+    for name, importer, cumulative, own in imports[:top]:
+        print >> out, "%8.1fms %8.1fms  %s (from %s)" % (
+            cumulative * 1000, own * 1000, name, importer)
+    print >> out, "Importing %s took %.1fms and loaded %d modules." % (
+        timings['module'], timings['total'] * 1000, len(timings['loaded']))
+    ok = True
+    loaded = heavy_modules(timings, heavy)
+    if loaded:
+        print >> out, "FAIL: heavy modules loaded: %s" % ', '.join(loaded)
+        ok = False
+    if budget is not None and timings['total'] > budget:
+        print >> out, "FAIL: over the budget of %.1fms" % (budget * 1000)
+        ok = False
+    return ok
@@ -16,6 +16,7 @@ from turbojson.jsonify import jsonify
 from turbojson.jsonify import jsonify_sqlobject
 
 from mse.model import User, Group, Permission
+from mse.model import SearchList, ResultList, ArchivedResult
 
 @jsonify.when('isinstance(obj, Group)')
 def jsonify_group(obj):
@@ -37,3 +38,23 @@ def jsonify_permission(obj):
     result = jsonify_sqlobject(obj)
     result['groups'] = [g.group_name for g in obj.groups]
     return result
+
+@jsonify.when('isinstance(obj, SearchList)')
+def jsonify_searchlist(obj):
+    result = jsonify_sqlobject(obj)
+    # the spectrum can be large and is known to the client anyway
+    result.pop('query', None)
+    return result
+
+@jsonify.when('isinstance(obj, ResultList)')
+def jsonify_resultlist(obj):
+    result = jsonify_sqlobject(obj)
+    result['search_id'] = obj.searchID
+    return result
+
+@jsonify.when('isinstance(obj, ArchivedResult)')
+def jsonify_archivedresult(obj):
+    result = dict((name, value) for name, value in obj.__dict__.items()
+                  if name != 'search')
+    result['search_id'] = obj.search.id
+    return result
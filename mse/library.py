@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""This module contains the spectral library of the application.
+
+Searches can add their spectrum to the library when they are done
+(SearchList.add_to_library). The spectrum is stored in a LibrarySpectrum
+row, labelled with the species the search identified best. Before matching
+against the protein databases, every search looks its spectrum up in the
+library and stores the most similar spectra as LibraryMatch rows, so a
+known isolate is recognized at once. The library is held in memory (see
+mse.myAlgorithms.SpectralLibrary) and picks up spectra added by other
+processes before every lookup.
+
+    # width of the mass bins of the library spectra, in Da
+    mse.library.bin_width = 2.0
+    # cosine similarity a library spectrum needs to be reported
+    mse.library.min_similarity = 0.5
+    # maximal number of library spectra reported per search
+    mse.library.matches = 5
+
+"""
+
+# symbols which are imported by "from mse.library import *"
+__all__ = ['add_search', 'lookup', 'pack_peaks', 'unpack_peaks']
+
+import logging
+import threading
+import zlib
+
+import numpy as np
+from turbogears import config
+
+from mse.database import transaction
+from mse.myAlgorithms.PeakPicking import searchPeaks
+from mse.myAlgorithms.SpectralLibrary import (BIN_WIDTH, SpectralLibrary,
+    binSpectrum)
+
+log = logging.getLogger('mse.library')
+
+_lock = threading.Lock()
+_library = {}   # the SpectralLibrary, its bin width and the last spectrum id
+_labels = {}    # LibrarySpectrum id -> (microorganism name, source)
+
+
+def pack_peaks(spectrum, intensities=None):
+    """Pack a peak list into a string for LibrarySpectrum.peaks."""
+    if intensities is None:
+        intensities = np.ones(len(spectrum))
+    peaks = np.array([spectrum, intensities], dtype='<f8')
+    return zlib.compress(peaks.tostring())
+
+
+def unpack_peaks(data):
+    """Return the (m/z values, intensities) arrays packed by pack_peaks."""
+    peaks = np.fromstring(zlib.decompress(data), dtype='<f8')
+    return peaks.reshape(2, -1)
+
+
+def _bin_width():
+    return float(config.get('mse.library.bin_width', BIN_WIDTH))
+
+
+def _current_library():
+    """Return the in-memory library with all spectra in the database."""
+    from mse.model import LibrarySpectrum
+    binWidth = _bin_width()
+    if _library.get('bin_width') != binWidth:
+        _library.update(library=SpectralLibrary(), bin_width=binWidth,
+                        last_id=0)
+    library = _library['library']
+    with transaction():
+        new = list(LibrarySpectrum.select(
+            LibrarySpectrum.q.id > _library['last_id'], orderBy='id'))
+    for entry in new:
+        spectrum, intensities = unpack_peaks(entry.peaks)
+        bins, values = binSpectrum(spectrum, intensities, binWidth)
+        library.add(entry.id, bins, values)
+        _labels[entry.id] = (entry.microorganism_name, entry.source)
+        _library['last_id'] = entry.id
+    return library
+
+
+def lookup(s, spectrum, intensities=None):
+    """Look the spectrum of search s up in the library.
+
+    Returns the rows of the LibraryMatch table for the most similar library
+    spectra, most similar first.
+    """
+    with _lock:
+        library = _current_library()
+        if not len(library):
+            return []
+        bins, values = binSpectrum(spectrum, intensities, _bin_width())
+        matches = library.lookup(bins, values,
+            int(config.get('mse.library.matches', 5)),
+            float(config.get('mse.library.min_similarity', 0.5)))
+        rows = []
+        for similarity, shared, key in matches:
+            name, source = _labels[key]
+            rows.append(dict(search=s, spectrum=key, microorganism_name=name,
+                             source=source, shared_bins=shared,
+                             similarity=round(similarity, 4)))
+        return rows
+
+
+def add_search(s, rows):
+    """Add the spectrum of the finished search s to the library.
+
+    rows are the ResultList rows of the search; the spectrum is labelled
+    with the species with the lowest p-value. Returns the LibrarySpectrum,
+    or None if the search identified nothing.
+    """
+    from mse.model import LibrarySpectrum
+    species = [row for row in rows if row['rank'] == u'species']
+    if not species:
+        return None
+    best = min(species, key=lambda row: row['p_value'])
+    spectrum, intensities = searchPeaks(s.query, s.peak_picking)
+    entry = LibrarySpectrum(search=s,
+                            microorganism_name=best['microorganism_name'],
+                            source=best['source'],
+                            peaks=pack_peaks(spectrum, intensities))
+    log.info("Added the spectrum of search %d to the library as %s",
+             s.id, entry.microorganism_name)
+    return entry
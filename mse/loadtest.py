@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""This module contains a load test for the web and the search tier.
+
+`run_load_test` starts the application in a subprocess against a scratch
+SQLite database and lets many simulated clients use it at once. Every
+client signs up through /signupsubmit and then requests a random mix of
+/searchsubmit, /searchlist and /searchresult pages. Afterwards it waits
+until all submitted searches are done and reports the throughput and the
+latency percentiles per page as well as the time the queue took to drain.
+
+Latencies are measured like a browser sees them, i.e. including redirects
+(a search submission includes the search list it redirects to).
+
+Searches need the FASTA files of the selected databases, otherwise they
+fail and the queue never drains. Their releases are published into the
+scratch directory, so the reference database store of the configuration
+is left alone. Run it with the 'loadtest-mse' command.
+
+"""
+
+# symbols which are imported by "from mse.loadtest import *"
+__all__ = ['Client', 'LoadTestError', 'parse_mix', 'percentile',
+           'run_load_test', 'select_databases']
+
+import cookielib
+import math
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib
+import urllib2
+
+# The pages requested by the clients and their default weights
+DEFAULT_MIX = 'searchsubmit:1,searchlist:5,searchresult:4'
+
+CONFIG_TEMPLATE = """\
+[global]
+sqlobject.dburi = 'sqlite://%(database)s'
+environment = 'production'
+server.socket_host = '127.0.0.1'
+server.socket_port = %(port)d
+server.thread_pool = %(threads)d
+log.screen = False
+mse.sqlite.journal_mode = 'WAL'
+mse.sqlite.busy_timeout = 30
+mse.sqlite.pool_size = %(threads)d
+mse.refdb.store = '%(store)s'
+"""
+
+_search_id_re = re.compile(r'searchresult\?searchID=(\d+)')
+
+
+class LoadTestError(Exception):
+    """The application under test could not be set up or failed."""
+
+
+def parse_mix(mix):
+    """Parse 'page:weight,...' into a list of (page, weight) tuples."""
+    pages = []
+    for item in mix.split(','):
+        page, _, weight = item.strip().partition(':')
+        if page not in ('searchsubmit', 'searchlist', 'searchresult'):
+            raise ValueError("Unknown page in mix: %r" % page)
+        pages.append((page, float(weight or 1)))
+    return pages
+
+
+def percentile(values, p):
+    """Return the p-th percentile of the sorted values (nearest rank)."""
+    if not values:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def select_databases(names=None):
+    """Return the comma separated keys of the databases to search.
+
+    names is a comma separated string of database keys, by default the
+    databases searched by default are used (see mse.registry).
+    """
+    from mse import registry
+    if not names:
+        return ','.join(registry.default_databases())
+    keys = [db.key for db in registry.databases()]
+    selected = [name.strip() for name in names.split(',')]
+    for name in selected:
+        if name not in keys:
+            raise LoadTestError("Unknown database: %s (configured: %s)" % (
+                name, ', '.join(keys)))
+    return ','.join(selected)
+
+
+def _free_port():
+    s = socket.socket()
+    try:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+
+class Client(threading.Thread):
+    """A simulated user of the application running in its own thread."""
+
+    def __init__(self, number, base_url, options, mix, spectrum, databases):
+        threading.Thread.__init__(self, name='client-%d' % number)
+        self.daemon = True
+        self.number = number
+        self.base_url = base_url
+        self.options = options
+        self.mix = mix
+        self.spectrum = spectrum
+        self.databases = databases
+        self.random = random.Random(number)
+        self.opener = urllib2.build_opener(
+            urllib2.HTTPCookieProcessor(cookielib.CookieJar()))
+        self.search_ids = set()
+        self.url = None     # the URL of the last response, after redirects
+        self.samples = []   # (page, start, latency, ok)
+        self.errors = []
+
+    def request(self, page, path, data=None):
+        """Request path and record the latency of the request under page."""
+        start = time.time()
+        body = None
+        try:
+            response = self.opener.open(self.base_url + path,
+                data and urllib.urlencode(data), self.options.timeout)
+            body = response.read()
+            self.url = response.geturl()
+            ok = response.getcode() == 200
+        except (urllib2.URLError, socket.error), e:
+            self.errors.append('%s: %s' % (page, e))
+            ok = False
+        self.samples.append((page, start, time.time() - start, ok))
+        return body
+
+    def signup(self):
+        name = u'load%d' % self.number
+        body = self.request('signupsubmit', '/signupsubmit', dict(
+            userName=name, password='loadtest', confirmPassword='loadtest',
+            displayName='Load Test %d' % self.number,
+            email='%s@example.com' % name,
+            securityQuestion="What's your first pet's name?",
+            securityAnswer='load', consent='on'))
+        return body is not None and self.url.endswith('/signupconfirmation')
+
+    def searchsubmit(self):
+        options = self.options
+        spectrum = self.spectrum or [
+            self.random.uniform(options.min_mass, options.max_mass)
+            for i in xrange(options.peaks)]
+        self.read_search_ids(self.request('searchsubmit', '/searchsubmit',
+            dict(title='Load test %d' % self.number,
+                 query='\t'.join('%.4f' % mass for mass in spectrum),
+                 minMass=options.min_mass, maxMass=options.max_mass,
+                 massTolerance=options.tolerance, specMode='Positive',
+                 database=self.databases)))
+
+    def searchlist(self):
+        self.read_search_ids(self.request('searchlist', '/searchlist'))
+
+    def searchresult(self):
+        if not self.search_ids:
+            # nothing is done yet, look again like a user would
+            return self.searchlist()
+        searchID = self.random.choice(sorted(self.search_ids))
+        self.request('searchresult', '/searchresult?searchID=%d' % searchID)
+
+    def read_search_ids(self, body):
+        """Remember the finished searches linked from a search list."""
+        if body:
+            self.search_ids.update(int(i) for i in _search_id_re.findall(body))
+
+    def run(self):
+        options = self.options
+        if not self.signup():
+            self.errors.append("signup failed")
+            return
+        total = sum(weight for page, weight in self.mix)
+        end = options.duration and time.time() + options.duration
+        count = 0
+        while (end and time.time() < end) or (
+                not end and count < options.requests):
+            choice = self.random.uniform(0, total)
+            for page, weight in self.mix:
+                choice -= weight
+                if choice <= 0:
+                    break
+            getattr(self, page)()
+            count += 1
+            if options.think:
+                time.sleep(self.random.uniform(0, 2 * options.think))
+
+
+def _setup_database(config_file):
+    """Create the tables and the group new users are put in."""
+    from mse.command import _read_config
+    _read_config([config_file])
+    from mse import model
+    model.create_tables()
+    model.Group(group_name=u'admin', display_name=u'Administrators')
+
+
+def _queued_searches():
+    from sqlobject.sqlbuilder import IN
+    from mse.model import SearchList
+    return SearchList.select(
+        IN(SearchList.q.status, [u'Incomplete', u'Running'])).count()
+
+
+def _start_server(directory, config_file, base_url, timeout):
+    env = dict(os.environ)
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [package_dir] + filter(None, [env.get('PYTHONPATH')]))
+    log = open(os.path.join(directory, 'server.log'), 'w')
+    server = subprocess.Popen([sys.executable, '-c',
+        'from mse.command import start; start()', config_file],
+        cwd=directory, env=env, stdout=log, stderr=subprocess.STDOUT)
+    end = time.time() + timeout
+    while time.time() < end:
+        if server.poll() is not None:
+            raise LoadTestError("The server exited, see %s" % log.name)
+        try:
+            urllib2.urlopen(base_url + '/', timeout=1).read()
+            return server
+        except (urllib2.URLError, socket.error):
+            time.sleep(0.2)
+    server.terminate()
+    raise LoadTestError("The server did not start within %ss" % timeout)
+
+
+def _report(clients, elapsed, drain_time, out):
+    samples = {}
+    for client in clients:
+        for page, start, latency, ok in client.samples:
+            samples.setdefault(page, []).append((latency, ok))
+    print >> out, "%-14s %7s %6s %8s %8s %8s %8s %8s" % ('page',
+        'count', 'errors', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms')
+    for page in sorted(samples):
+        latencies = sorted(latency for latency, ok in samples[page])
+        errors = len([ok for latency, ok in samples[page] if not ok])
+        print >> out, "%-14s %7d %6d %8.1f %8.1f %8.1f %8.1f %8.1f" % (
+            page, len(latencies), errors, len(latencies) / elapsed,
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 90) * 1000,
+            percentile(latencies, 99) * 1000, latencies[-1] * 1000)
+    total = sum(len(s) for s in samples.values())
+    print >> out, "%d requests by %d clients in %.1fs: %.1f requests/s" % (
+        total, len(clients), elapsed, total / elapsed)
+    if drain_time is None:
+        print >> out, "The search queue did not drain."
+    else:
+        print >> out, "Search queue drained %.1fs after the load ended." % (
+            drain_time)
+    errors = [e for client in clients for e in client.errors]
+    for error in sorted(set(errors))[:10]:
+        print >> out, "error: %s (%dx)" % (error, errors.count(error))
+
+
+def run_load_test(options, out=sys.stdout):
+    """Run a load test as configured by options and print a report to out.
+
+    options has the attributes of the options of the 'loadtest-mse'
+    command. Returns True if the test ran without errors and the search
+    queue drained in time.
+
+    """
+    mix = parse_mix(options.mix)
+    spectrum = None
+    if options.spectrum:
+        with open(options.spectrum) as f:
+            spectrum = [float(mass) for mass in f.read().split()]
+    directory = tempfile.mkdtemp(prefix='mse-loadtest-')
+    server = None
+    try:
+        port = options.port or _free_port()
+        base_url = 'http://127.0.0.1:%d' % port
+        config_file = os.path.join(directory, 'loadtest.cfg')
+        with open(config_file, 'w') as f:
+            f.write(CONFIG_TEMPLATE % dict(port=port,
+                database=os.path.join(directory, 'loadtest.sqlite'),
+                store=os.path.join(directory, 'refdb'),
+                threads=max(options.clients, 10)))
+        _setup_database(config_file)
+        databases = select_databases(options.database)
+        server = _start_server(directory, config_file, base_url,
+                               options.startup_timeout)
+        print >> out, "Server running at %s, data in %s" % (
+            base_url, directory)
+
+        clients = [Client(i, base_url, options, mix, spectrum, databases)
+                   for i in xrange(options.clients)]
+        start = time.time()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        end = time.time()
+
+        drain_time = None
+        while time.time() < end + options.drain_timeout:
+            if not _queued_searches():
+                drain_time = time.time() - end
+                break
+            if server.poll() is not None:
+                raise LoadTestError("The server exited during the test")
+            time.sleep(0.5)
+
+        _report(clients, end - start, drain_time, out)
+        return drain_time is not None and not any(
+            client.errors for client in clients)
+    finally:
+        if server is not None and server.poll() is None:
+            server.terminate()
+            server.wait()
+        if options.keep:
+            print >> out, "Kept %s" % directory
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""This module contains the operational metrics of the application.
+
+The metrics are kept in memory by the process and rendered by `render` in
+the text exposition format of Prometheus (version 0.0.4), which the admin
+only /metrics page of the application returns. Counters only ever grow;
+rates like "results written per second" or the utilization of the search
+worker are computed by the monitoring system from two samples:
+
+    rate(mse_results_written_total[5m])
+    rate(mse_worker_busy_seconds_total[5m])
+
+Gauges which are cheap to compute from the database, like the number of
+searches by status, are collected when the metrics are rendered.
+
+"""
+
+# symbols which are imported by "from mse.metrics import *"
+__all__ = ['Counter', 'Gauge', 'Histogram', 'render', 'candidate_cache',
+           'db_queries', 'db_query_seconds', 'results_written', 'searches',
+           'search_failures', 'search_run_seconds', 'search_wait_seconds',
+           'stage_seconds', 'worker_busy', 'worker_busy_seconds']
+
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlobject.sqlbuilder import Select, func
+
+from mse import database
+from mse.model import SearchList
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Histogram buckets in seconds
+SEARCH_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60, 300)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                 0.25, 0.5, 1, 5)
+
+_metrics = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = zip(names, values) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, unicode(value).replace(
+        '\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in pairs)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric(object):
+    """Base class of the metrics, which registers them for `render`."""
+
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        if not self.labels:
+            self._values[()] = self._initial()
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _initial(self):
+        return 0
+
+    def _key(self, labels):
+        if sorted(labels) != sorted(self.labels):
+            raise ValueError("%s needs the labels %s"
+                             % (self.name, ', '.join(self.labels)))
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self):
+        """Return the samples as a list of (suffix, labels, value) tuples."""
+        self._lock.acquire()
+        try:
+            return [('', key, value)
+                    for key, value in sorted(self._values.items())]
+        finally:
+            self._lock.release()
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation),
+                 '# TYPE %s %s' % (self.name, self.type)]
+        for sample in self.samples():
+            suffix, key, value = sample[:3]
+            extra = len(sample) > 3 and sample[3] or ()
+            lines.append('%s%s%s %s' % (self.name, suffix,
+                _format_labels(self.labels, key, extra), _format_value(value)))
+        return lines
+
+
+class Counter(_Metric):
+    """A value which only increases, like the number of written results."""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._lock.acquire()
+        try:
+            self._values[key] = self._values.get(key, 0) + amount
+        finally:
+            self._lock.release()
+
+
+class Gauge(_Metric):
+    """A value which goes up and down, like the number of queued searches.
+
+    If collect is given, it is called when the metrics are rendered and
+    returns the current values as a dictionary mapping tuples of label
+    values to values.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), collect=None):
+        super(Gauge, self).__init__(name, documentation, labels)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        self._lock.acquire()
+        try:
+            self._values[key] = value
+        finally:
+            self._lock.release()
+
+    def samples(self):
+        if self.collect is not None:
+            return [('', key, value)
+                    for key, value in sorted(self.collect().items())]
+        return super(Gauge, self).samples()
+
+
+class Histogram(_Metric):
+    """Counts observed values, like durations, in cumulative buckets."""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=STAGE_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        super(Histogram, self).__init__(name, documentation, labels)
+
+    def _initial(self):
+        return [0] * len(self.buckets), 0.0
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        self._lock.acquire()
+        try:
+            counts, total = self._values.get(key) or self._initial()
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = counts, total + value
+        finally:
+            self._lock.release()
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the time spent in the enclosed block in seconds."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def samples(self):
+        # observe updates the bucket counts in place, so copy them and the
+        # sum together while holding the lock
+        self._lock.acquire()
+        try:
+            values = [(key, list(counts), total) for key, (counts, total)
+                      in sorted(self._values.items())]
+        finally:
+            self._lock.release()
+        samples = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(('_bucket', key, cumulative,
+                                [('le', _format_value(bound))]))
+            samples.append(('_sum', key, total))
+            samples.append(('_count', key, cumulative))
+        return samples
+
+
+def render():
+    """Return all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines).encode('utf-8') + '\n'
+
+
+def _searches_by_status():
+    conn = SearchList._connection
+    counts = dict.fromkeys([(u'Incomplete',), (u'Running',), (u'Done',),
+                            (u'Failed',)], 0)
+    for status, count in conn.queryAll(conn.sqlrepr(Select(
+            [SearchList.q.status, func.COUNT(SearchList.q.id)],
+            groupBy=SearchList.q.status))):
+        counts[(status,)] = count
+    return counts
+
+
+searches = Gauge('mse_searches',
+    "Number of searches by status (Incomplete searches are queued).",
+    ['status'], collect=_searches_by_status)
+search_wait_seconds = Histogram('mse_search_wait_seconds',
+    "Time searches spent in the queue before they were started.",
+    buckets=SEARCH_BUCKETS)
+search_run_seconds = Histogram('mse_search_run_seconds',
+    "Time from the start to the end of successful searches.",
+    buckets=SEARCH_BUCKETS)
+stage_seconds = Histogram('mse_search_stage_seconds',
+    "Time spent in the stages of the search pipeline.", ['stage'])
+search_failures = Counter('mse_search_failures_total',
+    "Number of searches which failed with an error.")
+results_written = Counter('mse_results_written_total',
+    "Number of result rows written to the database.")
+candidate_cache = Counter('mse_candidate_cache_total',
+    "Number of searches rescored from cached candidates (hit) or matched "
+    "against the index (miss).", ['result'])
+worker_busy = Gauge('mse_worker_busy',
+    "1 while the search worker processes a search, 0 while it is idle.")
+worker_busy_seconds = Counter('mse_worker_busy_seconds_total',
+    "Time the search worker spent processing searches.")
+db_queries = Counter('mse_db_queries_total',
+    "Number of statements executed through SQLObject.")
+db_query_seconds = Histogram('mse_db_query_seconds',
+    "Execution time of the statements executed through SQLObject.",
+    buckets=QUERY_BUCKETS)
+
+
+def _observe_query(query, duration):
+    db_queries.inc()
+    db_query_seconds.observe(duration)
+
+database.query_hooks.append(_observe_query)
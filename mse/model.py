@@ -5,6 +5,8 @@
 __all__ = ['Group', 'Permission', 'User', 'Visit', 'VisitIdentity']
 
 from datetime import datetime
+import json
+import zlib
 
 import pkg_resources
 pkg_resources.require('SQLObject>=0.10.1')
@@ -12,13 +14,16 @@ pkg_resources.require('SQLObject>=0.10.1')
 from turbogears.database import PackageHub
 # import some basic SQLObject classes for declaring the data model
 # (see http://www.sqlobject.org/SQLObject.html#declaring-the-class)
-from sqlobject import SQLObject, SQLObjectNotFound, RelatedJoin
+from sqlobject import SQLObject, SQLObjectNotFound, RelatedJoin, SingleJoin
+from sqlobject.sqlbuilder import AND, IN, OR, NoDefault, Select, Update
 from sqlobject.inheritance import InheritableSQLObject
 # import some datatypes for table columns from SQLObject
 # (see http://www.sqlobject.org/SQLObject.html#column-types for more)
 from sqlobject import StringCol, UnicodeCol, IntCol, DateTimeCol, FloatCol, ForeignKey, MultipleJoin
+from sqlobject import BLOBCol, BoolCol
 from turbogears import identity
 
+from mse.database import transaction
 
 __connection__ = hub = PackageHub('mse')
 
@@ -33,21 +38,160 @@ class SearchList(SQLObject):
     max_mass = FloatCol()
     min_mass = FloatCol()
     mass_tolerance = FloatCol()
+    tolerance_unit = UnicodeCol(default=u'Da') # 'Da' or 'ppm'
+    weighting = UnicodeCol(default=u'none') # see MassIndex.peakWeights
+    add_to_library = BoolCol(default=False) # see mse.library
+    peak_picking = BoolCol(default=False) # see PeakPicking.pickPeaks
+    decoys = IntCol(default=0) # see MassIndex.empiricalSignificance
     spec_mode = UnicodeCol()
     database = UnicodeCol()
+    db_version = UnicodeCol(default=None) # see registry.current_versions
     created = DateTimeCol(default=datetime.now)
-    status = UnicodeCol(default=u'Incomplete')
+    status = UnicodeCol(default=u'Incomplete') # Running, Done or Failed
+    started = DateTimeCol(default=None)
+    completed = DateTimeCol(default=None)
     user = ForeignKey('User')
     results = MultipleJoin("ResultList", joinColumn="search_id") # automatically add "_id" to "search" col in ResultList
+    archive = SingleJoin("ResultArchive", joinColumn="search_id")
+    library_matches = MultipleJoin("LibraryMatch", joinColumn="search_id")
+
+    def get_results(self, rank=None):
+        """Return the results of this search.
+
+        Results of archived searches are unpacked from their ResultArchive,
+        all others are selected from ResultList so they can be sorted and
+        sliced by the database. If rank is given, only the results at this
+        taxonomy rank are returned.
+        """
+        if self.archive:
+            results = self.archive.unpack()
+            if rank:
+                results = [r for r in results
+                           if r.rank == rank]
+            return results
+        if rank:
+            return ResultList.selectBy(search=self, rank=rank)
+        return ResultList.selectBy(search=self)
+
+    def iter_results(self, batch_size=500):
+        """Yield the results of this search ordered by ascending p-value.
+
+        Every result is a tuple of the values of the result_columns().
+        Results are read batch_size rows at a time, so they are never all
+        held in memory. Every batch is read in its own short transaction
+        and continues after the p-value and id of the last row read (keyset
+        paging), so no connection or transaction is held while the rows
+        are consumed, e.g. by the streamed response body of a download,
+        which runs after the transaction of the request has ended (see
+        mse.database.transaction).
+        """
+        names = result_columns()
+        with transaction():
+            archive = self.archive
+            if archive:
+                results = archive.unpack()
+        if archive:
+            for r in sorted(results, key=lambda r: r.p_value):
+                yield tuple(getattr(r, name) for name in names)
+            return
+        q = ResultList.q
+        columns = [q.p_value, q.id] + [getattr(q, name) for name in names]
+        where = of_search = (q.searchID == self.id)
+        while True:
+            with transaction():
+                conn = hub.getConnection()
+                rows = conn.queryAll(conn.sqlrepr(Select(columns,
+                    where=where, orderBy=[q.p_value, q.id],
+                    limit=batch_size)))
+            for row in rows:
+                yield tuple(row[2:])
+            if len(rows) < batch_size:
+                break
+            p_value, id = rows[-1][:2]
+            where = AND(of_search, OR(q.p_value > p_value,
+                                 AND(q.p_value == p_value, q.id > id)))
 
 
 class ResultList(SQLObject):
     microorganism_name = UnicodeCol()
     matching_hit = IntCol()
+    weighted_score = FloatCol(default=None) # sum of the matching peak weights
     p_value = FloatCol()
     e_value = FloatCol()
+    empirical_p_value = FloatCol(default=None) # from decoy spectra
+    q_value = FloatCol(default=None) # false discovery rate
+    source = UnicodeCol(default=None) # key of the database of the organism
+    rank = UnicodeCol(default=u'species') # taxonomy rank of the organism
     search = ForeignKey("SearchList")
 
+
+class LibrarySpectrum(SQLObject):
+    """A spectrum of an identified microorganism in the spectral library."""
+
+    search = ForeignKey("SearchList")
+    microorganism_name = UnicodeCol()
+    source = UnicodeCol(default=None)
+    peaks = BLOBCol() # see mse.library.pack_peaks
+    created = DateTimeCol(default=datetime.now)
+
+
+class LibraryMatch(SQLObject):
+    """A library spectrum similar to the spectrum of a search."""
+
+    search = ForeignKey("SearchList")
+    spectrum = ForeignKey("LibrarySpectrum")
+    microorganism_name = UnicodeCol()
+    source = UnicodeCol(default=None)
+    similarity = FloatCol() # cosine similarity of the binned spectra
+    shared_bins = IntCol()
+
+
+def result_columns():
+    """Return the names of the columns of a result, without its search."""
+    return [col.name for col in ResultList.sqlmeta.columnList
+            if col.name != 'searchID']
+
+
+class ResultArchive(SQLObject):
+    """The ResultList rows of a finished search, packed into one blob.
+
+    The rows are stored as zlib compressed JSON: a list of column names
+    followed by one list of values per result.
+    """
+
+    search = ForeignKey("SearchList")
+    row_count = IntCol()
+    data = BLOBCol()
+    created = DateTimeCol(default=datetime.now)
+
+    @classmethod
+    def pack(cls, search):
+        """Create the archive of the given search from its ResultList rows."""
+        names = result_columns()
+        rows = [[getattr(r, name) for name in names]
+                for r in ResultList.selectBy(search=search)]
+        data = zlib.compress(json.dumps([names] + rows))
+        return cls(search=search, row_count=len(rows), data=data)
+
+    def unpack(self):
+        """Return the archived results as a list of ArchivedResult objects."""
+        rows = json.loads(zlib.decompress(self.data))
+        names = rows.pop(0)
+        return [ArchivedResult(self.search, **dict(zip(names, row)))
+                for row in rows]
+
+
+class ArchivedResult(object):
+    """A read-only stand-in for a ResultList row unpacked from an archive."""
+
+    # columns added after the oldest archives were packed
+    source = weighted_score = empirical_p_value = q_value = None
+    rank = u'species'
+
+    def __init__(self, search, **kw):
+        self.search = search
+        self.__dict__.update(kw)
+
 # the identity model
 
 class Visit(SQLObject):
@@ -169,6 +313,46 @@ class Permission(SQLObject):
         return self.permission_name
 
 
+# functions for maintaining the database
+
+def archive_results(age, batch_size=1000):
+    """Pack the results of old finished searches into ResultArchive rows.
+
+    Every search which is 'Done' and was created more than 'age' (a
+    timedelta) ago gets its results packed into a single ResultArchive.
+    The expanded ResultList rows are then deleted in batches of at most
+    'batch_size' rows, each batch in its own transaction, so that the
+    database is never locked for long. Rows left over by an earlier run
+    which stopped before all of them were deleted are deleted as well.
+
+    Returns the number of searches that have been archived.
+
+    """
+    cutoff = datetime.now() - age
+    searches = SearchList.select(AND(SearchList.q.status == u'Done',
+                                     SearchList.q.created < cutoff))
+    count = 0
+    for s in list(searches):
+        packed = not s.archive
+        if packed:
+            with transaction(write=True):
+                ResultArchive.pack(s)
+        while True:
+            with transaction(write=True):
+                conn = hub.getConnection()
+                ids = [row[0] for row in conn.queryAll(conn.sqlrepr(
+                    Select(ResultList.q.id,
+                           where=(ResultList.q.searchID == s.id),
+                           limit=batch_size)))]
+                if ids:
+                    ResultList.deleteMany(IN(ResultList.q.id, ids))
+            if len(ids) < batch_size:
+                break
+        if packed:
+            count += 1
+    return count
+
+
 # functions for populating the database
 
 def bootstrap_model(clean=False, user=None):
@@ -193,7 +377,8 @@ def bootstrap_model(clean=False, user=None):
 def create_tables(drop_all=False):
     """Create all tables defined in the model in the database.
 
-    Optionally drop existing tables before creating them.
+    Optionally drop existing tables before creating them. The columns added
+    to the model since an existing table was created are added to it.
 
     """
     from turbogears.util import get_model
@@ -229,8 +414,13 @@ def create_tables(drop_all=False):
             # all the constaints for later creation.
             # see http://sqlobject.org/FAQ.html#mutually-referencing-tables
             # for more info
+            if item.tableExists():
+                for name in add_missing_columns(item):
+                    print "Column %s added to table %s." % (
+                        name, item.sqlmeta.table)
+                continue
             collected_constraints = item.createTable(
-                ifNotExists=True, applyConstraints=False)
+                applyConstraints=False)
 
             if collected_constraints:
                 constraints.extend(collected_constraints)
@@ -242,6 +432,30 @@ def create_tables(drop_all=False):
 
     print "All database tables defined in model created."
 
+def add_missing_columns(soClass):
+    """Add the columns of soClass missing in its existing table.
+
+    createTable never alters an existing table, so the columns added to the
+    model later are added here. The rows already in the table get the
+    default value of the column, unless it is computed when a row is made.
+    Returns the names of the added columns.
+
+    """
+    conn = soClass._connection
+    table = soClass.sqlmeta.table
+    existing = set(col.withClass(soClass).dbName
+                   for col in conn.columnsFromSchema(table, soClass))
+    added = []
+    for column in soClass.sqlmeta.columnList:
+        if column.dbName in existing:
+            continue
+        conn.addColumn(table, column)
+        default = column.default
+        if default not in (NoDefault, None) and not callable(default):
+            conn.query(conn.sqlrepr(Update(table, {column.dbName: default})))
+        added.append(column.name)
+    return added
+
 def create_default_user(user_name, password=None):
     """Create a default user."""
     try:
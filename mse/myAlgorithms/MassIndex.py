@@ -0,0 +1,612 @@
+"""Sorted biomarker mass index of protein sequence databases
+
+Computing the biomarkers of every sequence of a FASTA file for every search
+is by far the most expensive part of a search. A MassIndex holds the masses
+once computed in numpy arrays, with the biomarker masses sorted, so that the
+sequences matching a peak are found by binary search and a whole spectrum is
+matched with a few vectorized operations.
+
+Ribosomal proteins are highly conserved, so many organisms share sequences
+and biomarker masses. The index keeps every distinct biomarker mass once,
+with a posting list (in CSR layout) of the distinct protein masses and
+organisms it belongs to, so matching touches every mass once and only fans
+out to organisms for hits.
+
+Indexes of several databases can be merged into one, which is then searched
+in a single pass. Every organism of an index is identified by its source
+(the key of the database it comes from) and its name including the strain.
+The taxonomy lineage of every organism is computed when it is indexed, so
+one pass scores the organisms at every rank of RANKS.
+"""
+
+import os
+
+import numpy as np
+
+from ScoringAlgorithms import (RANKS, WEIGHTINGS, lineage, proteinMass,
+    readStrain, toleranceWindow)
+
+MET = 131.0404  # Methionine's monoisotopic weight
+PROTON = 1.007825   # Proton's monoisotopic weight
+
+# Range of the mass shifts of decoy spectra, see decoyShifts
+DECOY_MIN_SHIFT = 10.0
+DECOY_MAX_SHIFT = 300.0
+
+# Format of the saved indexes; indexes in another format are rebuilt
+INDEX_FORMAT = 3
+# Formats which can still be read: format 1 had no lineages, formats 1 and
+# 2 had a biomarker mass entry per sequence (markerSeq)
+READ_FORMATS = (1, 2, INDEX_FORMAT)
+
+
+class MassIndex(object):
+    """Protein and biomarker masses of the sequences of some databases
+
+    Attributes:
+        seqMass: Monoisotopic protein mass of every sequence
+        seqOrganism: Index of the organism of every sequence
+        organisms: List of (source, name) tuples
+        lineages: List of the (strain, species, genus) names of every
+        organism, see lineage
+        taxa: List of (rank, source, name) tuples of all taxa of all ranks
+        taxonIds: Matrix of the index in taxa of every organism (rows) at
+        every rank of RANKS (columns)
+        proteinMass: Sorted distinct protein masses
+        markerMass: Sorted distinct neutral biomarker masses, i.e. the
+        protein masses and, for sequences with a N-terminal methionine, the
+        protein masses without the methionine
+        markerStart: Offsets of the posting lists of the biomarker masses;
+        the postings of markerMass[i] are markerStart[i]:markerStart[i + 1]
+        postingProtein: Index in proteinMass of the protein of every posting
+        postingOrganism: Index of the organism of every posting
+        info: Dictionary describing the source files of the index
+    """
+
+    def __init__(self, seqMass, seqOrganism, organisms, proteinMass,
+                 markerMass, markerStart, postingProtein, postingOrganism,
+                 info=None, lineages=None):
+        self.seqMass = seqMass
+        self.seqOrganism = seqOrganism
+        self.organisms = organisms
+        self.proteinMass = proteinMass
+        self.markerMass = markerMass
+        self.markerStart = markerStart
+        self.postingProtein = postingProtein
+        self.postingOrganism = postingOrganism
+        self.info = info or {}
+        if lineages is None:
+            lineages = [lineage(name) for source, name in organisms]
+        self.lineages = [tuple(names) for names in lineages]
+        taxa = {}
+        taxonIds = [[taxa.setdefault((rank, source, name), len(taxa))
+                     for rank, name in zip(RANKS, names)]
+                    for (source, strain), names in zip(organisms,
+                                                       self.lineages)]
+        self.taxa = sorted(taxa, key=taxa.get)
+        self.taxonIds = np.array(taxonIds, dtype=np.int64).reshape(
+            len(organisms), len(RANKS))
+
+    def __len__(self):
+        return len(self.seqMass)
+
+    def search(self, spectrum, lowerBound, upperBound, tolerance, mode,
+               unit="Da"):
+        """Match a spectrum against the sequences in a mass range
+
+        Organisms are scored at the species level, see searchRanks.
+
+        Return:
+            Two dictionaries keyed by (source, species) of organisms: the
+            hits and the sizes, see searchRanks
+        """
+
+        return self.searchRanks(spectrum, lowerBound, upperBound, tolerance,
+                                mode, unit, ("species",))["species"][:2]
+
+    def searchRanks(self, spectrum, lowerBound, upperBound, tolerance, mode,
+                    unit="Da", ranks=RANKS, weights=None):
+        """Match a spectrum against the sequences in a mass range at once at
+        several taxonomy ranks
+
+        Only sequences with a protein mass between lowerBound and upperBound
+        are considered, like fastaFilter does. A peak matches a sequence if
+        it is within tolerance of one of its biomarkers (see biomarker and
+        isMatch). Windows of ppm tolerances grow with the mass of the peak;
+        their bounds are still found by binary search.
+
+        Args:
+            spectrum: A list of float numbers representing spectral peaks
+            lowerBound: The lower bound of protein weight
+            upperBound: The upper bound of protein weight
+            tolerance: Maximal difference between peak and biomarker
+            mode: Mass spec mode, Positive or Negative
+            unit: Unit of the tolerance, "Da" or "ppm"
+            ranks: The ranks of RANKS to score
+            weights: Optional weight of every peak of the spectrum, see
+            peakWeights
+
+        Return:
+            A dictionary of rank to three dictionaries keyed by (source,
+            name) of the taxa of the rank: the number of distinct peaks
+            matching a sequence of the taxon (only taxa with matches), the
+            number of sequences of the taxon in the mass range (see matchNum
+            and resultTable), and the sum of the weights of the matching
+            peaks (the number of matching peaks without weights)
+        """
+
+        candidates = self.matchPeaks(spectrum, lowerBound, upperBound,
+                                     tolerance, mode, unit)
+        return self.scoreCandidates(candidates, lowerBound, upperBound,
+                                    tolerance, unit, ranks, weights)
+
+    def matchPeaks(self, spectrum, lowerBound, upperBound, tolerance, mode,
+                   unit="Da", widen=None):
+        """Find the biomarkers within tolerance of the peaks of a spectrum
+
+        Args:
+            spectrum, lowerBound, upperBound, tolerance, mode, unit: See
+            searchRanks
+            widen: Optional CandidateSet of the same spectrum and mode
+            found before; the windows and the mass range are widened to
+            include its windows and mass range
+
+        Return:
+            A CandidateSet, which scoreCandidates scores for the given or
+            any narrower tolerance and mass range
+        """
+
+        shift = massShift(mode)
+        peaks, inverse = np.unique(np.asarray(spectrum, dtype=float),
+                                   return_inverse=True)
+        low, high = toleranceWindow(peaks, tolerance, unit)
+        low, high = low - shift, high - shift
+        lowerBound, upperBound = float(lowerBound), float(upperBound)
+        if widen is not None:
+            if widen.shift != shift or not np.array_equal(widen.peaks, peaks):
+                raise ValueError("Candidates of another spectrum or mode")
+            low = np.minimum(low, widen.low)
+            high = np.maximum(high, widen.high)
+            lowerBound = min(lowerBound, widen.lowerBound)
+            upperBound = max(upperBound, widen.upperBound)
+        proteinInRange = ((self.proteinMass >= lowerBound) &
+                          (self.proteinMass <= upperBound))
+
+        # Distinct biomarker masses within the window of each peak, by binary
+        # search, and the postings of these masses
+        markerLo = np.searchsorted(self.markerMass, low, 'left')
+        markerHi = np.searchsorted(self.markerMass, high, 'right')
+        lo, hi = self.markerStart[markerLo], self.markerStart[markerHi]
+        counts = hi - lo
+        peakIds = np.repeat(np.arange(len(peaks)), counts)
+        entries = (np.repeat(lo - (np.cumsum(counts) - counts), counts) +
+                   np.arange(counts.sum()))
+        keep = proteinInRange[self.postingProtein[entries]]
+        entries = entries[keep]
+        markers = np.searchsorted(self.markerStart, entries, 'right') - 1
+        return CandidateSet(peaks, inverse, shift, low, high, lowerBound,
+                            upperBound, peakIds[keep], self.markerMass[markers],
+                            self.proteinMass[self.postingProtein[entries]],
+                            self.postingOrganism[entries])
+
+    def scoreCandidates(self, candidates, lowerBound, upperBound, tolerance,
+                        unit="Da", ranks=RANKS, weights=None):
+        """Score the candidates of matchPeaks
+
+        The tolerance and mass range may be narrower than those the
+        candidates were found with (see CandidateSet.covers); only the
+        candidates within them are counted.
+
+        Args:
+            candidates: A CandidateSet returned by matchPeaks
+            lowerBound, upperBound, tolerance, unit, ranks, weights: See
+            searchRanks
+
+        Return:
+            See searchRanks
+        """
+
+        result = dict((rank, ({}, {}, {})) for rank in ranks)
+        if not self.organisms:
+            return result
+        # Taxa of every organism at the requested ranks; they are numbered
+        # across all ranks, so every rank is counted by the same bincount
+        taxonIds = self.taxonIds[:, [RANKS.index(rank) for rank in ranks]]
+        nTaxa = len(self.taxa)
+        inRange = ((self.seqMass >= float(lowerBound)) &
+                   (self.seqMass <= float(upperBound)))
+        sizes = np.bincount(taxonIds[self.seqOrganism[inRange]].ravel(),
+                            minlength=nTaxa)
+
+        peakWeight = np.ones(len(candidates.peaks))
+        if weights is not None:
+            # a peak listed twice counts with its highest weight
+            peakWeight = np.zeros(len(candidates.peaks))
+            np.maximum.at(peakWeight, candidates.inverse,
+                          np.asarray(weights, dtype=float))
+        keep = candidates.select(lowerBound, upperBound, tolerance, unit)
+
+        # Count every taxon once per matching peak
+        peakIds = candidates.peakIds[keep].astype(np.int64)[:, np.newaxis]
+        pairs = np.unique(peakIds * nTaxa +
+                          taxonIds[candidates.organism[keep]])
+        taxa = pairs % nTaxa
+        hits = np.bincount(taxa, minlength=nTaxa)
+        weighted = np.bincount(taxa, weights=peakWeight[pairs // nTaxa],
+                               minlength=nTaxa)
+
+        for i in np.flatnonzero(hits):
+            rank, source, name = self.taxa[i]
+            result[rank][0][source, name] = int(hits[i])
+            result[rank][2][source, name] = float(weighted[i])
+        for i in np.flatnonzero(sizes):
+            rank, source, name = self.taxa[i]
+            result[rank][1][source, name] = int(sizes[i])
+        return result
+
+    def empiricalSignificance(self, spectrum, lowerBound, upperBound,
+                              tolerance, mode, unit, hits, shifts):
+        """Estimate the significance of the hits of taxa from decoy spectra
+
+        The decoys are copies of the spectrum with all peaks shifted by the
+        same mass, so they keep its number and spacing of peaks but match
+        biomarkers by chance only. All decoys are matched in a single pass
+        over one spectrum of all their peaks, and counted per decoy.
+
+        Args:
+            spectrum, lowerBound, upperBound, tolerance, mode, unit: See
+            searchRanks
+            hits: Dictionary of rank to the hits of the spectrum, keyed by
+            (source, name), as returned by searchRanks
+            shifts: The mass shift of every decoy, see decoyShifts
+
+        Return:
+            A dictionary of rank to a dictionary of (empirical p-value,
+            q-value) tuples keyed like hits. The empirical p-value of a
+            taxon with k hits is the share of decoys (counting the spectrum
+            itself) in which it has k or more hits. The q-value is the
+            lowest false discovery rate at which the taxon is reported:
+            the mean number of taxa of the rank with at least k' decoy
+            hits per decoy divided by the number with at least k' hits,
+            minimized over k' <= k.
+        """
+
+        result = dict((rank, {}) for rank in hits)
+        shifts = np.asarray(shifts, dtype=float)
+        nDecoys, nTaxa = len(shifts), len(self.taxa)
+        peaks = np.asarray(spectrum, dtype=float)
+        if not (nDecoys and len(peaks) and self.organisms):
+            return result
+        observed = np.zeros(nTaxa, dtype=np.int64)
+        taxonIndex = dict((taxon, i) for i, taxon in enumerate(self.taxa))
+        for rank, score in hits.items():
+            for (source, name), hit in score.items():
+                observed[taxonIndex[rank, source, name]] = hit
+
+        # One pass over the peaks of all decoys; decoys may share peaks
+        decoyPeaks = (peaks[np.newaxis, :] + shifts[:, np.newaxis]).ravel()
+        candidates = self.matchPeaks(decoyPeaks, lowerBound, upperBound,
+                                     tolerance, mode, unit)
+        decoyOf = np.repeat(np.arange(nDecoys), len(peaks))
+        peakDecoys = np.unique(candidates.inverse.astype(np.int64) * nDecoys +
+                               decoyOf)
+        start = np.searchsorted(peakDecoys // nDecoys,
+                                np.arange(len(candidates.peaks) + 1))
+        counts = (start[1:] - start[:-1])[candidates.peakIds]
+        entries = (np.repeat(start[candidates.peakIds] -
+                             (np.cumsum(counts) - counts), counts) +
+                   np.arange(counts.sum()))
+        candidate = np.repeat(np.arange(len(candidates)), counts)
+        decoy = (peakDecoys[entries] % nDecoys)[:, np.newaxis]
+
+        # Count every taxon once per matching peak of every decoy, like
+        # scoreCandidates does for the spectrum
+        taxonIds = self.taxonIds[:, [RANKS.index(rank) for rank in hits]]
+        peakIds = candidates.peakIds[candidate].astype(np.int64)[:, np.newaxis]
+        triples = np.unique((decoy * len(candidates.peaks) + peakIds) * nTaxa +
+                            taxonIds[candidates.organism[candidate]])
+        decoyTaxa, decoyHits = np.unique(
+            triples // (nTaxa * len(candidates.peaks)) * nTaxa +
+            triples % nTaxa, return_counts=True)
+        taxa = decoyTaxa % nTaxa
+        exceeding = np.bincount(taxa[decoyHits >= observed[taxa]],
+                                minlength=nTaxa)
+
+        for rank in hits:
+            column = RANKS.index(rank)
+            rankTaxa = np.unique(self.taxonIds[:, column])
+            targetHits = observed[rankTaxa]
+            # taxa with at least k hits, for k = 1 .. the most hits
+            maxHits = max(targetHits.max(), 1)
+            targets = np.cumsum(np.bincount(targetHits,
+                minlength=maxHits + 1)[::-1])[::-1]
+            isRank = np.in1d(taxa, rankTaxa)
+            decoys = np.cumsum(np.bincount(np.minimum(decoyHits[isRank],
+                maxHits), minlength=maxHits + 1)[::-1])[::-1]
+            fdr = np.minimum(decoys / float(nDecoys) /
+                             np.maximum(targets, 1), 1.0)
+            fdr[0] = 1.0
+            qValues = np.minimum.accumulate(fdr)
+            for i in rankTaxa[targetHits > 0]:
+                _, source, name = self.taxa[i]
+                result[rank][source, name] = (
+                    (1.0 + exceeding[i]) / (1.0 + nDecoys),
+                    float(qValues[observed[i]]))
+        return result
+
+    def save(self, fileName):
+        """Save the index to a file, replacing it atomically"""
+
+        tmpName = '%s.%d.tmp' % (fileName, os.getpid())
+        with open(tmpName, 'wb') as f:
+            np.savez(f, seqMass=self.seqMass, seqOrganism=self.seqOrganism,
+                     sources=np.array([s for s, n in self.organisms], dtype=object),
+                     names=np.array([n for s, n in self.organisms], dtype=object),
+                     lineages=np.array(self.lineages, dtype=object),
+                     proteinMass=self.proteinMass,
+                     markerMass=self.markerMass, markerStart=self.markerStart,
+                     postingProtein=self.postingProtein,
+                     postingOrganism=self.postingOrganism,
+                     info=np.array([sorted(self.info.items())], dtype=object),
+                     format=np.array(INDEX_FORMAT))
+        os.rename(tmpName, fileName)
+
+
+class CandidateSet(object):
+    """The biomarkers within the tolerance windows of the peaks of a spectrum
+
+    Every candidate is a biomarker of an organism, with the protein mass of
+    its sequence, within the window of a peak. A candidate set found with a
+    wide tolerance and mass range answers searches of the same spectrum
+    with any narrower tolerance and mass range, see MassIndex.matchPeaks.
+
+    Attributes:
+        peaks: Sorted distinct peaks of the spectrum
+        inverse: Index in peaks of every peak of the spectrum
+        shift: Mass of the charge of the peaks, see massShift
+        low, high: Neutral biomarker mass window of every peak
+        lowerBound, upperBound: Protein mass range of the candidates
+        peakIds: Index in peaks of the peak of every candidate
+        markerMass: Neutral biomarker mass of every candidate
+        proteinMass: Protein mass of the sequence of every candidate
+        organism: Index of the organism of every candidate
+    """
+
+    def __init__(self, peaks, inverse, shift, low, high, lowerBound,
+                 upperBound, peakIds, markerMass, proteinMass, organism):
+        self.peaks = peaks
+        self.inverse = inverse
+        self.shift = shift
+        self.low = low
+        self.high = high
+        self.lowerBound = lowerBound
+        self.upperBound = upperBound
+        self.peakIds = peakIds
+        self.markerMass = markerMass
+        self.proteinMass = proteinMass
+        self.organism = organism
+
+    def __len__(self):
+        return len(self.peakIds)
+
+    def windows(self, tolerance, unit="Da"):
+        """Return the neutral biomarker mass windows of the peaks"""
+
+        low, high = toleranceWindow(self.peaks, tolerance, unit)
+        return low - self.shift, high - self.shift
+
+    def covers(self, lowerBound, upperBound, tolerance, unit="Da"):
+        """Check if all matches of a search are among the candidates"""
+
+        low, high = self.windows(tolerance, unit)
+        return (float(lowerBound) >= self.lowerBound and
+                float(upperBound) <= self.upperBound and
+                bool((low >= self.low).all() and (high <= self.high).all()))
+
+    def select(self, lowerBound, upperBound, tolerance, unit="Da"):
+        """Return a boolean array of the candidates matching a search"""
+
+        low, high = self.windows(tolerance, unit)
+        return ((self.markerMass >= low[self.peakIds]) &
+                (self.markerMass <= high[self.peakIds]) &
+                (self.proteinMass >= float(lowerBound)) &
+                (self.proteinMass <= float(upperBound)))
+
+
+def decoyShifts(nDecoys, seed=0):
+    """Draw the mass shifts of decoy spectra
+
+    The shifts are between DECOY_MIN_SHIFT and DECOY_MAX_SHIFT in either
+    direction, except near the mass of a methionine, which would turn
+    biomarkers of cleaved sequences into matches. The same seed always
+    gives the same shifts.
+
+    Return:
+        A numpy array of nDecoys shifts
+    """
+
+    random = np.random.RandomState(seed)
+    shifts = np.zeros(0)
+    while len(shifts) < nDecoys:
+        drawn = random.uniform(DECOY_MIN_SHIFT, DECOY_MAX_SHIFT, nDecoys)
+        drawn = drawn[np.abs(drawn - MET) > 2 * DECOY_MIN_SHIFT]
+        shifts = np.concatenate([shifts, drawn])
+    signs = np.where(random.randint(0, 2, len(shifts)), 1.0, -1.0)
+    return (shifts * signs)[:nDecoys]
+
+
+def massShift(mode):
+    """Return the mass added to neutral masses by the mass spec mode"""
+
+    if mode == "Positive":
+        return PROTON
+    elif mode == "Negative":
+        return -PROTON
+    raise ValueError("Unknown mass spec mode: %r" % mode)
+
+
+def peakWeights(intensities, weighting):
+    """Compute the weights of the peaks of a spectrum from their intensities
+
+    Args:
+        intensities: Intensity of every peak
+        weighting: One of WEIGHTINGS. "intensity" weights every peak by its
+        share of the total intensity, "rank" by its rank by intensity, from
+        1 for the most intense down to 1 / K for the least intense of the K
+        peaks. "none" gives every peak the weight 1.
+
+    Return:
+        A numpy array of weights, or None for "none" or without intensities
+    """
+
+    if weighting not in WEIGHTINGS:
+        raise ValueError("Unknown peak weighting: %r" % weighting)
+    if weighting == "none" or intensities is None or not len(intensities):
+        return None
+    intensities = np.asarray(intensities, dtype=float)
+    if weighting == "intensity":
+        total = intensities.sum()
+        if total <= 0:
+            return None
+        return intensities / total
+    # the most intense peak gets the highest rank
+    ranks = np.empty(len(intensities))
+    ranks[np.argsort(intensities, kind='mergesort')] = np.arange(
+        1, len(intensities) + 1)
+    return ranks / len(intensities)
+
+
+def collapseMarkers(markerMass, markerProtein, markerOrganism):
+    """Collapse biomarkers into distinct masses with posting lists
+
+    Biomarkers with the same mass, protein mass and organism are kept once,
+    e.g. those of identical sequences of an organism.
+
+    Args:
+        markerMass: Neutral mass of every biomarker
+        markerProtein: Protein mass of the sequence of every biomarker
+        markerOrganism: Index of the organism of every biomarker
+
+    Return:
+        (proteinMass, markerMass, markerStart, postingProtein,
+        postingOrganism), see MassIndex
+    """
+
+    proteinMass, proteinIds = np.unique(np.asarray(markerProtein, dtype=float),
+                                        return_inverse=True)
+    markerMass = np.asarray(markerMass, dtype=float)
+    markerOrganism = np.asarray(markerOrganism)
+    order = np.lexsort((markerOrganism, proteinIds, markerMass))
+    mass = markerMass[order]
+    protein = proteinIds[order]
+    organism = markerOrganism[order]
+    new = np.ones(len(mass), dtype=bool)
+    new[1:] = ((mass[1:] != mass[:-1]) | (protein[1:] != protein[:-1]) |
+               (organism[1:] != organism[:-1]))
+    mass, protein, organism = mass[new], protein[new], organism[new]
+    first = np.ones(len(mass), dtype=bool)
+    first[1:] = mass[1:] != mass[:-1]
+    markerStart = np.append(np.flatnonzero(first), len(mass)).astype(np.int64)
+    return (proteinMass, mass[first], markerStart, protein.astype(np.int32),
+            organism.astype(np.int32))
+
+
+def loadIndex(fileName):
+    """Load an index saved with MassIndex.save
+
+    Return:
+        The MassIndex, or None if the file is in an outdated format
+    """
+
+    with open(fileName, 'rb') as f:
+        data = np.load(f, allow_pickle=True)
+        indexFormat = int(data['format'])
+        if indexFormat not in READ_FORMATS:
+            return None
+        lineages = None
+        if 'lineages' in data.files:
+            lineages = data['lineages'].tolist()
+        seqMass, seqOrganism = data['seqMass'], data['seqOrganism']
+        if indexFormat < 3:
+            markerSeq = data['markerSeq']
+            markers = collapseMarkers(data['markerMass'], seqMass[markerSeq],
+                                      seqOrganism[markerSeq])
+        else:
+            markers = (data['proteinMass'], data['markerMass'],
+                       data['markerStart'], data['postingProtein'],
+                       data['postingOrganism'])
+        return MassIndex(seqMass, seqOrganism,
+                         zip(data['sources'].tolist(), data['names'].tolist()),
+                         *markers, info=dict(data['info'][0]),
+                         lineages=lineages)
+
+
+def buildIndex(fileName, source, info=None):
+    """Compute the index of the sequences of a FASTA file
+
+    Sequences with ambiguous or unknown amino acids are left out, like
+    fastaFilter does. Organisms are named by their whole OS tag (see
+    readStrain) and their lineage is stored with the index.
+
+    Args:
+        fileName: Fasta file name
+        source: Name of the database, stored with the organisms
+        info: Dictionary describing the source of the index
+
+    Return:
+        A MassIndex
+    """
+
+    from Bio import SeqIO
+
+    seqMass, seqOrganism, metMass, metSeq = [], [], [], []
+    organisms = {}
+    with open(fileName, 'r') as fastaFile:
+        for seqRecord in SeqIO.parse(fastaFile, "fasta"):
+            sequence = str(seqRecord.seq)
+            try:
+                pMass = proteinMass(sequence)
+            except (KeyError, ValueError):
+                continue
+            organism = (source, readStrain(seqRecord.description))
+            if sequence.startswith("M"):
+                metMass.append(pMass - MET)
+                metSeq.append(len(seqMass))
+            seqOrganism.append(organisms.setdefault(organism, len(organisms)))
+            seqMass.append(pMass)
+    seqMass = np.array(seqMass, dtype=float)
+    seqOrganism = np.array(seqOrganism, dtype=np.int32)
+    markerSeq = np.concatenate([np.arange(len(seqMass), dtype=np.int32),
+                                np.array(metSeq, dtype=np.int32)])
+    markerMass = np.concatenate([seqMass, np.array(metMass, dtype=float)])
+    return MassIndex(seqMass, seqOrganism,
+                     sorted(organisms, key=organisms.get),
+                     *collapseMarkers(markerMass, seqMass[markerSeq],
+                                      seqOrganism[markerSeq]),
+                     info=info)
+
+
+def mergeIndexes(indexes):
+    """Merge indexes into one which is searched in a single pass"""
+
+    if len(indexes) == 1:
+        return indexes[0]
+    organisms, lineages = [], []
+    orgOffsets = np.cumsum([0] + [len(index.organisms) for index in indexes])
+    for index in indexes:
+        organisms.extend(index.organisms)
+        lineages.extend(index.lineages)
+    # expand the postings of every index and collapse them together
+    markerMass = np.concatenate([
+        np.repeat(index.markerMass, np.diff(index.markerStart))
+        for index in indexes])
+    markerProtein = np.concatenate([index.proteinMass[index.postingProtein]
+                                    for index in indexes])
+    markerOrganism = np.concatenate([index.postingOrganism + offset
+        for index, offset in zip(indexes, orgOffsets)])
+    return MassIndex(
+        np.concatenate([index.seqMass for index in indexes]),
+        np.concatenate([index.seqOrganism + offset
+                        for index, offset in zip(indexes, orgOffsets)]),
+        organisms, *collapseMarkers(markerMass, markerProtein, markerOrganism),
+        lineages=lineages)
@@ -1,42 +1,131 @@
 from collections import defaultdict
-from Bio import SeqIO
+import importlib
+import math
 import os.path
 
+# Biopython and scipy are imported by the first function which needs them,
+# so the web process can use the light functions of this module (like
+# readPeaks) without loading the scientific stack
+_modules = {}
+
+
+def _lazy(name):
+    """Import a module on first use and return it"""
+
+    module = _modules.get(name)
+    if module is None:
+        module = _modules[name] = importlib.import_module(name)
+    return module
+
 
 def readInput(spectrum):
     """Read the input from textbox and convert them to float type
 
     """
 
-    return map(float, spectrum.strip().split("\t"))
+    return readPeaks(spectrum)[0]
+
+
+def readPeaks(spectrum):
+    """Read a peak list from the textbox
+
+    The input is either a single line of tab separated m/z values, or one
+    peak per line: its m/z value optionally followed by its intensity,
+    separated by whitespace or a comma. A single line of two values not
+    separated by a tab is one peak and its intensity.
+
+    Args:
+        spectrum: Input text
+
+    Return:
+        (m/z values, intensities) lists of floats; intensities is None
+        unless every peak has one
+
+    Raises:
+        ValueError: If the input is not a peak list
+    """
+
+    rows = [row for row in spectrum.strip().splitlines() if row.strip()]
+    lines = [row.replace(",", " ").split() for row in rows]
+    if not lines:
+        raise ValueError("Empty peak list")
+    if len(lines) == 1 and (len(lines[0]) != 2 or "\t" in rows[0]):
+        return map(float, lines[0]), None
+    if any(len(line) > 2 for line in lines):
+        raise ValueError("Expected one m/z value and intensity per line")
+    mz = [float(line[0]) for line in lines]
+    if all(len(line) == 2 for line in lines):
+        return mz, [float(line[1]) for line in lines]
+    return mz, None
 
 
 def SelectFastaFile(database):
+    """Return the FASTA file of a database given by its title
+
+    Databases are configured in the registry (see mse.registry) now, this
+    only knows the two databases shipped with the application.
+    """
+
     if database == "Ribosomal Proteins in Bacteria: Reviewed":
-        return "/RiboReviewed.fasta"
+        return "RiboReviewed.fasta"
     elif database == "Ribosomal Proteins in Bacteria: Unreviewed":
         return "RiboUnreviewed.fasta"
-    
 
-def readOS(seqTitle):
-    """Extract OS tag from sequence description
 
-    Get the microorganism name from sequence title
+def readStrain(seqTitle):
+    """Extract the whole OS tag from sequence description
 
     Args:
         seqTitle: SequenceObject.description
 
     Return
-        Microorganism species name
+        Microorganism name including the strain, e.g.
+        "Escherichia coli (strain K12)"
     """
 
     i = 0
     x = seqTitle.find("=", i) + 1
     i = x + 1
     y = seqTitle.find("=", i) - 2
-    #return seqTitle[x:y].strip()
+    return seqTitle[x:y].strip()
+
+
+def readOS(seqTitle):
+    """Extract OS tag from sequence description
+
+    Get the microorganism name from sequence title
+
+    Args:
+        seqTitle: SequenceObject.description
+
+    Return
+        Microorganism species name
+    """
+
     # Only takes the first two words from OS tag
-    return " ".join(seqTitle[x:y].strip().split(None, 2)[:2])
+    return lineage(readStrain(seqTitle))[1]
+
+
+def lineage(strain):
+    """Derive the taxonomy lineage of a microorganism from its name
+
+    Args:
+        strain: Microorganism name as returned by readStrain
+
+    Return:
+        (strain, species, genus) tuple of names, see RANKS. The species is
+        the first two words of the name and the genus the first word.
+    """
+
+    words = strain.split(None, 2)
+    return strain, " ".join(words[:2]), " ".join(words[:1])
+
+
+# Taxonomy ranks of lineage, from the most to the least specific
+RANKS = ("strain", "species", "genus")
+
+# Ways to weight the peaks of a spectrum, see MassIndex.peakWeights
+WEIGHTINGS = ("none", "intensity", "rank")
 
 
 def proteinMass(seq):
@@ -50,10 +139,11 @@ def proteinMass(seq):
         Protein monoisotopic weight including one water molecule
 
     Raise:
-        KeyError when sequence contains ambiguous or unknown amino acids
+        KeyError (ValueError with newer Biopython versions) when sequence
+        contains ambiguous or unknown amino acids
     """
 
-    from Bio.SeqUtils.ProtParam import ProteinAnalysis
+    ProteinAnalysis = _lazy("Bio.SeqUtils.ProtParam").ProteinAnalysis
     # The second argument in the ProteinAnalysis constructor indicates
     # the weight of the amino acids will be calculated using their
     # monoisotopic mass, if set to true
@@ -68,7 +158,7 @@ def fastaFilter(fileName, lowerBound, upperBound):
     amino acid characters.
 
     Args:
-        fileName: Fasta file name
+        fileName: Fasta file name, relative to this directory or absolute
         lowerBound: The lower bound of protein weight
         upperBound: The upper bound of protein weight
 
@@ -77,14 +167,15 @@ def fastaFilter(fileName, lowerBound, upperBound):
 
         iterator(SeqObject1, SeqObject2...)
     """
+    SeqIO = _lazy("Bio.SeqIO")
     directory = os.path.dirname(__file__)
-    with open(directory+fileName, 'r') as fastaFile:
+    with open(os.path.join(directory, fileName), 'r') as fastaFile:
         for seqRecord in SeqIO.parse(fastaFile, "fasta"):
             # Use a try-except block to avoid illegal amino acid chars
             # including B, J, X, Z
             try:
                 pMass = proteinMass(str(seqRecord.seq))
-            except KeyError:
+            except (KeyError, ValueError):
                 continue
             if pMass >= float(lowerBound) and pMass <= float(upperBound):
                 # Convert the function into an iterator
@@ -126,7 +217,7 @@ def biomarker(sequence, mode):
         return [biomarkerValue]
 
 
-def isMatch(peak, biomarker, tolerance):
+def isMatch(peak, biomarker, tolerance, unit="Da"):
     """Check if spectral peak matches protein biomarker
 
     Args:
@@ -134,18 +225,71 @@ def isMatch(peak, biomarker, tolerance):
         biomarker: An array of biomarker values
         tolerance: Maximal difference between experimental weight and
         theoretical one that could be considered a match. float
+        unit: Unit of the tolerance, "Da" for an absolute difference or
+        "ppm" for parts per million of the theoretical weight
 
     Return:
         True / False
     """
 
     for each in biomarker:
-        if abs(float(peak) - each) <= float(tolerance):
+        if unit == "ppm":
+            allowed = float(tolerance) * 1e-6 * each
+        else:
+            allowed = float(tolerance)
+        if abs(float(peak) - each) <= allowed:
             return True
     return False
 
 
-def resultTable(spectrum, filteredSequences, tolerance, mode):
+def toleranceWindow(peak, tolerance, unit="Da"):
+    """Return the range of biomarker values a peak matches
+
+    Args:
+        peak: Spectral peak (float or numpy array)
+        tolerance: See isMatch
+        unit: See isMatch
+
+    Return:
+        (lowest, highest) biomarker value within tolerance of the peak. A
+        ppm tolerance is relative to the biomarker, so the window grows with
+        the mass of the peak.
+    """
+
+    tolerance = float(tolerance)
+    if unit == "ppm":
+        ratio = tolerance * 1e-6
+        return peak / (1 + ratio), peak / (1 - ratio)
+    elif unit == "Da":
+        return peak - tolerance, peak + tolerance
+    raise ValueError("Unknown tolerance unit: %r" % unit)
+
+
+def nStar(lowerBound, upperBound, tolerance, unit="Da"):
+    """Calculate the number of independent tolerance windows in a mass range
+
+    This is the nstar of pValue. With an absolute tolerance every window is
+    2 * tolerance wide. A ppm tolerance gives windows of 2 * ppm * 1e-6 * m
+    at mass m, so their number is the integral of dm / (2 * ppm * 1e-6 * m).
+
+    Args:
+        lowerBound: The lower bound of protein weight
+        upperBound: The upper bound of protein weight
+        tolerance: See isMatch
+        unit: See isMatch
+
+    Return:
+        nstar, float
+    """
+
+    if unit == "ppm":
+        if lowerBound <= 0:
+            raise ValueError("A ppm tolerance needs a positive lower bound")
+        return math.log(float(upperBound) / lowerBound) / (2 * tolerance * 1e-6)
+    return float(upperBound - lowerBound) / (2 * tolerance)
+
+
+def resultTable(spectrum, filteredSequences, tolerance, mode, unit="Da"):
     """Output result table for all the matches
 
     This function will find all the sequences that match each of the
@@ -157,6 +301,7 @@ def resultTable(spectrum, filteredSequences, tolerance, mode):
         filteredSequences: An array of post-filtering sequence objects
         tolerance: See above
         mode: See above
+        unit: Unit of the tolerance, see isMatch
 
     Return:
         A dictionary of which key is the peak and value is a list of
@@ -177,7 +322,7 @@ def resultTable(spectrum, filteredSequences, tolerance, mode):
         microbeName = readOS(seqRecord.description)
         dbSize[microbeName] += 1
         for peak in spectrum:
-            if isMatch(peak, biomarkerValue, tolerance):
+            if isMatch(peak, biomarkerValue, tolerance, unit):
                 hitDict[peak].append(seqRecord)
     return hitDict, dbSize
 
@@ -232,13 +377,12 @@ def pValue(bigK, k, n, nstar, bigN):
     :param bigK: number of total peaks
     :param k: number of matching peaks
     :param n: number of proteins
-    :param nstar: (maxMass - minMass) / (2 * tolerance)
+    :param nstar: number of tolerance windows in the mass range, see nStar
     :param bigN: number of total microorganisms (trials)
     :return: p-value, e-value
     """
 
-    from scipy import special
-    import math
+    special = _lazy("scipy.special")
 
     # chooseln(N, k) = lg(N Choose k)
     # special.gammaln(x) = (x-1)!
@@ -261,5 +405,46 @@ def pValue(bigK, k, n, nstar, bigN):
     return pvalue, evalue
 
 
+def rankResults(ranks, bigK, nstar, weighted=False, significance=None):
+    """Compute the significance of the matches of every rank
 
+    Args:
+        ranks: Dictionary of rank to (score, dbSize, weighted score), see
+        MassIndex.scoreCandidates
+        bigK: Number of peaks in the unknown spectrum
+        nstar: Number of tolerance windows in the mass range, see nStar
+        weighted: Whether the peaks were weighted
+        significance: Optional empirical significance of the matches, see
+        MassIndex.empiricalSignificance
+
+    Return:
+        A list of dictionaries with the rank, source, microorganism_name,
+        matching_hit, weighted_score (None if not weighted), p_value,
+        e_value, empirical_p_value and q_value (None without significance)
+        of every matching taxon, ordered by rank and descending number of
+        matches
+    """
 
+    rows = []
+    for rank in RANKS:
+        score, dbSize, weightedScore = ranks[rank]
+        bigN = len(dbSize)      # Number of taxa in the sequence files
+        for (source, microbe), hit in sortbyMatch(score):
+            n = dbSize[source, microbe] # Number of sequences of the taxon
+            pvalue, evalue = pValue(bigK, hit, n, nstar, bigN)
+            wscore = None   # Sum of the weights of the matching peaks
+            if weighted:
+                wscore = float('%.3g' % weightedScore[source, microbe])
+            empirical = qvalue = None
+            if significance is not None:
+                empirical, qvalue = significance[rank][source, microbe]
+                empirical = float('%.3g' % empirical)
+                qvalue = float('%.3g' % qvalue)
+            # Trim the number of significant figures to 3
+            rows.append(dict(rank=unicode(rank), source=source,
+                             microorganism_name=microbe, matching_hit=hit,
+                             weighted_score=wscore,
+                             p_value=float('%.3g' % pvalue),
+                             e_value=float('%.3g' % evalue),
+                             empirical_p_value=empirical, q_value=qvalue))
+    return rows
@@ -0,0 +1,101 @@
+"""Spectral library of identified spectra with an inverted index on mass bins
+
+Spectra are stored as binned sparse vectors: the peaks are put into mass
+bins of a fixed width, the square roots of their intensities are added up
+per bin and the vector is scaled to unit length. The library keeps a
+posting list per bin of the spectra with a peak in it, so the cosine
+similarity of a query to every library spectrum is computed by visiting
+only the bins of the query.
+"""
+
+import numpy as np
+
+# Default width of the mass bins, in Da
+BIN_WIDTH = 2.0
+
+
+def binSpectrum(spectrum, intensities=None, binWidth=BIN_WIDTH):
+    """Convert a peak list to a binned sparse vector
+
+    Args:
+        spectrum: A list of float numbers representing spectral peaks
+        intensities: Optional intensity of every peak; without intensities
+        every peak counts the same
+        binWidth: Width of the mass bins, in Da
+
+    Return:
+        (bins, values) numpy arrays: the sorted distinct bin numbers with
+        peaks and the values of the vector in these bins, of unit length
+    """
+
+    spectrum = np.asarray(spectrum, dtype=float)
+    if intensities is None:
+        intensities = np.ones(len(spectrum))
+    # square roots keep a few intense peaks from dominating the similarity
+    weights = np.sqrt(np.maximum(np.asarray(intensities, dtype=float), 0))
+    bins, inverse = np.unique(np.floor(spectrum / binWidth).astype(np.int64),
+                              return_inverse=True)
+    values = np.bincount(inverse, weights=weights, minlength=len(bins))
+    norm = np.sqrt(np.dot(values, values))
+    if norm > 0:
+        values = values / norm
+    return bins, values
+
+
+class SpectralLibrary(object):
+    """Binned spectra searchable by cosine similarity
+
+    Attributes:
+        keys: The key of every spectrum, in the order they were added
+        postings: Dictionary of bin number to two lists, the positions in
+        keys of the spectra with a peak in the bin and their values there
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.postings = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, bins, values):
+        """Add a spectrum binned by binSpectrum under the given key"""
+
+        entry = len(self.keys)
+        self.keys.append(key)
+        for b, value in zip(bins.tolist(), values.tolist()):
+            if value:
+                entries, entryValues = self.postings.setdefault(b, ([], []))
+                entries.append(entry)
+                entryValues.append(value)
+
+    def lookup(self, bins, values, limit=5, minSimilarity=0.0):
+        """Find the library spectra most similar to a binned spectrum
+
+        Args:
+            bins, values: The binned spectrum, see binSpectrum
+            limit: Maximal number of spectra returned
+            minSimilarity: Minimal cosine similarity of returned spectra
+
+        Return:
+            A list of (similarity, shared bins, key) tuples, most similar
+            first
+        """
+
+        entries, products = [], []
+        for b, value in zip(bins.tolist(), values.tolist()):
+            posting = self.postings.get(b)
+            if posting is not None:
+                entries.append(np.asarray(posting[0]))
+                products.append(value * np.asarray(posting[1]))
+        if not entries:
+            return []
+        entries = np.concatenate(entries)
+        similarity = np.bincount(entries, weights=np.concatenate(products),
+                                 minlength=len(self.keys))
+        shared = np.bincount(entries, minlength=len(self.keys))
+        candidates = np.flatnonzero((shared > 0) & (similarity >= minSimilarity))
+        best = candidates[np.argsort(-similarity[candidates],
+                                     kind='mergesort')][:limit]
+        return [(float(similarity[i]), int(shared[i]), self.keys[i])
+                for i in best]
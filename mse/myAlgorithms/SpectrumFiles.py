@@ -0,0 +1,278 @@
+"""Streaming readers of mass spectrometry data files
+
+Every reader takes an open file and yields the spectra in it one at a time
+as (title, m/z values, intensities) tuples of a string and numpy arrays;
+intensities is None if the file has none. Only the spectrum being read is
+kept in memory, so files of any size can be read:
+
+- MGF peak lists, read line by line,
+- mzXML and mzML files, parsed incrementally with iterparse; elements are
+  dropped as soon as their spectrum is done and the base64 encoded (and
+  optionally zlib compressed) peak arrays are decoded directly into numpy
+  arrays,
+- CSV files with the m/z value and intensity of one peak per row, and
+- the peak lists of the search form (see readPeaks) in any other file.
+
+Only MS1 spectra are read from mzXML and mzML files.
+"""
+
+from array import array
+import base64
+import os.path
+import re
+import zlib
+from xml.etree import cElementTree
+
+import numpy as np
+
+from ScoringAlgorithms import readPeaks
+
+# Controlled vocabulary accessions of the mzML arrays
+MZML_MZ = "MS:1000514"
+MZML_INTENSITY = "MS:1000515"
+MZML_FLOAT32 = "MS:1000521"
+MZML_FLOAT64 = "MS:1000523"
+MZML_ZLIB = "MS:1000574"
+MZML_MS_LEVEL = "MS:1000511"
+
+_number = re.compile(r"[,;\s]+")
+
+
+def decodePeaks(text, dtype, compressed=False):
+    """Decode a base64 encoded binary array
+
+    Args:
+        text: The base64 text
+        dtype: numpy data type of the values, with their byte order
+        compressed: Whether the data is zlib compressed
+
+    Return:
+        A read-only numpy array using the decoded data as its buffer
+
+    Raises:
+        ValueError: If the text is not a valid array
+    """
+
+    try:
+        data = base64.b64decode(text or "")
+        if compressed:
+            data = zlib.decompress(data)
+    except (TypeError, zlib.error), e:
+        raise ValueError("Invalid binary peak array: %s" % e)
+    if len(data) % np.dtype(dtype).itemsize:
+        raise ValueError("Invalid binary peak array length")
+    return np.frombuffer(data, dtype=dtype)
+
+
+def _arrays(mz, intensities):
+    mz = np.frombuffer(mz, dtype=float) if mz else np.zeros(0)
+    if intensities is None:
+        return mz, None
+    return mz, np.frombuffer(intensities, dtype=float) if intensities else \
+        np.zeros(0)
+
+
+def readMgf(f):
+    """Read the spectra of an MGF file
+
+    The peaks of a spectrum are one m/z value per line, optionally followed
+    by its intensity; the title is the TITLE parameter of the spectrum.
+    """
+
+    mz = None
+    for line in f:
+        line = line.strip()
+        if not line or line[0] in "#;!/":
+            continue
+        if line == "BEGIN IONS":
+            title, mz, intensities = None, array("d"), array("d")
+        elif mz is None:
+            continue    # a global parameter
+        elif line == "END IONS":
+            yield (title,) + _arrays(mz, intensities)
+            mz = None
+        elif line[0].isalpha():
+            key, _, value = line.partition("=")
+            if key.upper() == "TITLE":
+                title = value
+        else:
+            values = line.split()
+            mz.append(float(values[0]))
+            if intensities is not None and len(values) > 1:
+                intensities.append(float(values[1]))
+            else:
+                intensities = None
+
+
+def _localName(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _iterElements(f, tags):
+    """Parse an XML file incrementally
+
+    Yields (event, local name, element) for the start and end events of
+    the elements with the given local names. Elements are removed from their
+    parent after their end event, so only the open elements are in memory.
+    """
+
+    stack = []
+    for event, element in cElementTree.iterparse(f, ("start", "end")):
+        if event == "start":
+            stack.append(element)
+            name = _localName(element.tag)
+            if name in tags:
+                yield event, name, element
+        else:
+            stack.pop()
+            name = _localName(element.tag)
+            if name in tags:
+                yield event, name, element
+            element.clear()
+            if stack:
+                stack[-1].remove(element)
+
+
+def readMzXml(f):
+    """Read the MS1 spectra of an mzXML file
+
+    The title of a spectrum is its scan number.
+    """
+
+    scans = []  # attributes and peaks of the open (nested) scans
+    for event, name, element in _iterElements(f, ("scan", "peaks")):
+        if name == "scan":
+            if event == "start":
+                scans.append([dict(element.attrib), None])
+                continue
+            attrib, peaks = scans.pop()
+            if peaks is not None and int(attrib.get("msLevel", 1)) == 1:
+                yield (attrib.get("num"),) + peaks
+        elif event == "end" and scans:
+            attrib = element.attrib
+            order = attrib.get("pairOrder", attrib.get("contentType",
+                                                       "m/z-int"))
+            if order != "m/z-int":
+                raise ValueError("Unsupported peak order: %s" % order)
+            dtype = ">f%d" % (int(attrib.get("precision", 32)) // 8)
+            if attrib.get("byteOrder", "network") != "network":
+                dtype = "<" + dtype[1:]
+            pairs = decodePeaks(element.text, dtype,
+                                attrib.get("compressionType") == "zlib")
+            pairs = pairs.astype(float)
+            scans[-1][1] = (pairs[0::2], pairs[1::2])
+
+
+def readMzMl(f):
+    """Read the MS1 spectra of an mzML file
+
+    The title of a spectrum is its id.
+    """
+
+    spectrum = None
+    for event, name, element in _iterElements(
+            f, ("spectrum", "binaryDataArray", "cvParam", "binary")):
+        if name == "spectrum":
+            if event == "start":
+                spectrum = dict(id=element.get("id"), level=1)
+            else:
+                if spectrum["level"] == 1 and "mz" in spectrum:
+                    yield (spectrum["id"], spectrum["mz"],
+                           spectrum.get("intensity"))
+                spectrum = None
+        elif spectrum is None or event == "start":
+            continue
+        elif name == "cvParam":
+            accession = element.get("accession")
+            if accession == MZML_MS_LEVEL:
+                spectrum["level"] = int(element.get("value"))
+            else:
+                spectrum.setdefault("params", set()).add(accession)
+        elif name == "binary":
+            spectrum["binary"] = element.text
+        elif name == "binaryDataArray":
+            params = spectrum.pop("params", set())
+            dtype = "<f8" if MZML_FLOAT64 in params else "<f4"
+            if MZML_FLOAT32 not in params and MZML_FLOAT64 not in params:
+                raise ValueError("Unsupported binary data type in spectrum %s"
+                                 % spectrum["id"])
+            values = decodePeaks(spectrum.pop("binary", None), dtype,
+                                 MZML_ZLIB in params)
+            if MZML_MZ in params:
+                spectrum["mz"] = np.asarray(values, dtype=float)
+            elif MZML_INTENSITY in params:
+                spectrum["intensity"] = np.asarray(values, dtype=float)
+
+
+def readCsv(f, title=None):
+    """Read a spectrum with one peak per row from a CSV file
+
+    The first two columns are the m/z value and the intensity; rows which
+    do not start with a number, like a header, are skipped.
+    """
+
+    mz, intensities = array("d"), array("d")
+    for row in f:
+        values = _number.split(row.strip())
+        try:
+            peak = float(values[0])
+        except ValueError:
+            continue
+        mz.append(peak)
+        if intensities is not None and len(values) > 1:
+            intensities.append(float(values[1]))
+        else:
+            intensities = None
+    yield (title,) + _arrays(mz, intensities)
+
+
+def readText(f, title=None):
+    """Read a peak list like the one of the search form, see readPeaks"""
+
+    mz, intensities = readPeaks(f.read())
+    if intensities is not None:
+        intensities = np.array(intensities)
+    yield title, np.array(mz), intensities
+
+
+# Readers by file name extension
+READERS = {".mgf": readMgf, ".mzxml": readMzXml, ".mzml": readMzMl,
+           ".csv": readCsv}
+
+
+def readSpectra(f, fileName):
+    """Read the spectra of a file in the format given by its name
+
+    Args:
+        f: The open file
+        fileName: Name of the file; its extension selects the reader (see
+        READERS), other files are read as peak lists
+
+    Return:
+        An iterator of (title, m/z values, intensities) tuples; titles
+        missing in the file are the base name of fileName, numbered if the
+        file has several spectra
+    """
+
+    baseName, extension = os.path.splitext(os.path.basename(fileName))
+    reader = READERS.get(extension.lower())
+    if reader in (readMgf, readMzXml, readMzMl):
+        spectra = reader(f)
+    else:
+        spectra = (reader or readText)(f, baseName)
+    for i, (title, mz, intensities) in enumerate(spectra):
+        yield title or "%s %d" % (baseName, i + 1), mz, intensities
+
+
+def formatPeaks(mz, intensities=None):
+    """Format a spectrum as a peak list which readPeaks reads
+
+    Return:
+        One m/z value and intensity per line, separated by a space, or a
+        line of tab separated m/z values without intensities
+    """
+
+    if intensities is None:
+        return "\t".join(repr(float(peak)) for peak in mz)
+    return "\n".join("%r %r" % (float(peak), float(intensity))
+                     for peak, intensity in zip(mz, intensities))
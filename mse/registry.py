@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""This module contains the registry of the reference databases.
+
+The databases searches can run against are defined in the configuration:
+
+    mse.refdb.databases = ['reviewed', 'unreviewed']
+    mse.refdb.reviewed.title = 'Ribosomal Proteins in Bacteria: Reviewed'
+    mse.refdb.reviewed.path = '%(package_dir)s/myAlgorithms/RiboReviewed.fasta'
+    mse.refdb.reviewed.index = '/var/lib/mse/refdb/reviewed'
+
+The key of a database ('reviewed') is what searches store; the title is
+shown in the search form.
+
+Searches never read the FASTA files. They use releases of the databases:
+immutable MassIndex files in a directory per version below the index
+directory of the database (by default 'mse.refdb.store'/<key>). A file
+named CURRENT in the index directory names the current version. A new
+release is published (`ReferenceDatabase.publish`, the 'publish-db-mse'
+command) by building the index into a new version directory and then
+replacing CURRENT atomically, so it can be done while searches run.
+If a database has no release yet, its FASTA file is published the first
+time it is searched.
+
+Every search records the versions it used (`current_versions`) when it
+starts and is searched with exactly these (`search_index`), so the search
+worker switches to a new release between two searches. Releases which are
+no longer current are deleted by `collect_garbage` once no running search
+uses them and 'mse.refdb.gc_grace' seconds have passed.
+
+"""
+
+# symbols which are imported by "from mse.registry import *"
+__all__ = ['ReferenceDatabase', 'collect_garbage', 'current_versions',
+           'databases', 'database_options', 'default_databases',
+           'find_database', 'search_index']
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from turbogears import config
+
+log = logging.getLogger('mse.registry')
+
+# Number of merged indexes of combinations of databases kept in memory
+MERGED_INDEXES = 8
+
+CURRENT = 'CURRENT'
+RETIRED = 'RETIRED'
+INDEX_FILE = 'index.npz'
+
+_version_re = re.compile(r'^[\w.-]+$')
+
+_lock = threading.RLock()
+_indexes = {}   # (index directory, version) -> MassIndex
+_merged = OrderedDict()    # tuple of (key, version) -> merged MassIndex
+
+
+class ReferenceDatabase(object):
+    """A FASTA file of protein sequences searches can run against."""
+
+    def __init__(self, key, title=None, path=None, index=None):
+        self.key = key
+        self.title = title or key
+        self.path = path
+        if not index:
+            index = os.path.join(config.get('mse.refdb.store', 'refdb'), key)
+        self.index_dir = index
+
+    def __repr__(self):
+        return '<ReferenceDatabase %s %r>' % (self.key, self.path)
+
+    def versions(self):
+        """Return the versions of this database which are on disk."""
+        try:
+            names = os.listdir(self.index_dir)
+        except OSError:
+            return []
+        # versions being built are in hidden directories
+        return sorted(name for name in names if not name.startswith('.') and
+            os.path.exists(os.path.join(self.index_dir, name, INDEX_FILE)))
+
+    def current_version(self):
+        """Return the current version, publishing the FASTA file if none is."""
+        try:
+            with open(os.path.join(self.index_dir, CURRENT)) as f:
+                return f.read().strip()
+        except IOError:
+            pass
+        with _lock:
+            # check again, another thread may have published meanwhile
+            if not os.path.exists(os.path.join(self.index_dir, CURRENT)):
+                return self.publish()
+        return self.current_version()
+
+    def publish(self, path=None, version=None):
+        """Build the index of a FASTA file and make it the current version.
+
+        path defaults to the configured FASTA file and version to the time
+        and a hash of the file. Returns the version.
+        """
+        from mse.myAlgorithms.MassIndex import buildIndex
+        path = path or self.path
+        with open(path, 'rb') as f:
+            digest = hashlib.sha1()
+            for block in iter(lambda: f.read(1 << 20), ''):
+                digest.update(block)
+        if not version:
+            version = '%s-%s' % (time.strftime('%Y%m%d-%H%M%S'),
+                                 digest.hexdigest()[:8])
+        if not _version_re.match(version):
+            raise ValueError("Invalid version name: %r" % version)
+        target = os.path.join(self.index_dir, version)
+        if os.path.exists(target):
+            raise ValueError("Version %s of %s exists already"
+                             % (version, self.key))
+        if not os.path.isdir(self.index_dir):
+            os.makedirs(self.index_dir)
+        log.info("Building version %s of %s from %s", version, self.key, path)
+        index = buildIndex(path, self.key, dict(source=self.key,
+            version=version, path=os.path.abspath(path),
+            sha1=digest.hexdigest(), created=time.time()))
+        # build in a temporary directory, so versions are always complete
+        build = tempfile.mkdtemp(prefix='.%s-' % version, dir=self.index_dir)
+        try:
+            os.chmod(build, 0755)
+            index.save(os.path.join(build, INDEX_FILE))
+            os.rename(build, target)
+        except:
+            shutil.rmtree(build, ignore_errors=True)
+            raise
+        self.set_current(version)
+        return version
+
+    def set_current(self, version):
+        """Make an existing version the current one, atomically."""
+        if version not in self.versions():
+            raise ValueError("Unknown version %s of %s" % (version, self.key))
+        current = os.path.join(self.index_dir, CURRENT)
+        try:
+            with open(current) as f:
+                old = f.read().strip()
+        except IOError:
+            old = None
+        tmp = '%s.%d.tmp' % (current, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(version + '\n')
+        os.rename(tmp, current)
+        retired = os.path.join(self.index_dir, version, RETIRED)
+        if os.path.exists(retired):
+            os.remove(retired)
+        if old and old != version and old in self.versions():
+            # the grace period of garbage collection starts now
+            open(os.path.join(self.index_dir, old, RETIRED), 'w').close()
+        log.info("Version %s of %s is current", version, self.key)
+
+    def load_index(self, version):
+        """Return the MassIndex of a version of this database."""
+        from mse.myAlgorithms.MassIndex import loadIndex
+        with _lock:
+            index = _indexes.get((self.index_dir, version))
+            if index is None:
+                index = loadIndex(
+                    os.path.join(self.index_dir, version, INDEX_FILE))
+                if index is None:
+                    raise ValueError("Version %s of %s has an outdated format"
+                                     % (version, self.key))
+                _indexes[self.index_dir, version] = index
+            return index
+
+
+def databases():
+    """Return the configured reference databases in their order."""
+    result = []
+    for key in config.get('mse.refdb.databases', []):
+        prefix = 'mse.refdb.%s.' % key
+        result.append(ReferenceDatabase(key,
+            title=config.get(prefix + 'title'),
+            path=config.get(prefix + 'path'),
+            index=config.get(prefix + 'index')))
+    return result
+
+
+def find_database(name):
+    """Return the database with the given key or title, or None.
+
+    Searches created before the registry existed store the title.
+    """
+    for db in databases():
+        if name in (db.key, db.title):
+            return db
+    return None
+
+
+def database_options():
+    """Return (key, title) tuples of the databases for select fields."""
+    return [(db.key, db.title) for db in databases()]
+
+
+def default_databases():
+    """Return the keys of the databases searched by default."""
+    default = config.get('mse.refdb.default')
+    if isinstance(default, basestring):
+        default = default.split(',')
+    if default:
+        return list(default)
+    return [db.key for db in databases()[:1]]
+
+
+def _find_databases(names):
+    if isinstance(names, basestring):
+        names = names.split(',')
+    dbs = []
+    for name in names:
+        db = find_database(name.strip())
+        if db is None:
+            raise KeyError("Unknown reference database: %s" % name)
+        if db.key not in [d.key for d in dbs]:
+            dbs.append(db)
+    return dbs
+
+
+def current_versions(names):
+    """Return the current versions of the given databases.
+
+    names is a sequence of database keys or titles, or a comma separated
+    string of them, as stored in SearchList.database. The versions are
+    returned as a string like 'reviewed@v1,unreviewed@v2', to be stored in
+    SearchList.db_version.
+    """
+    return u','.join(u'%s@%s' % (db.key, db.current_version())
+                     for db in _find_databases(names))
+
+
+def search_index(versions):
+    """Return the index to search the given versions in a single pass.
+
+    versions is a string returned by current_versions. Merged indexes of
+    recently searched combinations are kept in memory.
+    """
+    from mse.myAlgorithms.MassIndex import mergeIndexes
+    pairs = tuple(tuple(item.split('@', 1)) for item in versions.split(','))
+    with _lock:
+        merged = _merged.pop(pairs, None)
+        if merged is None:
+            dbs = _find_databases([key for key, version in pairs])
+            merged = mergeIndexes([db.load_index(version)
+                                   for db, (key, version) in zip(dbs, pairs)])
+        _merged[pairs] = merged
+        while len(_merged) > MERGED_INDEXES:
+            _merged.popitem(last=False)
+    return merged
+
+
+def _running_versions():
+    """Return the (key, version) pairs used by running searches."""
+    from mse.database import transaction
+    from mse.model import SearchList
+    used = set()
+    with transaction():
+        for s in SearchList.selectBy(status=u'Running'):
+            for item in (s.db_version or u'').split(','):
+                if '@' in item:
+                    used.add(tuple(item.split('@', 1)))
+    return used
+
+
+def collect_garbage(grace=None):
+    """Delete the releases which are no longer needed.
+
+    A version is deleted if it is not current, no running search uses it
+    and it was retired more than grace seconds (by default the setting
+    'mse.refdb.gc_grace', one hour) ago. The grace period covers searches
+    which just read the old CURRENT file but have not been marked as
+    running yet. Indexes of versions which are not current are also
+    dropped from memory. Returns the number of deleted versions.
+    """
+    if grace is None:
+        grace = config.get('mse.refdb.gc_grace', 3600)
+    used = _running_versions()
+    deleted = 0
+    for db in databases():
+        try:
+            with open(os.path.join(db.index_dir, CURRENT)) as f:
+                current = f.read().strip()
+        except IOError:
+            continue
+        for version in db.versions():
+            if version == current:
+                continue
+            with _lock:
+                _indexes.pop((db.index_dir, version), None)
+                for pairs in [p for p in _merged if (db.key, version) in p]:
+                    del _merged[pairs]
+            retired = os.path.join(db.index_dir, version, RETIRED)
+            if (db.key, version) in used or not os.path.exists(retired) or (
+                    time.time() - os.path.getmtime(retired) < grace):
+                continue
+            log.info("Deleting version %s of %s", version, db.key)
+            shutil.rmtree(os.path.join(db.index_dir, version))
+            deleted += 1
+    return deleted
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""This module contains the SQL profiler of the application.
+
+The profiler is switched on by `install` (called by the start-mse command)
+with the following configuration options, all of which are off by default:
+
+    # log every statement slower than this many seconds to 'mse.sql'
+    mse.sql.slow_threshold = 0.5
+    # count the statements of every request and log a summary
+    mse.sql.profile = True
+    # warn if a request runs the same statement this often (N+1 queries)
+    mse.sql.n_plus_one = 10
+
+Statements are compared after replacing their literals with '?', so the
+per-row lookups of a foreign key like SearchList.user, which only differ
+in the ID, are recognized as the same statement. Slow statements, queries
+per request and N+1 patterns are also counted in the metrics.
+
+"""
+
+# symbols which are imported by "from mse.sqlprofile import *"
+__all__ = ['RequestProfile', 'install', 'normalize']
+
+import logging
+import re
+import threading
+
+import cherrypy
+from turbogears import config
+
+from mse import database, metrics
+
+log = logging.getLogger('mse.sql')
+
+# Length to which statements are shortened in log messages
+LOG_LENGTH = 500
+
+request_queries = metrics.Histogram('mse_request_queries',
+    "Number of statements executed per profiled request.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+slow_queries = metrics.Counter('mse_slow_queries_total',
+    "Number of statements slower than mse.sql.slow_threshold.")
+n_plus_one = metrics.Counter('mse_n_plus_one_total',
+    "Number of requests which repeated a statement mse.sql.n_plus_one times.",
+    ['handler'])
+
+_literal_re = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_list_re = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_space_re = re.compile(r'\s+')
+
+_profiles = threading.local()
+_settings = {}
+
+
+def normalize(statement):
+    """Return statement with all literals replaced by '?'."""
+    statement = _literal_re.sub('?', statement)
+    statement = _list_re.sub('(?)', statement)
+    return _space_re.sub(' ', statement).strip()
+
+
+def _shorten(statement):
+    if len(statement) > LOG_LENGTH:
+        return statement[:LOG_LENGTH] + '...'
+    return statement
+
+
+class RequestProfile(object):
+    """The statements executed while handling a request.
+
+    name describes the request in log messages; handler names the
+    controller method handling it, which unlike the path of the request
+    has few distinct values and can label metrics.
+    """
+
+    def __init__(self, name, handler=None):
+        self.name = name
+        self.handler = handler
+        self.count = 0
+        self.duration = 0.0
+        self.statements = {}
+
+    def add(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        key = normalize(statement)
+        self.statements[key] = self.statements.get(key, 0) + 1
+
+    def repeated(self, times):
+        """Return the SELECT statements run at least times times.
+
+        Returns a list of (count, statement) tuples, most frequent first.
+        """
+        return sorted(((count, statement)
+                       for statement, count in self.statements.items()
+                       if count >= times and statement.upper().startswith(
+                           'SELECT')), reverse=True)
+
+
+def _current_name():
+    request = cherrypy.serving.request
+    return '%s %s' % (request.method, request.path_info)
+
+
+def _current_handler():
+    """Return the name of the method handling the current request."""
+    func = getattr(cherrypy.serving.request.handler, 'callable', None)
+    name = getattr(func, '__name__', None)
+    if name is None:
+        # served by a tool, like the static files
+        return 'none'
+    owner = getattr(func, 'im_class', None)
+    return owner and '%s.%s' % (owner.__name__, name) or name
+
+
+def _observe_query(statement, duration):
+    profile = getattr(_profiles, 'profile', None)
+    if profile is not None:
+        profile.add(statement, duration)
+    threshold = _settings.get('slow_threshold')
+    if threshold is not None and duration >= threshold:
+        slow_queries.inc()
+        log.warning("Slow statement (%.1f ms)%s: %s", duration * 1000,
+                    profile is not None and ' in %s' % profile.name or '',
+                    _shorten(statement))
+
+
+def start_profile():
+    """Start profiling the statements of the current request."""
+    _profiles.profile = RequestProfile(_current_name(), _current_handler())
+    cherrypy.serving.request.hooks.attach('on_end_request', end_profile)
+
+
+def end_profile():
+    """Log the statements of the current request and stop profiling them."""
+    profile = getattr(_profiles, 'profile', None)
+    if profile is None:
+        return
+    _profiles.profile = None
+    request_queries.observe(profile.count)
+    log.debug("%s: %d statements in %.1f ms", profile.name, profile.count,
+              profile.duration * 1000)
+    times = _settings.get('n_plus_one')
+    if times:
+        repeated = profile.repeated(times)
+        if repeated:
+            n_plus_one.inc(handler=profile.handler)
+        for count, statement in repeated:
+            log.warning("Possible N+1 query in %s, %d times: %s",
+                        profile.name, count, _shorten(statement))
+
+cherrypy.tools.sql_profile = cherrypy.Tool('on_start_resource', start_profile)
+
+
+def install():
+    """Switch the profiler on as configured.
+
+    This must be called after the configuration has been read.
+
+    """
+    threshold = config.get('mse.sql.slow_threshold')
+    if threshold is not None:
+        threshold = float(threshold)
+    _settings.update(slow_threshold=threshold,
+                     n_plus_one=int(config.get('mse.sql.n_plus_one', 10)))
+    profile = config.get('mse.sql.profile', False)
+    if profile:
+        config.update({'tools.sql_profile.on': True})
+    if (profile or _settings['slow_threshold'] is not None) and (
+            _observe_query not in database.query_hooks):
+        database.query_hooks.append(_observe_query)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""Unit test cases for testing the search algorithms.
+
+The mass index must find exactly the matches the original algorithms in
+ScoringAlgorithms find, only faster.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from mse.myAlgorithms.ScoringAlgorithms import (fastaFilter, matchNum,
+    nStar, proteinMass, readPeaks, resultTable)
+from mse.myAlgorithms.MassIndex import (PROTON, buildIndex, decoyShifts,
+    loadIndex, mergeIndexes, peakWeights)
+from mse.myAlgorithms.SpectralLibrary import SpectralLibrary, binSpectrum
+
+FASTA = """\
+>sp|P0A7V0|RS2_ECOLI 30S ribosomal protein S2 OS=Escherichia coli (strain K12) GN=rpsB PE=1 SV=2
+MATVSMRDMLKAGVHFGHQTRYWNPKMKPFIFGARNKVHIINLEKTVPMFNEALAELNKIASRKGKILFVGTKRAASEAVK
+>sp|P0A7W7|RS8_ECOLI 30S ribosomal protein S8 OS=Escherichia coli (strain K12) GN=rpsH PE=1 SV=2
+SMQDPIADMLTRIRNGQAANKAAVTMPSSKLKVAIANVLKEEGFIEDFKVEGDTKPELELTLKYFQGKAVVESIQRVSRPGLRIYKRKDELPKVMAGLGIAVVSTSKGVMTDRAARQAGLGGEIICYVA
+>sp|P21464|RS2_BACSU 30S ribosomal protein S2 OS=Bacillus subtilis (strain 168) GN=rpsB PE=3 SV=2
+MSVISMKQLLEAGVHFGHQTRRWNPKMKKYIFTERNGIYIIDLQKTVKKVEEAYNFTKNLAAEGGKILFVGTKKQAQDSVK
+>sp|P12345|RSX_BACSU ambiguous protein OS=Bacillus subtilis (strain 168) GN=rpsX PE=3 SV=1
+MKVLBZX
+"""
+
+
+class TestMassIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fasta = os.path.join(self.directory, 'test.fasta')
+        with open(self.fasta, 'w') as f:
+            f.write(FASTA)
+        self.index = buildIndex(self.fasta, 'test')
+        masses = sorted(self.index.seqMass)
+        self.spectrum = [masses[0] + PROTON + 0.5, masses[1] + PROTON - 1.5,
+                         masses[1] + PROTON - 131.0404, 20000.0]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_build_index(self):
+        """Sequences with ambiguous amino acids should be left out."""
+        assert len(self.index) == 3
+        assert sorted(self.index.organisms) == [
+            ('test', 'Bacillus subtilis (strain 168)'),
+            ('test', 'Escherichia coli (strain K12)')]
+        assert sorted(self.index.lineages) == [
+            ('Bacillus subtilis (strain 168)', 'Bacillus subtilis', 'Bacillus'),
+            ('Escherichia coli (strain K12)', 'Escherichia coli',
+             'Escherichia')]
+        assert list(self.index.markerMass) == sorted(self.index.markerMass)
+
+    def test_search_matches_result_table(self):
+        """The index should find the matches resultTable finds."""
+        for mode in ("Positive", "Negative"):
+            for tolerance in (0.1, 2.0, 200.0):
+                result, dbSize = resultTable(self.spectrum,
+                    fastaFilter(self.fasta, 4000, 15000), tolerance, mode)
+                score, size = self.index.search(self.spectrum, 4000, 15000,
+                                                tolerance, mode)
+                assert score == dict((('test', name), hits)
+                    for name, hits in matchNum(result).items())
+                assert size == dict((('test', name), n)
+                    for name, n in dbSize.items())
+
+    def test_search_ppm_matches_result_table(self):
+        """Tolerances in ppm should find the matches resultTable finds."""
+        for mode in ("Positive", "Negative"):
+            for tolerance in (10, 200, 20000):
+                result, dbSize = resultTable(self.spectrum,
+                    fastaFilter(self.fasta, 4000, 15000), tolerance, mode,
+                    "ppm")
+                score, size = self.index.search(self.spectrum, 4000, 15000,
+                                                tolerance, mode, "ppm")
+                assert score == dict((('test', name), hits)
+                    for name, hits in matchNum(result).items())
+
+    def test_nstar(self):
+        """nStar should count the tolerance windows in the mass range."""
+        assert nStar(4000, 20000, 2.0) == 4000
+        # windows of 1000 ppm at 10000 Da are 20 Da wide
+        assert abs(nStar(9990, 10010, 1000, "ppm") - 1.0) < 1e-3
+
+    def test_search_mass_range(self):
+        """Sequences outside of the mass range should not match."""
+        mass = proteinMass(FASTA.split('\n')[1])
+        score, size = self.index.search(self.spectrum, mass + 1, 20000,
+                                        2.0, "Positive")
+        assert size == {('test', 'Escherichia coli'): 1,
+                        ('test', 'Bacillus subtilis'): 1}
+
+    def test_search_ranks(self):
+        """All ranks should be scored like searches at one rank."""
+        ranks = self.index.searchRanks(self.spectrum, 4000, 15000, 200.0,
+                                       "Positive")
+        assert sorted(ranks) == ['genus', 'species', 'strain']
+        assert ranks['species'][:2] == self.index.search(
+            self.spectrum, 4000, 15000, 200.0, "Positive")
+        score, size, weighted = ranks['genus']
+        assert size == {('test', 'Escherichia'): 2, ('test', 'Bacillus'): 1}
+        score, size, weighted = ranks['strain']
+        assert size == {('test', 'Escherichia coli (strain K12)'): 2,
+                        ('test', 'Bacillus subtilis (strain 168)'): 1}
+
+    def test_weighted_score(self):
+        """Weighted scores should add the weights of the matching peaks."""
+        weights = [0.5, 0.25, 0.125, 0.125]
+        ranks = self.index.searchRanks(self.spectrum, 4000, 15000, 200.0,
+                                       "Positive", weights=weights)
+        for rank, (score, size, weighted) in ranks.items():
+            assert sorted(weighted) == sorted(score)
+            for taxon, hits in score.items():
+                assert 0 < weighted[taxon] <= sum(weights[:hits])
+        score, size, weighted = self.index.searchRanks(self.spectrum, 4000,
+            15000, 200.0, "Positive")['species']
+        assert weighted == score
+
+    def test_collapse_identical_sequences(self):
+        """Identical sequences of an organism should share their postings."""
+        fasta = os.path.join(self.directory, 'duplicate.fasta')
+        with open(fasta, 'w') as f:
+            f.write(FASTA + '\n'.join(FASTA.split('\n')[:2]) + '\n')
+        index = buildIndex(fasta, 'test')
+        assert len(index) == 4
+        assert len(index.markerMass) == len(self.index.markerMass)
+        assert len(index.postingProtein) == len(self.index.postingProtein)
+        result, dbSize = resultTable(self.spectrum,
+            fastaFilter(fasta, 4000, 15000), 2.0, "Positive")
+        score, size = index.search(self.spectrum, 4000, 15000, 2.0,
+                                   "Positive")
+        assert score == dict((('test', name), hits)
+            for name, hits in matchNum(result).items())
+        assert size[('test', 'Escherichia coli')] == 3
+
+    def test_rescore_candidates(self):
+        """Candidates of a wide search should answer narrower searches."""
+        candidates = self.index.matchPeaks(self.spectrum, 4000, 15000, 200.0,
+                                           "Positive")
+        for lowerBound, upperBound, tolerance, unit in [
+                (4000, 15000, 2.0, "Da"), (5000, 12000, 200.0, "Da"),
+                (4000, 15000, 100, "ppm")]:
+            assert candidates.covers(lowerBound, upperBound, tolerance, unit)
+            assert self.index.scoreCandidates(candidates, lowerBound,
+                upperBound, tolerance, unit) == self.index.searchRanks(
+                self.spectrum, lowerBound, upperBound, tolerance, "Positive",
+                unit)
+        assert not candidates.covers(4000, 15000, 300.0)
+        assert not candidates.covers(3000, 15000, 2.0)
+        wider = self.index.matchPeaks(self.spectrum, 3000, 14000, 2.0,
+                                      "Positive", widen=candidates)
+        assert wider.covers(3000, 15000, 200.0)
+        assert len(wider) >= len(candidates)
+
+    def test_match_peaks_windows(self):
+        """Only the biomarkers within the window of a peak should be visited."""
+        candidates = self.index.matchPeaks(self.spectrum, 0, 100000, 2.0,
+                                           "Positive")
+        for peak, mass in zip(candidates.peakIds, candidates.markerMass):
+            assert candidates.low[peak] <= mass <= candidates.high[peak]
+        # all postings of the biomarker masses within a window, no others
+        markers = self.index.markerMass
+        starts = self.index.markerStart
+        postings = 0
+        for low, high in zip(candidates.low, candidates.high):
+            postings += sum(starts[i + 1] - starts[i]
+                            for i in range(len(markers))
+                            if low <= markers[i] <= high)
+        assert len(candidates) == postings > 0
+        assert len(self.index.matchPeaks([100.0], 0, 100000, 2.0,
+                                         "Positive")) == 0
+
+    def test_save_and_merge(self):
+        """Saved and merged indexes should find the same matches."""
+        fileName = os.path.join(self.directory, 'test.npz')
+        self.index.save(fileName)
+        loaded = loadIndex(fileName)
+        other = buildIndex(self.fasta, 'other')
+        merged = mergeIndexes([loaded, other])
+        score, size = self.index.search(self.spectrum, 4000, 15000, 2.0,
+                                        "Positive")
+        merged_score, merged_size = merged.search(self.spectrum, 4000, 15000,
+                                                  2.0, "Positive")
+        assert loaded.lineages == self.index.lineages
+        assert len(merged_score) == 2 * len(score)
+        for (source, name), hits in score.items():
+            assert merged_score[source, name] == hits
+            assert merged_score['other', name] == hits
+
+    def test_empirical_significance(self):
+        """Decoys matched in one pass should count like separate searches."""
+        ranks = self.index.searchRanks(self.spectrum, 4000, 15000, 2.0,
+                                       "Positive")
+        hits = dict((rank, ranks[rank][0]) for rank in ranks)
+        shifts = decoyShifts(20)
+        assert len(shifts) == 20 and np.all(np.abs(shifts) >= 10)
+        assert np.all(decoyShifts(20) == shifts)
+        # a decoy shifted onto the spectrum matches like the spectrum
+        shifts[0] = 0.0
+        significance = self.index.empiricalSignificance(self.spectrum, 4000,
+            15000, 2.0, "Positive", "Da", hits, shifts)
+        decoys = [self.index.searchRanks(np.array(self.spectrum) + shift,
+                                         4000, 15000, 2.0, "Positive")
+                  for shift in shifts]
+        for rank in hits:
+            assert sorted(significance[rank]) == sorted(hits[rank])
+            for taxon, hit in hits[rank].items():
+                exceeding = len([decoy for decoy in decoys
+                                 if decoy[rank][0].get(taxon, 0) >= hit])
+                assert exceeding >= 1
+                pValue, qValue = significance[rank][taxon]
+                assert abs(pValue - (1.0 + exceeding) / 21) < 1e-12
+                assert 0 < qValue <= 1
+
+
+class TestPeakList(unittest.TestCase):
+
+    def test_read_peaks(self):
+        """Both the tab separated and the peak per line input should be read."""
+        assert readPeaks("1000.5\t2000\t3000\n") == (
+            [1000.5, 2000.0, 3000.0], None)
+        assert readPeaks("1000.5 10\n2000,20\n\n3000\t5") == (
+            [1000.5, 2000.0, 3000.0], [10.0, 20.0, 5.0])
+        assert readPeaks("1000.5 10\n2000") == ([1000.5, 2000.0], None)
+        # a single peak with its intensity
+        assert readPeaks("1000.5 10\n") == ([1000.5], [10.0])
+        assert readPeaks("1000.5,10") == ([1000.5], [10.0])
+        assert readPeaks("1000.5\t10") == ([1000.5, 10.0], None)
+        assert readPeaks("1000.5") == ([1000.5], None)
+        self.assertRaises(ValueError, readPeaks, "1000 10 1\n2000 20")
+        self.assertRaises(ValueError, readPeaks, "1000\tabc")
+        self.assertRaises(ValueError, readPeaks, " ")
+
+    def test_peak_weights(self):
+        """Peaks should be weighted by their share or rank of intensity."""
+        assert peakWeights([10, 30], "none") is None
+        assert peakWeights(None, "rank") is None
+        assert list(peakWeights([10, 30], "intensity")) == [0.25, 0.75]
+        assert list(peakWeights([10, 30, 20], "rank")) == [1 / 3.0, 1, 2 / 3.0]
+        self.assertRaises(ValueError, peakWeights, [1], "log")
+
+
+class TestSpectralLibrary(unittest.TestCase):
+
+    def setUp(self):
+        self.library = SpectralLibrary()
+        self.spectra = {'a': [4365.4, 5381.2, 6241.3, 7158.8, 9536.6],
+                        'b': [4365.4, 5096.8, 6315.2, 7871.0, 9742.4],
+                        'c': [3000.0, 3500.0]}
+        for key in sorted(self.spectra):
+            self.library.add(key, *binSpectrum(self.spectra[key]))
+
+    def test_bin_spectrum(self):
+        """Binned spectra should have unit length and one value per bin."""
+        bins, values = binSpectrum([1000.1, 1001.9, 1003.0], [1, 4, 9])
+        assert list(bins) == [500, 501]
+        assert abs((values ** 2).sum() - 1) < 1e-12
+        assert abs(values[0] / values[1] - 1.0) < 1e-12
+
+    def test_lookup(self):
+        """The most similar spectra should be found first."""
+        bins, values = binSpectrum(self.spectra['a'][:4] + [8000.0])
+        matches = self.library.lookup(bins, values)
+        assert [key for similarity, shared, key in matches] == ['a', 'b']
+        assert [shared for similarity, shared, key in matches] == [4, 1]
+        assert abs(matches[0][0] - 0.8) < 1e-9
+        assert self.library.lookup(bins, values, minSimilarity=0.5) == [
+            matches[0]]
+        assert self.library.lookup(*binSpectrum([100.0])) == []
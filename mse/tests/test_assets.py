@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Unit test cases for testing the build and serving of static assets."""
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import cherrypy
+from cherrypy import _cprequest
+
+from mse import assets
+from mse.assets import asset_url, build_assets, minify_css, serve_asset
+
+STYLE = """\
+/*! License */
+body {
+    color : red;   /* the color */
+    background: url("../fonts/bg.png?v=1");
+}
+"""
+
+
+class TestAssets(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.saved = dict((name, getattr(assets, name))
+                          for name in ('STATIC_DIR', 'BUILD_DIR', 'BUNDLES'))
+        assets.STATIC_DIR = self.directory
+        assets.BUILD_DIR = os.path.join(self.directory, 'build')
+        assets.BUNDLES = {'test.css': ['css/style.css', 'css/lib.min.css'],
+                          'test.js': ['js/a.js', 'js/b.js']}
+        files = {'css/style.css': STYLE, 'css/lib.min.css': 'p{margin:0}',
+                 'fonts/bg.png': '\x89PNG', 'js/a.js': 'var a = 1\n' * 100,
+                 'js/b.js': 'var b = 2;\n//# sourceMappingURL=b.js.map\n'}
+        for name, data in files.items():
+            path = os.path.join(self.directory, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(data)
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(assets, name, value)
+        assets._manifest.clear()
+        shutil.rmtree(self.directory)
+
+    def _read(self, name):
+        with open(os.path.join(assets.BUILD_DIR, name), 'rb') as f:
+            return f.read()
+
+    def test_minify_css(self):
+        """Comments and whitespace should go, license comments stay."""
+        # the space before a colon can be part of a selector (a :hover)
+        assert minify_css(STYLE) == ('/*! License */ body{color : red;'
+            'background: url("../fonts/bg.png?v=1")}')
+
+    def test_build_assets(self):
+        """Bundles should be joined in order and named by their content."""
+        assert asset_url('test.css') is None
+        manifest = build_assets()
+        css = self._read(manifest['test.css'])
+        assert css.index('color : red') < css.index('p{margin:0}')
+        font = [name for name in os.listdir(assets.BUILD_DIR)
+                if name.startswith('bg.')]
+        assert len(font) == 1
+        assert "url('%s?v=1')" % font[0] in css
+        js = self._read(manifest['test.js'])
+        assert 'var a = 1;\nvar b = 2;' in js
+        assert 'sourceMappingURL' not in js
+        assert gzip.GzipFile(fileobj=StringIO(self._read(
+            manifest['test.js'] + '.gz'))).read() == js
+        # the font would not get smaller
+        assert not os.path.exists(os.path.join(assets.BUILD_DIR,
+                                               font[0] + '.gz'))
+        assert asset_url('test.js') == assets.BUILD_URL + manifest['test.js']
+        assert asset_url('spam.js') is None
+
+    def test_fingerprint(self):
+        """A changed file should change the name of its bundle only."""
+        old = build_assets()
+        assert asset_url('test.css') == assets.BUILD_URL + old['test.css']
+        with open(os.path.join(self.directory, 'js', 'b.js'), 'ab') as f:
+            f.write('var c = 3;\n')
+        new = build_assets()
+        assert new['test.css'] == old['test.css']
+        assert new['test.js'] != old['test.js']
+        assert asset_url('test.js') == assets.BUILD_URL + new['test.js']
+
+    def _serve(self, name, method='GET', encoding=None):
+        request = _cprequest.Request(None, None)
+        request.method = method
+        request.path_info = assets.BUILD_URL + name
+        if encoding:
+            request.headers['Accept-Encoding'] = encoding
+        response = _cprequest.Response()
+        cherrypy.serving.load(request, response)
+        try:
+            return serve_asset(assets.BUILD_DIR), response
+        finally:
+            cherrypy.serving.clear()
+
+    def test_serve_asset(self):
+        """Built files should be served precompressed to gzip clients."""
+        name = build_assets()['test.js']
+        served, response = self._serve(name, encoding='gzip, deflate')
+        assert served
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.headers['Vary'] == 'Accept-Encoding'
+        assert 'max-age=%d' % assets.MAX_AGE in \
+            response.headers['Cache-Control']
+        assert ''.join(response.body) == self._read(name + '.gz')
+        served, response = self._serve(name, encoding='gzip;q=0')
+        assert served and 'Content-Encoding' not in response.headers
+        assert ''.join(response.body) == self._read(name)
+        assert not self._serve(assets.MANIFEST)[0]
+        assert not self._serve('spam.js')[0]
+        assert not self._serve(name, method='POST')[0]
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Unit test cases for testing the search worker."""
+
+import os
+import shutil
+import tempfile
+
+from turbogears import config
+from turbogears.testutil import DBTest
+
+from mse import async, metrics, registry
+from mse.database import transaction
+from mse.model import SearchList, User
+from mse.myAlgorithms.MassIndex import PROTON
+from mse.myAlgorithms.PeakPicking import searchPeaks
+
+FASTA = """\
+>sp|P0A7V0|RS2_ECOLI 30S ribosomal protein S2 OS=Escherichia coli (strain K12) GN=rpsB PE=1 SV=2
+MATVSMRDMLKAGVHFGHQTRYWNPKMKPFIFGARNKVHIINLEKTVPMFNEALAELNKIASRKGKILFVGTKRAASEAVK
+>sp|P0A7W7|RS8_ECOLI 30S ribosomal protein S8 OS=Escherichia coli (strain K12) GN=rpsH PE=1 SV=2
+SMQDPIADMLTRIRNGQAANKAAVTMPSSKLKVAIANVLKEEGFIEDFKVEGDTKPELELTLKYFQGKAVVESIQRVSRPGLRIYKRKDELPKVMAGLGIAVVSTSKGVMTDRAARQAGLGGEIICYVA
+>sp|P21464|RS2_BACSU 30S ribosomal protein S2 OS=Bacillus subtilis (strain 168) GN=rpsB PE=3 SV=2
+MSVISMKQLLEAGVHFGHQTRRWNPKMKKYIFTERNGIYIIDLQKTVKKVEEAYNFTKNLAAEGGKILFVGTKKQAQDSVK
+"""
+
+
+class TestSearchWorker(DBTest):
+
+    def setUp(self):
+        super(TestSearchWorker, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        fasta = os.path.join(self.directory, 'proteins.fasta')
+        with open(fasta, 'w') as f:
+            f.write(FASTA)
+        settings = {'mse.refdb.databases': ['reviewed'],
+                    'mse.refdb.reviewed.path': fasta,
+                    'mse.refdb.store': self.directory}
+        self.saved = dict((key, config.get(key)) for key in settings)
+        config.update(settings)
+        self.index = registry.search_index(
+            registry.current_versions(u'reviewed'))
+        with transaction(write=True):
+            self.user = User(user_name=u"creosote",
+                email_address=u"spam@python.not", display_name=u"Mr Creosote",
+                password=u"Wafer-thin Mint", security_question=u"Dessert?",
+                security_answer=u"Wafer-thin mint")
+        masses = sorted(self.index.seqMass)
+        self.query = u'\t'.join('%.4f' % (mass + PROTON)
+                                for mass in masses[:2])
+
+    def tearDown(self):
+        config.update(self.saved)
+        registry._indexes.clear()
+        registry._merged.clear()
+        async.candidateCache.clear()
+        shutil.rmtree(self.directory)
+        super(TestSearchWorker, self).tearDown()
+
+    def _search(self, database=u'reviewed', **kw):
+        values = dict(title=u"Spam", query=self.query, max_mass=20000.0,
+            min_mass=4000.0, mass_tolerance=2.0, spec_mode=u"Positive",
+            database=database, user=self.user)
+        values.update(kw)
+        with transaction(write=True):
+            return SearchList(**values)
+
+    def test_failed_search(self):
+        """A failing search should not block the searches after it."""
+        failed = self._search(database=u'spam')
+        done = self._search()
+        async.MicroorganismIdentification()
+        with transaction():
+            failed.sync()
+            done.sync()
+            assert failed.status == u'Failed' and failed.completed
+            assert failed.started is None
+            assert done.status == u'Done'
+            assert done.db_version == registry.current_versions(u'reviewed')
+            assert done.get_results().count() > 0
+
+    def _match(self, **kw):
+        s = self._search(db_version=registry.current_versions(u'reviewed'),
+                         **kw)
+        spectrum = searchPeaks(s.query)[0]
+        counts = dict(metrics.candidate_cache._values)
+        candidates = async.matchCandidates(s, self.index, spectrum)
+        hits, misses = [metrics.candidate_cache._values.get((result,), 0) -
+                        counts.get((result,), 0)
+                        for result in ('hit', 'miss')]
+        scores = self.index.scoreCandidates(candidates, s.min_mass,
+            s.max_mass, s.mass_tolerance, s.tolerance_unit)
+        assert scores == self.index.searchRanks(spectrum, s.min_mass,
+            s.max_mass, s.mass_tolerance, s.spec_mode, s.tolerance_unit)
+        return candidates, hits, misses
+
+    def test_candidate_cache(self):
+        """Narrower searches should be rescored, wider ones matched again."""
+        wide, hits, misses = self._match()
+        assert (hits, misses) == (0, 1)
+        narrow, hits, misses = self._match(mass_tolerance=1.0,
+                                           min_mass=5000.0)
+        assert (hits, misses) == (1, 0) and narrow is wide
+        wider, hits, misses = self._match(mass_tolerance=4.0)
+        assert (hits, misses) == (0, 1) and wider is not wide
+        assert not wider.covers(3000.0, 20000.0, 4.0)
+        wider, hits, misses = self._match(min_mass=3000.0)
+        assert (hits, misses) == (0, 1)
+        # the widened candidates cover both the old and the new search
+        assert wider.covers(3000.0, 20000.0, 4.0)
+        assert len(async.candidateCache) == 1
+        # another mass spec mode is another entry
+        self._match(spec_mode=u"Negative")
+        assert len(async.candidateCache) == 2
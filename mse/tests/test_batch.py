@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Unit test cases for testing the offline batch search."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from optparse import Values
+from StringIO import StringIO
+
+from mse.batch import TSV_COLUMNS, run_batch, spectrum_files
+from mse.myAlgorithms.MassIndex import PROTON, buildIndex
+
+FASTA = """\
+>sp|P0A7V0|RS2_ECOLI 30S ribosomal protein S2 OS=Escherichia coli (strain K12) GN=rpsB PE=1 SV=2
+MATVSMRDMLKAGVHFGHQTRYWNPKMKPFIFGARNKVHIINLEKTVPMFNEALAELNKIASRKGKILFVGTKRAASEAVK
+>sp|P0A7W7|RS8_ECOLI 30S ribosomal protein S8 OS=Escherichia coli (strain K12) GN=rpsH PE=1 SV=2
+SMQDPIADMLTRIRNGQAANKAAVTMPSSKLKVAIANVLKEEGFIEDFKVEGDTKPELELTLKYFQGKAVVESIQRVSRPGLRIYKRKDELPKVMAGLGIAVVSTSKGVMTDRAARQAGLGGEIICYVA
+>sp|P21464|RS2_BACSU 30S ribosomal protein S2 OS=Bacillus subtilis (strain 168) GN=rpsB PE=3 SV=2
+MSVISMKQLLEAGVHFGHQTRRWNPKMKKYIFTERNGIYIIDLQKTVKKVEEAYNFTKNLAAEGGKILFVGTKKQAQDSVK
+>sp|P12345|RSX_BACSU ambiguous protein OS=Bacillus subtilis (strain 168) GN=rpsX PE=3 SV=1
+MKVLBZX
+"""
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fasta = os.path.join(self.directory, 'test.fasta')
+        with open(self.fasta, 'w') as f:
+            f.write(FASTA)
+        masses = sorted(buildIndex(self.fasta, 'test').seqMass)
+        self.spectrum = [masses[0] + PROTON + 0.5, masses[1] + PROTON - 1.5,
+                         masses[1] + PROTON - 131.0404, 20000.0]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_batch_resume(self):
+        """An interrupted batch should resume after the last spectrum done."""
+        spectra = os.path.join(self.directory, 'spectra')
+        os.mkdir(spectra)
+        for name, text in [('a.txt', '\t'.join(map(str, self.spectrum))),
+                           ('b.txt', str(self.spectrum[1])),
+                           ('c.txt', 'not a peak list')]:
+            with open(os.path.join(spectra, name), 'w') as f:
+                f.write(text)
+        files = spectrum_files([spectra])
+        assert [os.path.basename(path) for path in files] == [
+            'a.txt', 'b.txt', 'c.txt']
+        options = Values(dict(min_mass=4000, max_mass=15000, tolerance=2.0,
+            unit='Da', mode='Positive', weighting='none', peak_picking=False,
+            snr=5.0, decoys=0, format='tsv', processes=1))
+        output = os.path.join(self.directory, 'results.tsv')
+        assert run_batch(self.fasta, files, options, output,
+                         log=StringIO()) == 1
+        with open(output) as f:
+            complete = f.read()
+        lines = complete.splitlines()
+        assert lines[0].split('\t') == TSV_COLUMNS
+        assert lines[1].startswith(files[0] + '\ta\tstrain\ttest\t')
+        assert len([line for line in lines if 'b.txt' in line]) == 3
+        # killed while writing the results of the second spectrum
+        with open(output + '.progress') as f:
+            first = f.readline()
+        with open(output + '.progress', 'w') as f:
+            f.write(first + '123')
+        with open(output, 'a') as f:
+            f.write('partial row')
+        log = StringIO()
+        assert run_batch(self.fasta, files, options, output, resume=True,
+                         log=log) == 1
+        assert 'Resuming: 1 of 3 files done.' in log.getvalue()
+        with open(output) as f:
+            assert f.read() == complete
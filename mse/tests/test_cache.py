@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Unit test cases for testing the cache of rendered pages."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mse.cache import RenderCache
+
+
+class TestRenderCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.template = os.path.join(self.directory, 'page.html')
+        with open(self.template, 'w') as f:
+            f.write('<html/>')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_evict_least_recently_used(self):
+        """The least recently used page should go when there are too many."""
+        cache = RenderCache(max_entries=2)
+        cache.set('a', 'spam')
+        cache.set('b', 'eggs')
+        assert cache.get('a') == 'spam'
+        cache.set('c', 'ham')
+        assert len(cache) == 2
+        assert cache.get('b') is None
+        assert cache.get('a') == 'spam' and cache.get('c') == 'ham'
+        assert (cache.hits, cache.misses) == (3, 1)
+
+    def test_evict_by_size(self):
+        """Pages should be evicted when their total length is too large."""
+        cache = RenderCache(max_entries=10, max_bytes=40)
+        for key in 'abcd':
+            cache.set(key, key * 10)
+        assert cache.size == 40
+        cache.set('e', 'e' * 5)
+        assert cache.size == 35 and len(cache) == 4
+        assert cache.get('a') is None
+        # replacing a page accounts for the length of the old one
+        cache.set('b', 'b' * 2)
+        assert cache.size == 27
+        # pages longer than a quarter of max_bytes are not cached at all
+        cache.set('f', 'f' * 11)
+        assert cache.get('f') is None and cache.size == 27
+        cache.clear()
+        assert cache.size == 0 and len(cache) == 0
+
+    def test_invalidate_on_file_change(self):
+        """A page should be rendered again when its template changes."""
+        cache = RenderCache()
+        cache.set('page', 'spam', [self.template])
+        assert cache.get('page') == 'spam'
+        mtime = os.stat(self.template).st_mtime
+        os.utime(self.template, (mtime + 10, mtime + 10))
+        assert cache.get('page') is None
+        assert cache.size == 0
+        cache.set('page', 'eggs', [self.template])
+        assert cache.get('page') == 'eggs'
+        os.remove(self.template)
+        assert cache.get('page') is None
+
+    def test_missing_file(self):
+        """A page depending on a file which does not exist yet is cached."""
+        path = os.path.join(self.directory, 'manifest.json')
+        cache = RenderCache()
+        cache.set('page', 'spam', [path])
+        assert cache.get('page') == 'spam'
+        with open(path, 'w') as f:
+            f.write('{}')
+        assert cache.get('page') is None
@@ -7,9 +7,12 @@ information.
 """
 import unittest
 import datetime
+import json
+import os
 from turbogears import testutil
-from mse.controllers import Root
-from mse.model import User
+from mse.controllers import Root, pageCache, page_files
+from mse.model import User, SearchList, ResultList
+from mse.model import LibraryMatch, LibrarySpectrum
 
 
 class TestPages(testutil.TGTest):
@@ -79,3 +82,134 @@ class TestPages(testutil.TGTest):
         assert "<title>Welcome to TurboGears</title>" in response
         assert 'href="/login"' in response
         assert 'href="/logout"' not in response
+
+    def test_cached_pages(self):
+        """Static pages should be rendered again only when a file changes."""
+        pageCache.clear()
+        body = self.app.get('/about').body
+        hits = pageCache.hits
+        assert self.app.get('/about').body == body
+        assert pageCache.hits == hits + 1
+        template = page_files('templates/about.html')[-1]
+        mtime = os.stat(template).st_mtime
+        os.utime(template, (mtime + 10, mtime + 10))
+        try:
+            assert self.app.get('/about').body == body
+            assert pageCache.hits == hits + 1
+            self.app.get('/about')
+            assert pageCache.hits == hits + 2
+        finally:
+            os.utime(template, (mtime, mtime))
+
+    def test_metrics_require_admin(self):
+        """The metrics are only shown to administrators."""
+        response = self.app.get('/metrics', status='*')
+        assert "<title>Login</title>" in response
+        assert "mse_searches" not in response
+
+
+class TestSearchAPI(testutil.TGTest):
+
+    root = Root
+
+    def setUp(self):
+        super(TestSearchAPI, self).setUp()
+        self.search = self._create_search(u"scott")
+        self.other_search = self._create_search(u"kirk")
+
+    def _create_search(self, user_name):
+        u = User(user_name=user_name, password=u"tiger",
+            display_name=user_name.title(),
+            email_address=u"%s@enterprise.com" % user_name,
+            security_question=u"Ship?", security_answer=u"Enterprise")
+        s = SearchList(title=u"Spam", query=u"4365.3\t5096.8",
+            max_mass=20000.0, min_mass=4000.0, mass_tolerance=2.0,
+            spec_mode=u"Positive", database=u"bacteria", status=u"Done",
+            user=u)
+        for i in range(5):
+            ResultList(microorganism_name=u"Bug %d" % i, matching_hit=5 - i,
+                p_value=0.01 * (4 - i), e_value=0.1 * i, search=s)
+        return s
+
+    def get(self, url, **kw):
+        """Get url as scott, logging in with the form parameters."""
+        url += '?' in url and '&' or '?'
+        return self.app.get(url + 'user_name=scott&password=tiger&login=Login',
+                            **kw)
+
+    def test_login_required(self):
+        """The API should only be used by logged in users."""
+        response = self.app.get('/api/status?ids=%d' % self.search.id,
+                                status='*')
+        assert "searches" not in response.raw
+
+    def test_submit_errors(self):
+        """Invalid searches should be answered with their errors and 400."""
+        response = self.app.post('/api/submit', dict(user_name='scott',
+            password='tiger', login='Login', searches='{"title": "Spam"}'),
+            status=400)
+        assert 'searches' in response.raw['errors']
+        response = self.app.post('/api/submit', dict(user_name='scott',
+            password='tiger', login='Login', searches=json.dumps(
+            [dict(title="Spam", query="4365.3", minMass="4000",
+                  maxMass="20000", massTolerance="2"), dict(title="")])),
+            status=400)
+        assert sorted(response.raw['errors']) == [0, 1]
+        assert 'specMode' in response.raw['errors'][0]
+        assert 'title' in response.raw['errors'][1]
+        assert SearchList.select().count() == 2
+
+    def test_status(self):
+        """Only the searches of the current user should be returned."""
+        response = self.get('/api/status?ids=%d,%d' % (
+            self.search.id, self.other_search.id))
+        assert response.raw['searches'] == [self.search]
+        self.get('/api/status?ids=spam', status=400)
+
+    def test_results_of_other_users(self):
+        """The results of other users should not be found."""
+        self.get('/api/results?searchID=%d' % self.other_search.id,
+                 status=404)
+        self.get('/api/results?searchID=spam', status=404)
+
+    def test_results_paging(self):
+        """Results should be returned a page at a time by p-value."""
+        response = self.get('/api/results?searchID=%d&page=2&per_page=2'
+                            % self.search.id)
+        assert response.raw['total'] == 5
+        assert response.raw['page'] == 2 and response.raw['per_page'] == 2
+        assert [r.microorganism_name for r in response.raw['results']] == [
+            u"Bug 2", u"Bug 1"]
+        response = self.get('/api/results?searchID=%d&page=3&per_page=2'
+                            % self.search.id)
+        assert len(response.raw['results']) == 1
+        self.get('/api/results?searchID=%d&page=first' % self.search.id,
+                 status=400)
+        self.get('/api/results?searchID=%d&rank=kingdom' % self.search.id,
+                 status=400)
+
+    def test_conditional_get(self):
+        """Only the same page of the same results should be Not Modified."""
+        self.search.completed = datetime.datetime(2014, 5, 1, 12, 0, 0, 1)
+        url = '/api/results?searchID=%d&page=1&per_page=2' % self.search.id
+        etag = self.get(url).headers['ETag']
+        self.get(url, headers={'If-None-Match': etag}, status=304)
+        response = self.get(url.replace('page=1', 'page=2'),
+                            headers={'If-None-Match': etag})
+        assert response.headers['ETag'] != etag
+        self.search.completed = datetime.datetime(2014, 5, 1, 12, 0, 0, 2)
+        response = self.get(url, headers={'If-None-Match': etag})
+        assert response.headers['ETag'] != etag
+
+    def test_library_matches_private(self):
+        """Library matches should not show the searches of other users."""
+        self.other_search.title = u"Kirk's isolate"
+        spectrum = LibrarySpectrum(search=self.other_search,
+            microorganism_name=u"Escherichia coli", source=u"reviewed",
+            peaks='')
+        LibraryMatch(search=self.search, spectrum=spectrum,
+            microorganism_name=u"Escherichia coli", source=u"reviewed",
+            similarity=0.9, shared_bins=5)
+        body = self.get('/searchresult?searchID=%d' % self.search.id).body
+        assert "Escherichia coli" in body
+        assert "Kirk" not in body
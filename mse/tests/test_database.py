@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Unit test cases for testing the database helpers."""
+
+import threading
+import time
+import unittest
+from datetime import datetime
+
+from turbogears import config
+from turbogears.testutil import DBTest
+
+from mse import database
+from mse.database import insert_many, transaction
+from mse.model import Visit
+
+
+class _Counter(object):
+    """Count the threads inside a block and remember the most at once."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inside = self.most = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.inside += 1
+            self.most = max(self.most, self.inside)
+
+    def __exit__(self, *exc_info):
+        with self.lock:
+            self.inside -= 1
+
+
+def _run_threads(count, target):
+    threads = [threading.Thread(target=target) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class _Hub(object):
+    """A hub without a database, the in-memory one is bound to a thread."""
+
+    def __init__(self):
+        self.commits = 0
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+class _PoolTest(object):
+
+    def setUp(self):
+        super(_PoolTest, self).setUp()
+        self.pool_size = config.get('mse.sqlite.pool_size', 10)
+        database._pool = None
+
+    def tearDown(self):
+        config.update({'mse.sqlite.pool_size': self.pool_size})
+        database._pool = None
+        super(_PoolTest, self).tearDown()
+
+
+class TestConcurrency(_PoolTest, unittest.TestCase):
+
+    def setUp(self):
+        super(TestConcurrency, self).setUp()
+        self.hub = database.hub
+        database.hub = _Hub()
+
+    def tearDown(self):
+        database.hub = self.hub
+        super(TestConcurrency, self).tearDown()
+
+    def test_pool_bound(self):
+        """No more than pool_size threads should be inside a transaction."""
+        config.update({'mse.sqlite.pool_size': 2})
+        database._pool = None
+        counter = _Counter()
+
+        def read():
+            with transaction():
+                with counter:
+                    time.sleep(0.05)
+        _run_threads(5, read)
+        assert counter.most == 2
+
+    def test_writes_serialized(self):
+        """Only one thread at a time should be inside a writing block."""
+        counter = _Counter()
+
+        def write():
+            with transaction(write=True):
+                with counter:
+                    time.sleep(0.02)
+        _run_threads(4, write)
+        assert counter.most == 1
+        assert database.hub.commits == 4
+
+
+class TestTransaction(_PoolTest, DBTest):
+
+    def _visit(self, key):
+        return Visit(visit_key=key, expiry=datetime.now())
+
+    def test_rollback(self):
+        """A block raising an exception should be rolled back."""
+        try:
+            with transaction(write=True):
+                self._visit('spam')
+                raise ValueError
+        except ValueError:
+            pass
+        with transaction(write=True):
+            assert Visit.lookup_visit('spam') is None
+            self._visit('eggs')
+        with transaction():
+            assert Visit.lookup_visit('eggs')
+
+    def test_nested(self):
+        """Nested blocks should join the transaction of the outer block."""
+        config.update({'mse.sqlite.pool_size': 1})
+        database._pool = None
+        try:
+            with transaction(write=True):
+                with transaction(write=True):
+                    self._visit('spam')
+                with transaction():
+                    assert Visit.lookup_visit('spam')
+                raise ValueError
+        except ValueError:
+            pass
+        with transaction():
+            assert Visit.lookup_visit('spam') is None
+
+    def test_insert_many(self):
+        """Rows should be inserted in chunks of at most INSERT_CHUNK_SIZE."""
+        rows = [dict(visit_key='visit%d' % i, created=datetime.now(),
+                     expiry=datetime.now())
+                for i in range(database.INSERT_CHUNK_SIZE + 1)]
+        with transaction(write=True):
+            assert insert_many(Visit, rows) == len(rows)
+            assert insert_many(Visit, []) == 0
+        with transaction():
+            assert Visit.select().count() == len(rows)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Unit test cases for testing the export of search results."""
+
+import csv
+import zlib
+from datetime import timedelta
+from StringIO import StringIO
+
+from turbogears.testutil import DBTest
+
+from mse import export
+from mse.export import export_results, gzip_stream
+from mse.model import SearchList, ResultList, User, archive_results
+from mse.model import result_columns
+
+
+class TestExport(DBTest):
+
+    def setUp(self):
+        super(TestExport, self).setUp()
+        u = User(user_name=u"creosote", email_address=u"spam@python.not",
+            display_name=u"Mr Creosote", password=u"Wafer-thin Mint",
+            security_question=u"Dessert?", security_answer=u"Wafer-thin mint")
+        self.searches = []
+        for title, count in ((u"Sp\xe4m, eggs", 7), (u"Ham", 2)):
+            s = SearchList(title=title, query=u"4365.3\t5096.8",
+                max_mass=20000.0, min_mass=4000.0, mass_tolerance=2.0,
+                spec_mode=u"Positive", database=u"bacteria", status=u'Done',
+                user=u)
+            for i in range(count):
+                # ties in the p-values must not get rows lost between batches
+                ResultList(microorganism_name=u"Bug %d" % i, matching_hit=i,
+                    p_value=0.1 * (i % 3), e_value=0.2, search=s)
+            self.searches.append(s)
+
+    def _rows(self, output, delimiter=','):
+        return list(csv.reader(StringIO(output), delimiter=delimiter))
+
+    def test_export_results(self):
+        """Results should be exported by search and ascending p-value."""
+        chunk_rows = export.CHUNK_ROWS
+        export.CHUNK_ROWS = 2
+        try:
+            chunks = list(export_results(self.searches))
+        finally:
+            export.CHUNK_ROWS = chunk_rows
+        assert len(chunks) > 2
+        rows = self._rows(''.join(chunks))
+        assert rows[0] == ['search_id', 'title'] + result_columns()
+        assert len(rows) == 10
+        assert rows[1][1] == u"Sp\xe4m, eggs".encode('utf-8')
+        p_value = rows[0].index('p_value')
+        assert [float(row[p_value]) for row in rows[1:8]] == [
+            0.0, 0.0, 0.0, 0.1, 0.1, 0.2, 0.2]
+        name = rows[0].index('microorganism_name')
+        assert sorted(row[name] for row in rows[1:8]) == [
+            "Bug %d" % i for i in range(7)]
+        assert [row[0] for row in rows[8:]] == [
+            str(self.searches[1].id)] * 2
+
+    def test_export_archived_results(self):
+        """Archived results should be exported like the others."""
+        expected = ''.join(export_results(self.searches, '\t'))
+        assert archive_results(timedelta(days=-1)) == 2
+        assert self._rows(''.join(export_results(self.searches, '\t')),
+            '\t')[1:] == self._rows(expected, '\t')[1:]
+
+    def test_gzip_stream(self):
+        """The compressed stream should be a gzip file of all chunks."""
+        chunks = ['spam,eggs\n' * 1000, '', 'ham\n']
+        data = ''.join(gzip_stream(iter(chunks)))
+        assert data[:2] == '\x1f\x8b'
+        assert zlib.decompress(data, 16 + zlib.MAX_WBITS) == ''.join(chunks)
+        assert zlib.decompress(''.join(gzip_stream([])),
+                               16 + zlib.MAX_WBITS) == ''
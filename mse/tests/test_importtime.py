@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""Unit test cases for testing the import-time report."""
+
+import unittest
+from StringIO import StringIO
+
+from mse.importtime import DEFAULT_MODULE, heavy_modules, measure, report
+
+
+class TestImportCost(unittest.TestCase):
+
+    def test_light_imports(self):
+        """Reading peak lists should not load the scientific stack."""
+        timings = measure('mse.myAlgorithms.ScoringAlgorithms')
+        assert heavy_modules(timings) == []
+        out = StringIO()
+        assert report(timings, out, top=3)
+        assert 'ScoringAlgorithms' in out.getvalue()
+        assert not report(timings, StringIO(), budget=0)
+        timings = measure('mse.myAlgorithms.MassIndex')
+        assert 'numpy' in heavy_modules(timings)
+        assert not report(timings, StringIO())
+
+    def test_light_startup(self):
+        """Starting the web server should not load the scientific stack."""
+        assert DEFAULT_MODULE == 'mse.controllers'
+        assert heavy_modules(measure(DEFAULT_MODULE)) == []
@@ -4,7 +4,7 @@
 from turbogears.database import session
 from turbogears import testutil
 
-from mse.model import Group, Permission, User
+from mse.model import Group, Permission, User, SearchList, ResultList
 from mse.jsonify import jsonify
 
 
@@ -26,6 +26,21 @@ class JsonifyTest(testutil.DBTest):
             permission_name = u'test',
             description = u'Test Permission')
         p.addGroup(g)
+        self.test_search = s = SearchList(
+            title = u'Test Search',
+            query = u'4365.3\t5096.8',
+            max_mass = 20000.0,
+            min_mass = 4000.0,
+            mass_tolerance = 2.0,
+            spec_mode = u'Positive',
+            database = u'Ribosomal Proteins in Bacteria: Reviewed',
+            user = u)
+        self.test_result = ResultList(
+            microorganism_name = u'Escherichia coli',
+            matching_hit = 2,
+            p_value = 0.001,
+            e_value = 0.01,
+            search = s)
 
     def test_jsonify_group(self):
         """Test that Group model objects are correctly jsonified."""
@@ -52,3 +67,20 @@ class JsonifyTest(testutil.DBTest):
         assert '_password' not in json
         assert json['groups'] == [u'test']
         assert json['permissions'] == [u'test']
+
+    def test_jsonify_searchlist(self):
+        """Test that SearchList model objects are correctly jsonified."""
+        json = jsonify(self.test_search)
+        assert json['id'] == self.test_search.id
+        assert json['title'] == u'Test Search'
+        assert json['status'] == u'Incomplete'
+        assert json['mass_tolerance'] == 2.0
+        assert 'query' not in json
+
+    def test_jsonify_resultlist(self):
+        """Test that ResultList model objects are correctly jsonified."""
+        json = jsonify(self.test_result)
+        assert json['microorganism_name'] == u'Escherichia coli'
+        assert json['matching_hit'] == 2
+        assert json['p_value'] == 0.001
+        assert json['search_id'] == self.test_search.id
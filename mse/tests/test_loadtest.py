@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""Unit test cases for testing the helpers of the load test."""
+
+import unittest
+
+from turbogears import config
+
+from mse.loadtest import LoadTestError, parse_mix, percentile
+from mse.loadtest import select_databases
+
+
+class TestLoadTest(unittest.TestCase):
+
+    def test_parse_mix(self):
+        """The weights should default to 1 and the pages be checked."""
+        assert parse_mix('searchsubmit:1, searchlist:2.5,searchresult') == [
+            ('searchsubmit', 1.0), ('searchlist', 2.5),
+            ('searchresult', 1.0)]
+        self.assertRaises(ValueError, parse_mix, 'index:1')
+        self.assertRaises(ValueError, parse_mix, 'searchlist:many')
+
+    def test_percentile(self):
+        """Percentiles should be the nearest rank of the sorted values."""
+        values = range(1, 101)
+        assert percentile(values, 50) == 50
+        assert percentile(values, 95) == 95
+        assert percentile(values, 100) == 100
+        assert percentile(values, 0) == 1
+        assert percentile([0.25], 99) == 0.25
+        assert percentile([], 50) is None
+
+    def test_select_databases(self):
+        """Databases should be selected by the keys of the registry."""
+        settings = {'mse.refdb.databases': ['spam', 'eggs'],
+                    'mse.refdb.default': None}
+        saved = dict((key, config.get(key)) for key in settings)
+        config.update(settings)
+        try:
+            assert select_databases() == 'spam'
+            assert select_databases('eggs, spam') == 'eggs,spam'
+            self.assertRaises(LoadTestError, select_databases, 'ham')
+            config.update({'mse.refdb.default': 'eggs'})
+            assert select_databases('') == 'eggs'
+        finally:
+            config.update(saved)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Unit test cases for testing the operational metrics."""
+
+import threading
+import unittest
+
+from mse import metrics
+from mse.metrics import Counter, Histogram
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.count = len(metrics._metrics)
+
+    def tearDown(self):
+        # unregister the metrics of the test
+        del metrics._metrics[self.count:]
+
+    def test_counter(self):
+        """Counters should be rendered per label value."""
+        counter = Counter('test_total', "Spam.", ['kind'])
+        counter.inc(kind='spam')
+        counter.inc(2, kind='eggs')
+        self.assertRaises(ValueError, counter.inc, color='red')
+        assert counter.render() == ['# HELP test_total Spam.',
+            '# TYPE test_total counter', 'test_total{kind="eggs"} 2.0',
+            'test_total{kind="spam"} 1.0']
+
+    def test_histogram(self):
+        """Bucket counts should be cumulative and add up to the count."""
+        histogram = Histogram('test_seconds', "Eggs.", buckets=(1, 10))
+
+        def observe():
+            for i in range(1000):
+                histogram.observe(i % 20)
+        threads = [threading.Thread(target=observe) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert histogram.samples() == [
+            ('_bucket', (), 400, [('le', '1.0')]),
+            ('_bucket', (), 2200, [('le', '10.0')]),
+            ('_bucket', (), 4000, [('le', '+Inf')]),
+            ('_sum', (), 4 * 50 * 190.0),
+            ('_count', (), 4000)]
@@ -22,6 +22,8 @@ information.
 
 """
 
+from datetime import timedelta
+
 from turbogears.testutil import DBTest
 from turbogears.util import get_model
 
@@ -33,12 +35,17 @@ except ImportError:
     warnings.warn("Identity model not found. Not running identity tests!")
     User = None
 
+from mse.model import SearchList, ResultList, ResultArchive
+from mse.model import add_missing_columns, archive_results
+from mse.database import transaction
+
 from sqlobject import SQLObjectNotFound
 from sqlobject.dberrors import OperationalError
 
 def _create_test_user():
     obj = User(user_name=u"creosote", email_address=u"spam@python.not",
-        display_name=u"Mr Creosote", password=u"Wafer-thin Mint")
+        display_name=u"Mr Creosote", password=u"Wafer-thin Mint",
+        security_question=u"Dessert?", security_answer=u"Wafer-thin mint")
     return obj
 
 class TestUser(DBTest):
@@ -54,6 +61,67 @@ class TestUser(DBTest):
                 "User name should have been creosote, not '%s'" % retrieved_user.user_name
             assert obj.display_name == u"Mr Creosote"
 
+class TestResultArchive(DBTest):
+
+    def _create_test_search(self, status=u'Done'):
+        s = SearchList(title=u"Spam", query=u"4365.3\t5096.8",
+            max_mass=20000.0, min_mass=4000.0, mass_tolerance=2.0,
+            spec_mode=u"Positive", database=u"Ribosomal Proteins in Bacteria: "
+            "Reviewed", status=status, user=_create_test_user())
+        for i in range(5):
+            ResultList(microorganism_name=u"Bug %d" % i, matching_hit=5 - i,
+                p_value=0.01 * i, e_value=0.1 * i, search=s)
+        return s
+
+    def test_archive_results(self):
+        """Old finished searches should be packed into a ResultArchive."""
+        s = self._create_test_search()
+        assert archive_results(timedelta(days=-1), batch_size=2) == 1
+        assert ResultList.selectBy(search=s).count() == 0
+        assert s.archive.row_count == 5
+        results = s.get_results()
+        assert [r.microorganism_name for r in results] == [
+            u"Bug %d" % i for i in range(5)]
+        assert results[1].matching_hit == 4
+        assert results[1].search == s
+        assert archive_results(timedelta(days=-1)) == 0
+
+    def test_archive_deletes_leftover_rows(self):
+        """Rows left over by an interrupted run should still be deleted."""
+        s = self._create_test_search()
+        ResultArchive.pack(s)
+        assert archive_results(timedelta(days=-1), batch_size=2) == 0
+        assert ResultList.selectBy(search=s).count() == 0
+        results = s.get_results()
+        assert len(results) == 5
+        assert results[0].source is None
+        assert results[0].rank == u'species'
+
+    def test_archive_rolls_back(self):
+        """A search which cannot be packed should keep its results."""
+        s = self._create_test_search()
+        pack = ResultArchive.__dict__['pack']
+        def fail(cls, search):
+            ResultArchive(search=search, row_count=0, data='')
+            raise ValueError("spam")
+        ResultArchive.pack = classmethod(fail)
+        try:
+            self.assertRaises(ValueError, archive_results, timedelta(days=-1))
+        finally:
+            ResultArchive.pack = pack
+        with transaction():
+            assert ResultArchive.select().count() == 0
+            assert ResultList.selectBy(search=s).count() == 5
+        assert archive_results(timedelta(days=-1)) == 1
+
+    def test_archive_skips_recent_and_unfinished(self):
+        """Recent and unfinished searches should not be archived."""
+        s = self._create_test_search(status=u'Running')
+        assert archive_results(timedelta(days=-1)) == 0
+        s.status = u'Done'
+        assert archive_results(timedelta(days=30)) == 0
+        assert s.get_results().count() == 5
+
 class TestBootstrap(DBTest):
 
     def setUp(self):
@@ -62,6 +130,23 @@ class TestBootstrap(DBTest):
             if not self.model:
                 raise Exception("Unable to run database tests without a model")
 
+    def test_add_missing_columns(self):
+        """Columns added to the model should be added to existing tables."""
+        conn = ResultList._connection
+        ResultList.dropTable(ifExists=True)
+        conn.query("CREATE TABLE result_list (id INTEGER PRIMARY KEY, "
+            "microorganism_name TEXT, matching_hit INT, p_value FLOAT, "
+            "e_value FLOAT, search_id INT)")
+        conn.query("INSERT INTO result_list (microorganism_name, "
+            "matching_hit, p_value, e_value, search_id) "
+            "VALUES ('Bug', 1, 0.1, 0.2, 1)")
+        assert add_missing_columns(ResultList) == ['weighted_score',
+            'empirical_p_value', 'q_value', 'source', 'rank']
+        r = ResultList.get(1)
+        assert r.microorganism_name == u'Bug'
+        assert r.rank == u'species' and r.source is None
+        assert add_missing_columns(ResultList) == []
+
     if User:
         def test_create_tables(self):
             """Test that model.create_tables correctly creates all database tables."""
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Unit test cases for testing the peak picking of profile spectra."""
+
+import unittest
+
+import numpy as np
+
+from mse.myAlgorithms.PeakPicking import pickPeaks, searchPeaks
+from mse.myAlgorithms.SpectrumFiles import formatPeaks
+
+
+class TestPeakPicking(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.mz = np.linspace(2000, 20000, 200000)
+        self.masses = np.array([4365.3, 5095.8, 6255.4, 7158.9, 9535.6])
+        self.profile = 5000 * np.exp(-(self.mz - 2000) / 3000.0) + \
+            random.normal(0, 20, len(self.mz))
+        for mass in self.masses:
+            self.profile += 1000 * np.exp(
+                -0.5 * ((self.mz - mass) / (mass * 4e-4)) ** 2)
+
+    def test_pick_peaks(self):
+        """The peaks of a noisy profile should be found on its baseline."""
+        mz, intensities = pickPeaks(self.mz, self.profile)
+        assert len(mz) == len(self.masses)
+        assert np.all(np.abs(mz - self.masses) < 0.5)
+        assert np.all(np.abs(intensities - 1000) < 100)
+        # the order of the points does not matter
+        order = np.random.RandomState(1).permutation(len(self.mz))
+        assert np.all(pickPeaks(self.mz[order], self.profile[order])[0] == mz)
+
+    def test_search_peaks(self):
+        """Only searches with peak picking should pick peaks."""
+        query = formatPeaks(self.mz[::10], self.profile[::10])
+        assert len(searchPeaks(query)[0]) == 20000
+        assert len(searchPeaks(query, True)[0]) == len(self.masses)
+        self.assertRaises(ValueError, searchPeaks, "4000.5\t5000.25", True)
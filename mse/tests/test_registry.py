@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Unit test cases for testing the registry of reference databases."""
+
+import os
+import shutil
+import tempfile
+
+from turbogears import config
+from turbogears.testutil import DBTest
+
+from mse import registry
+from mse.database import transaction
+from mse.model import SearchList, User
+from mse.registry import (CURRENT, RETIRED, collect_garbage,
+    current_versions, find_database, search_index)
+
+FASTA = """\
+>sp|P0A7V0|RS2_ECOLI 30S ribosomal protein S2 OS=Escherichia coli (strain K12) GN=rpsB PE=1 SV=2
+MATVSMRDMLKAGVHFGHQTRYWNPKMKPFIFGARNKVHIINLEKTVPMFNEALAELNKIASRKGKILFVGTKRAASEAVK
+>sp|P21464|RS2_BACSU 30S ribosomal protein S2 OS=Bacillus subtilis (strain 168) GN=rpsB PE=3 SV=2
+MSVISMKQLLEAGVHFGHQTRRWNPKMKKYIFTERNGIYIIDLQKTVKKVEEAYNFTKNLAAEGGKILFVGTKKQAQDSVK
+"""
+
+SETTINGS = {'mse.refdb.databases': ['reviewed', 'unreviewed'],
+            'mse.refdb.reviewed.title': 'Reviewed Proteins',
+            'mse.refdb.unreviewed.title': 'Unreviewed Proteins'}
+
+
+class TestRegistry(DBTest):
+
+    def setUp(self):
+        super(TestRegistry, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.fasta = os.path.join(self.directory, 'proteins.fasta')
+        with open(self.fasta, 'w') as f:
+            f.write(FASTA)
+        settings = dict(SETTINGS)
+        settings.update({'mse.refdb.store': self.directory,
+                         'mse.refdb.reviewed.path': self.fasta,
+                         'mse.refdb.unreviewed.path': self.fasta})
+        self.saved = dict((key, config.get(key)) for key in settings)
+        config.update(settings)
+        self.db = find_database('reviewed')
+
+    def tearDown(self):
+        config.update(self.saved)
+        registry._indexes.clear()
+        registry._merged.clear()
+        shutil.rmtree(self.directory)
+        super(TestRegistry, self).tearDown()
+
+    def _current(self):
+        with open(os.path.join(self.db.index_dir, CURRENT)) as f:
+            return f.read().strip()
+
+    def _retired(self, version):
+        return os.path.exists(os.path.join(self.db.index_dir, version,
+                                           RETIRED))
+
+    def test_publish(self):
+        """A published version should be complete and current."""
+        assert self.db.versions() == []
+        assert self.db.publish(version='v1') == 'v1'
+        assert self.db.versions() == ['v1'] and self._current() == 'v1'
+        assert len(self.db.load_index('v1')) == 2
+        assert self.db.publish(version='v2') == 'v2'
+        assert self._current() == 'v2' and self._retired('v1')
+        self.assertRaises(ValueError, self.db.publish, version='v2')
+        self.assertRaises(ValueError, self.db.publish, version='../v3')
+        # only complete versions are listed
+        os.mkdir(os.path.join(self.db.index_dir, '.v3-build'))
+        assert self.db.versions() == ['v1', 'v2']
+
+    def test_set_current(self):
+        """Switching back to a version should retire the current one."""
+        self.db.publish(version='v1')
+        self.db.publish(version='v2')
+        self.db.set_current('v1')
+        assert self._current() == 'v1'
+        assert not self._retired('v1') and self._retired('v2')
+        self.assertRaises(ValueError, self.db.set_current, 'v3')
+        assert self._current() == 'v1'
+
+    def test_current_versions(self):
+        """Databases without a release should be published when searched."""
+        versions = current_versions(u'Reviewed Proteins,unreviewed,reviewed')
+        pairs = [item.split('@') for item in versions.split(',')]
+        assert [key for key, version in pairs] == ['reviewed', 'unreviewed']
+        assert pairs[0][1] == self._current()
+        assert len(search_index(versions)) == 4
+        assert current_versions(u'reviewed') == u'reviewed@' + pairs[0][1]
+        self.assertRaises(KeyError, current_versions, u'spam')
+
+    def test_collect_garbage(self):
+        """Retired versions should be deleted unless a search uses them."""
+        self.db.publish(version='v1')
+        self.db.publish(version='v2')
+        assert collect_garbage() == 0
+        assert self.db.versions() == ['v1', 'v2']
+        self.db.publish(version='v3')
+        with transaction(write=True):
+            u = User(user_name=u"creosote", email_address=u"spam@python.not",
+                display_name=u"Mr Creosote", password=u"Wafer-thin Mint",
+                security_question=u"Dessert?",
+                security_answer=u"Wafer-thin mint")
+            SearchList(title=u"Spam", query=u"4365.3", max_mass=20000.0,
+                min_mass=4000.0, mass_tolerance=2.0, spec_mode=u"Positive",
+                database=u"reviewed", db_version=u"reviewed@v2",
+                status=u"Running", user=u)
+        assert collect_garbage(grace=0) == 1
+        assert self.db.versions() == ['v2', 'v3']
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Unit test cases for testing the reading of spectrum files."""
+
+import base64
+import unittest
+import zlib
+from StringIO import StringIO
+
+import numpy as np
+
+from mse.myAlgorithms.ScoringAlgorithms import readPeaks
+from mse.myAlgorithms.SpectrumFiles import formatPeaks, readSpectra
+
+
+class TestSpectrumFiles(unittest.TestCase):
+
+    mz = [4000.5, 5000.25, 6000.125]
+    intensities = [10.0, 20.0, 30.0]
+
+    def encode(self, values, dtype, compress=False):
+        data = np.array(values, dtype=dtype).tostring()
+        if compress:
+            data = zlib.compress(data)
+        return base64.b64encode(data)
+
+    def read(self, name, text):
+        return [(title, list(mz), intensities is not None and
+                 list(intensities)) for title, mz, intensities
+                in readSpectra(StringIO(text), name)]
+
+    def test_mgf_and_csv(self):
+        """Peak lists should be read with or without intensities."""
+        spectra = self.read('run.mgf', "CHARGE=1+\nBEGIN IONS\nTITLE=first\n"
+            "4000.5 10\n5000.25 20\nEND IONS\nBEGIN IONS\n4000.5\n"
+            "END IONS\n")
+        assert spectra == [('first', [4000.5, 5000.25], [10.0, 20.0]),
+                           ('run 2', [4000.5], False)]
+        assert self.read('run.csv', "m/z;intensity\n4000.5;10\n") == [
+            ('run', [4000.5], [10.0])]
+        assert self.read('run.txt', "4000.5\t5000.25") == [
+            ('run', [4000.5, 5000.25], False)]
+
+    def test_mzxml(self):
+        """Binary peak pairs should be decoded and MS2 scans skipped."""
+        pairs = np.column_stack([self.mz, self.intensities]).ravel()
+        text = ('<mzXML xmlns="http://sashimi.sourceforge.net/schema_revision/'
+            'mzXML_3.2"><msRun><scan num="1" msLevel="1"><peaks precision='
+            '"32" byteOrder="network" pairOrder="m/z-int" compressionType='
+            '"zlib">%s</peaks><scan num="2" msLevel="2"><peaks precision="64"'
+            '>%s</peaks></scan></scan></msRun></mzXML>' % (
+            self.encode(pairs, '>f4', True), self.encode(pairs, '>f8')))
+        assert self.read('run.mzXML', text) == [
+            ('1', self.mz, self.intensities)]
+
+    def test_mzml(self):
+        """Binary arrays should be decoded as their parameters say."""
+        array = ('<binaryDataArray><cvParam accession="%s"/><cvParam '
+                 'accession="%s"/><binary>%s</binary></binaryDataArray>')
+        text = ('<mzML xmlns="http://psi.hupo.org/ms/mzml"><run><spectrumList>'
+            '<spectrum id="scan=1"><cvParam accession="MS:1000511" value="1"/>'
+            '<binaryDataArrayList>%s%s</binaryDataArrayList></spectrum>'
+            '</spectrumList></run></mzML>' % (
+            array % ('MS:1000523', 'MS:1000514',
+                     self.encode(self.mz, '<f8')),
+            array % ('MS:1000521', 'MS:1000515',
+                     self.encode(self.intensities, '<f4'))))
+        assert self.read('run.mzML', text) == [
+            ('scan=1', self.mz, self.intensities)]
+        self.assertRaises(ValueError, self.read, 'run.mzML',
+                          text.replace('MS:1000523', 'MS:1000522'))
+
+    def test_format_peaks(self):
+        """Formatted spectra should be read back by readPeaks."""
+        assert readPeaks(formatPeaks(self.mz, self.intensities)) == (
+            self.mz, self.intensities)
+        assert readPeaks(formatPeaks(self.mz)) == (self.mz, None)
+        # a single peak should stay one peak, with or without intensity
+        assert readPeaks(formatPeaks([1000.0], [50.0])) == ([1000.0], [50.0])
+        assert readPeaks(formatPeaks([1000.0])) == ([1000.0], None)
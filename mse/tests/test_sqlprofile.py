@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Unit test cases for testing the SQL profiler."""
+
+import unittest
+
+from mse import sqlprofile
+from mse.sqlprofile import RequestProfile, normalize
+
+
+class TestSqlProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = sqlprofile._settings.copy()
+
+    def tearDown(self):
+        sqlprofile._settings.clear()
+        sqlprofile._settings.update(self.settings)
+        sqlprofile._profiles.profile = None
+
+    def test_normalize(self):
+        """Literals should be replaced, so only the IDs differ."""
+        assert normalize("SELECT name FROM tg_user WHERE id = 42") == \
+            "SELECT name FROM tg_user WHERE id = ?"
+        assert normalize("SELECT id FROM  visit\n WHERE visit_key IN "
+                         "('a''b', 'c', 3.5e-3) AND t2.x = 1") == \
+            "SELECT id FROM visit WHERE visit_key IN (?) AND t2.x = ?"
+
+    def test_repeated(self):
+        """Only SELECT statements run often enough should be repeated."""
+        profile = RequestProfile('GET /searchlist', 'Root.searchlist')
+        for i in range(3):
+            profile.add("SELECT * FROM tg_user WHERE id = %d" % i, 0.5)
+            profile.add("UPDATE visit SET expiry = %d" % i, 0.25)
+        profile.add("SELECT * FROM search_list", 0.25)
+        assert profile.count == 7 and profile.duration == 2.5
+        assert profile.repeated(3) == [
+            (3, "SELECT * FROM tg_user WHERE id = ?")]
+        assert len(profile.repeated(1)) == 2
+
+    def test_n_plus_one_by_handler(self):
+        """N+1 queries should be counted by handler, not by path."""
+        sqlprofile._settings['n_plus_one'] = 2
+        for search in range(2):
+            profile = RequestProfile('GET /searchresult/%d' % search,
+                                     'Root.searchresult')
+            for i in range(2):
+                profile.add("SELECT * FROM result_list WHERE id = %d" % i, 0)
+            sqlprofile._profiles.profile = profile
+            sqlprofile.end_profile()
+        assert ('', ('Root.searchresult',), 2) in \
+            sqlprofile.n_plus_one.samples()
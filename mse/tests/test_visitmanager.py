@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Unit test cases for testing the batched visit manager."""
+
+from datetime import datetime, timedelta
+
+from turbogears import config
+from turbogears.testutil import DBTest
+from turbogears.visit import api
+
+from mse.database import transaction
+from mse.model import Visit, VisitIdentity
+from mse.visitmanager import BatchedVisitManager, cleanup_visits
+
+
+class _RecordingManager(BatchedVisitManager):
+    """Record the visits written by the manager thread.
+
+    The in-memory test database cannot be used by other threads.
+    """
+
+    def __init__(self, timeout):
+        self.written = []
+        super(_RecordingManager, self).__init__(timeout)
+
+    def update_queued_visits(self, queue, new_visits=()):
+        self.written.append((queue, new_visits))
+
+
+class TestBatchedVisitManager(DBTest):
+
+    def setUp(self):
+        super(TestBatchedVisitManager, self).setUp()
+        self.interval = config.get('visit.interval', 30)
+        # the manager thread writes at shutdown only
+        config.update({'visit.interval': 3600})
+        self.manager = BatchedVisitManager(timedelta(minutes=20))
+
+    def tearDown(self):
+        self.manager.shutdown()
+        config.update({'visit.interval': self.interval})
+        super(TestBatchedVisitManager, self).tearDown()
+
+    def _keys(self):
+        with transaction():
+            return sorted(v.visit_key for v in Visit.select())
+
+    def test_batched_writes(self):
+        """New visits should be written in a batch, not one by one."""
+        for i in range(3):
+            assert self.manager.new_visit_with_key('visit%d' % i).is_new
+        assert self._keys() == []
+        visit = self.manager.visit_for_key('visit1')
+        assert visit.key == 'visit1' and not visit.is_new
+        assert self.manager.flush() == 3
+        assert self._keys() == ['visit0', 'visit1', 'visit2']
+        assert self.manager.flush() == 0
+
+    def test_extended_visits(self):
+        """Extended visits should be updated, expired ones not be found."""
+        for key in ('spam', 'eggs'):
+            self.manager.new_visit_with_key(key)
+        self.manager.flush()
+        expired = datetime.now() - timedelta(hours=1)
+        self.manager.update_visit('spam', expired)
+        assert self.manager.visit_for_key('eggs')
+        assert self.manager.flush() == 2
+        with transaction():
+            assert Visit.by_visit_key('spam').expiry == expired
+            assert Visit.by_visit_key('eggs').expiry > datetime.now()
+        assert self.manager.visit_for_key('spam') is None
+        assert self.manager.visit_for_key('ham') is None
+
+    def test_write_on_shutdown(self):
+        """Visits queued since the last write should be written at shutdown."""
+        manager = _RecordingManager(timedelta(minutes=20))
+        manager.new_visit_with_key('spam')
+        manager.update_visit('eggs', datetime.now())
+        manager.shutdown()
+        assert [(sorted(queue), new_visits)
+                for queue, new_visits in manager.written] == [
+            (['eggs', 'spam'], set(['spam']))]
+
+    def test_cleanup_visits(self):
+        """Expired visits and their identity links should be deleted."""
+        now = datetime.now()
+        with transaction(write=True):
+            for i in range(5):
+                Visit(visit_key='old%d' % i, expiry=now - timedelta(hours=1))
+                VisitIdentity(visit_key='old%d' % i, user_id=1)
+            Visit(visit_key='new', expiry=now + timedelta(hours=1))
+            VisitIdentity(visit_key='new', user_id=1)
+        assert cleanup_visits(batch_size=2) == 5
+        assert self._keys() == ['new']
+        with transaction():
+            assert [v.visit_key for v in VisitIdentity.select()] == ['new']
+        assert cleanup_visits() == 0
+
+    def test_cleanup_keeps_extended_visits(self):
+        """Visits extended but not written yet should not be deleted."""
+        expired = datetime.now() - timedelta(hours=1)
+        with transaction(write=True):
+            for key in ('spam', 'eggs', 'ham'):
+                Visit(visit_key=key, expiry=expired)
+                VisitIdentity(visit_key=key, user_id=1)
+        self.manager.update_visit('spam', datetime.now() + timedelta(hours=1))
+        self.manager.flushing = {'eggs': datetime.now() + timedelta(hours=1)}
+        manager, api._manager = api._manager, self.manager
+        try:
+            assert cleanup_visits(batch_size=1) == 1
+        finally:
+            api._manager = manager
+            self.manager.flushing = {}
+        assert self._keys() == ['eggs', 'spam']
+        with transaction():
+            assert sorted(v.visit_key for v in VisitIdentity.select()) == [
+                'eggs', 'spam']
+        assert self.manager.flush() == 1
+        with transaction():
+            assert Visit.by_visit_key('spam').expiry > datetime.now()
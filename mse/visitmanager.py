@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""This module contains the visit manager of the application.
+
+The visit manager of TurboGears inserts a row into the visit table as soon
+as a new visitor shows up and never deletes any rows. The BatchedVisitManager
+keeps new visits in memory, too, and writes them together with the extended
+expiry times of the known visits every 'visit.interval' seconds. Expired
+visits and their identity links are deleted by `cleanup_visits`, which
+`schedule_cleanup` runs periodically through the TurboGears scheduler.
+Visits extended in memory but not written yet are kept.
+
+Enable it in the configuration with:
+
+    visit.manager = 'mse.visitmanager.BatchedVisitManager'
+    tg.scheduler = True
+
+"""
+
+# symbols which are imported by "from mse.visitmanager import *"
+__all__ = ['BatchedVisitManager', 'cleanup_visits', 'schedule_cleanup']
+
+import logging
+from datetime import datetime
+
+from sqlobject.sqlbuilder import AND, IN, Select, SQLConstant, Update
+from turbogears import config, scheduler
+from turbogears.visit import api, sovisit
+from turbogears.visit.api import Visit
+
+from mse.database import insert_many, transaction
+from mse.model import VisitIdentity
+
+log = logging.getLogger('mse.visitmanager')
+
+# Maximum number of visits written or deleted with a single statement
+BATCH_SIZE = 500
+
+
+class BatchedVisitManager(sovisit.SqlObjectVisitManager):
+    """A visit manager which writes new and updated visits in batches."""
+
+    def __init__(self, timeout):
+        # the base class starts the update thread, so set up our state first
+        self.new_visits = set()
+        self.flushing = {}
+        super(BatchedVisitManager, self).__init__(timeout)
+
+    def new_visit_with_key(self, visit_key):
+        self.lock.acquire()
+        try:
+            self.new_visits.add(visit_key)
+            self.queue[visit_key] = datetime.now() + self.timeout
+        finally:
+            self.lock.release()
+        return Visit(visit_key, True)
+
+    def visit_for_key(self, visit_key):
+        """Return the visit for this key.
+
+        Returns None if the visit doesn't exist or has expired.
+
+        """
+        expiry = self.queue.get(visit_key) or self.flushing.get(visit_key)
+        if expiry is None:
+            visit = sovisit.visit_class.lookup_visit(visit_key)
+            if not visit:
+                return None
+            expiry = visit.expiry
+        now = datetime.now()
+        if expiry < now:
+            return None
+        # Visit hasn't expired, extend it
+        self.update_visit(visit_key, now + self.timeout)
+        return Visit(visit_key, False)
+
+    def run(self):
+        """Write the queued visits every 'visit.interval' seconds.
+
+        Unlike the loop of the base class, the queue and the new visits are
+        taken over together with the lock held, so no visit which is queued
+        meanwhile can get lost. The visits queued since the last update are
+        written when the manager is shut down.
+
+        """
+        while not self._shutdown.isSet():
+            self._shutdown.wait(self.interval)
+            self.flush()
+
+    def flush(self):
+        """Write the queued visits and return their number."""
+        self.lock.acquire()
+        try:
+            queue, self.queue = self.queue, {}
+            new_visits, self.new_visits = self.new_visits, set()
+            self.flushing = queue
+        finally:
+            self.lock.release()
+        try:
+            if queue:
+                self.update_queued_visits(queue, new_visits)
+        finally:
+            self.flushing = {}
+        return len(queue)
+
+    def update_queued_visits(self, queue, new_visits=()):
+        """Insert the new and update the extended visits in one transaction.
+
+        queue maps the keys of the visits to their expiry times, new_visits
+        is the set of the keys of the visits not in the database yet.
+
+        """
+        visit_class = sovisit.visit_class
+        now = datetime.now()
+        inserts = [dict(visit_key=key, created=now, expiry=queue[key])
+                   for key in new_visits]
+        updates = [key for key in queue if key not in new_visits]
+        with transaction(write=True):
+            insert_many(visit_class, inserts)
+            conn = visit_class._connection
+            for start in xrange(0, len(updates), BATCH_SIZE):
+                keys = updates[start:start + BATCH_SIZE]
+                expiry = ' '.join(["CASE %s" % conn.sqlrepr(
+                    visit_class.q.visit_key)] + ["WHEN %s THEN %s" % (
+                    conn.sqlrepr(key), conn.sqlrepr(queue[key]))
+                    for key in keys] + ["END"])
+                conn.query(conn.sqlrepr(Update(visit_class.sqlmeta.table,
+                    {visit_class.q.expiry.fieldName: SQLConstant(expiry)},
+                    where=IN(visit_class.q.visit_key, keys))))
+        log.debug("%d new and %d updated visits written.",
+                  len(inserts), len(updates))
+
+
+def _held_visits():
+    """Return the keys of the visits the running visit manager has to write.
+
+    Their expiry times in the database may be over although they have been
+    extended meanwhile.
+
+    """
+    manager = api._manager
+    if manager is None:
+        return set()
+    manager.lock.acquire()
+    try:
+        return set(manager.queue) | set(getattr(manager, 'flushing', ()))
+    finally:
+        manager.lock.release()
+
+
+def cleanup_visits(batch_size=BATCH_SIZE):
+    """Delete expired visits and the identity links of these visits.
+
+    Rows are deleted in batches of at most batch_size visits, each batch in
+    its own transaction. Visits which the running visit manager has
+    extended but not written yet are kept. Returns the number of deleted
+    visits.
+
+    """
+    visit_class = sovisit.visit_class
+    if visit_class is None:
+        from mse.model import Visit as visit_class
+    count = 0
+    now = datetime.now()
+    held = _held_visits()
+    last = None
+    while True:
+        with transaction(write=True):
+            conn = visit_class._connection
+            where = visit_class.q.expiry < now
+            if last is not None:
+                where = AND(where, visit_class.q.visit_key > last)
+            keys = [row[0] for row in conn.queryAll(conn.sqlrepr(
+                Select(visit_class.q.visit_key, where=where,
+                       orderBy=visit_class.q.visit_key, limit=batch_size)))]
+            expired = [key for key in keys if key not in held]
+            if expired:
+                VisitIdentity.deleteMany(
+                    IN(VisitIdentity.q.visit_key, expired))
+                # the expiry time may have been written meanwhile
+                visit_class.deleteMany(AND(
+                    IN(visit_class.q.visit_key, expired),
+                    visit_class.q.expiry < now))
+        count += len(expired)
+        if len(keys) < batch_size:
+            break
+        last = keys[-1]
+    if count:
+        log.info("%d expired visits deleted.", count)
+    return count
+
+
+def schedule_cleanup():
+    """Run cleanup_visits every 'visit.cleanup_interval' minutes.
+
+    This is meant to be registered in turbogears.startup.call_on_startup.
+
+    """
+    interval = config.get('visit.cleanup_interval', 60) * 60
+    if interval > 0:
+        scheduler.add_interval_task(action=cleanup_visits,
+            taskname='cleanup_visits', interval=interval,
+            initialdelay=interval)
@@ -102,6 +102,18 @@ setup(
             'start-mse = mse.command:start',
             # See the mse.command.bootstrap function for details
             'bootstrap-mse = mse.command:bootstrap',
+            # See the mse.command.archive function for details
+            'archive-mse = mse.command:archive',
+            # See the mse.command.build_assets function for details
+            'build-assets-mse = mse.command:build_assets',
+            # See the mse.command.loadtest function for details
+            'loadtest-mse = mse.command:loadtest',
+            # See the mse.command.publish_database function for details
+            'publish-db-mse = mse.command:publish_database',
+            # See the mse.command.import_report function for details
+            'import-report-mse = mse.command:import_report',
+            # See the mse.command.batch_search function for details
+            'batch-mse = mse.command:batch_search',
         ],
     },
     cmdclass={